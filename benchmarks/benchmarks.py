@@ -0,0 +1,185 @@
+"""Benchmarks of the plugin pipelines run with airspeed velocity (asv)
+
+Each benchmark runs a SDictWorker without the napari viewer on the C. elegans
+sample, cropped or padded to a matrix of 2D and 3D sizes. asv records the wall
+time (time_), the peak resident memory (peakmem_) and the throughput in voxels
+per second (track_). The combinations that cannot run, or that are too slow,
+are left out of the `params` lists of the suites.
+
+Usage::
+
+    asv run                      # benchmark the current commit
+    asv run v1.0.1..main         # benchmark the commits of a release range
+    asv compare v1.0.1 main      # show the regressions between two commits
+    asv publish && asv preview   # browse the history of the results
+
+"""
+import time
+
+import numpy as np
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._cache import SPSFCache
+from napari_sdeconv._dict_worker import SDictWorker
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._sample_data import make_sample_data
+
+sizes = {
+    "2d-128": (128, 128),
+    "2d-256": (256, 256),
+    "2d-512": (512, 512),
+    "3d-16x128": (16, 128, 128),
+    "3d-32x256": (32, 256, 256),
+}
+
+
+def sample_image(size):
+    """Crop or reflect pad the C. elegans sample to a 2D or 3D shape
+
+    The 3D images are stacks of the sample weighted by a Gaussian axial profile
+    """
+    shape = sizes[size]
+    image = make_sample_data()[0][0]
+    pad = [
+        (max(0, (target - length + 1) // 2),) * 2
+        for target, length in zip(shape[-2:], image.shape)
+    ]
+    image = np.pad(image, pad, mode="reflect")
+    start = [
+        (length - target) // 2
+        for length, target in zip(image.shape, shape[-2:])
+    ]
+    image = image[
+        start[0] : start[0] + shape[-2], start[1] : start[1] + shape[-1]
+    ]
+    if len(shape) == 3:
+        z = np.arange(shape[0]) - shape[0] // 2
+        profile = np.exp(-(z**2) / (2 * (shape[0] / 6) ** 2))
+        image = profile[:, None, None] * image[None]
+    return np.ascontiguousarray(image, dtype=np.float32)
+
+
+def gaussian_psf(ndim):
+    """Gaussian PSF of the deconvolution benchmarks"""
+    if ndim == 2:
+        return SPSFGaussian((1.5, 1.5), (13, 13))().numpy()
+    return SPSFGaussian((1.5, 1.5, 1.5), (11, 13, 13))().numpy()
+
+
+def default_inputs(metadata):
+    """Default values of the inputs of a plugin"""
+    return {
+        key: value.get("default") for key, value in metadata["inputs"].items()
+    }
+
+
+def run_worker(name, inputs):
+    """Run a plugin worker without the viewer and return its outputs"""
+    metadata = get_metadata(name)
+    state = {
+        "name": name,
+        "label": metadata["label"],
+        "inputs": {**default_inputs(metadata), **inputs},
+        "outputs": {
+            key: dict(value) for key, value in metadata["outputs"].items()
+        },
+    }
+    worker = SDictWorker(metadata)
+    worker.set_state(state)
+    worker.run()
+    return worker.state()["outputs"]
+
+
+class _DeconvolutionBenchmark:
+    """Deconvolution benchmarks of the plugins and sizes of `params`"""
+
+    param_names = ["algorithm", "size"]
+    number = 1
+    repeat = (1, 3, 120.0)
+    timeout = 1200
+
+    def setup(self, name, size):
+        self.image = sample_image(size)
+        self.inputs = {
+            "image": self.image,
+            "psf": gaussian_psf(self.image.ndim),
+        }
+
+    def time_run(self, name, size):
+        run_worker(name, self.inputs)
+
+    def peakmem_run(self, name, size):
+        run_worker(name, self.inputs)
+
+    def track_voxels_per_second(self, name, size):
+        start = time.perf_counter()
+        run_worker(name, self.inputs)
+        return self.image.size / (time.perf_counter() - start)
+
+    track_voxels_per_second.unit = "voxels/s"
+
+
+class DeconvolutionSuite(_DeconvolutionBenchmark):
+    """Wiener, Richardson-Lucy and Spitfire deconvolutions"""
+
+    params = (
+        ["SWiener", "SRichardsonLucy", "Spitfire"],
+        [size for size in sizes if size != "3d-32x256"],
+    )
+
+
+class LargeDeconvolutionSuite(_DeconvolutionBenchmark):
+    """Wiener and Richardson-Lucy deconvolutions of the largest size. Spitfire
+    takes several minutes per run on a CPU at this size"""
+
+    params = (["SWiener", "SRichardsonLucy"], ["3d-32x256"])
+
+
+class _PSFBenchmark:
+    """PSF generator benchmarks of the generators and sizes of `params`. The
+    PSF cache is cleared before each run"""
+
+    param_names = ["generator", "size"]
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 600
+
+    def setup(self, name, size):
+        shape = sizes[size]
+        self.shape = shape if len(shape) == 3 else (1,) + shape
+        self.inputs = {"shape": list(self.shape)}
+        if name == "SPSFGaussian":
+            self.inputs["sigma"] = [1.5 if len(shape) == 3 else 0, 1.5, 1.5]
+        SPSFCache.instance().clear()
+
+    def _run(self, name):
+        SPSFCache.instance().clear()
+        run_worker(name, self.inputs)
+
+    def time_run(self, name, size):
+        self._run(name)
+
+    def peakmem_run(self, name, size):
+        self._run(name)
+
+    def track_voxels_per_second(self, name, size):
+        start = time.perf_counter()
+        self._run(name)
+        return int(np.prod(self.shape)) / (time.perf_counter() - start)
+
+    track_voxels_per_second.unit = "voxels/s"
+
+
+class PSFSuite(_PSFBenchmark):
+    """Gaussian and Gibson-Lanni PSF generators in 3D"""
+
+    params = (
+        ["SPSFGaussian", "SPSFGibsonLanni"],
+        ["3d-16x128", "3d-32x256"],
+    )
+
+
+class PSF2DSuite(_PSFBenchmark):
+    """Gaussian PSF generator in 2D. The Gibson-Lanni model is 3D only"""
+
+    params = (["SPSFGaussian"], ["2d-128", "2d-256"])
@@ -1,9 +1,28 @@
 __version__ = "1.0.0"
-from ._sample_data import make_sample_data
-from ._sdeconv_widget import SWienerPlugin, SRichardsonLucyPlugin, SpitfirePlugin
 
 __all__ = (
-    'SWienerPlugin',
-    'SRichardsonLucyPlugin',
-    'SpitfirePlugin'
+    "make_sample_data",
+    "SWienerPlugin",
+    "SRichardsonLucyPlugin",
+    "SBlindRichardsonLucyPlugin",
+    "SpitfirePlugin",
 )
+
+# the widgets import Qt and napari: they are imported on first access so that
+# the command line interface (napari_sdeconv._cli) can run without them
+_lazy_attributes = {
+    "make_sample_data": "._sample_data",
+    "SWienerPlugin": "._sdeconv_widget",
+    "SRichardsonLucyPlugin": "._sdeconv_widget",
+    "SBlindRichardsonLucyPlugin": "._sdeconv_widget",
+    "SpitfirePlugin": "._sdeconv_widget",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        import importlib
+
+        module = importlib.import_module(_lazy_attributes[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,657 @@
+"""Batched deconvolution of frames sharing the same PSF
+
+The sdeconv functions deconvolve one 2D or 3D image and compute the PSF Fourier
+transform at each call. The classes of this module deconvolve a batch of frames
+[B, (Z), Y, X] in one tensor call with an OTF computed once for all the frames.
+
+Classes
+-------
+SIterationMonitor
+SBatchDeconv
+SBatchWiener
+SBatchRichardsonLucy
+SBatchSpitfire
+
+"""
+import copy
+import gc
+
+import numpy as np
+import torch
+from sdeconv.core import SSettings
+from sdeconv.deconv.spitfire import hv_loss, hv_loss_3d
+from sdeconv.deconv.wiener import laplacian_2d, laplacian_3d
+
+from ._cache import SPSFCache, SResumeCache
+from ._fft import padded_shape, padding_widths
+from ._precision import fft_dtype, storage_dtype, to_numpy, torch_dtype
+from ._profiling import profile_stage
+from ._tiling import fit_psf
+
+
+def _spatial_dims(ndim):
+    """Spatial dimensions of a batch tensor"""
+    return tuple(range(-ndim, 0))
+
+
+def _fftn(images, dims, out=None):
+    """Fourier transform of a batch, calculated in float32 for the half
+    precision types"""
+    return torch.fft.fftn(
+        images.to(fft_dtype(images.dtype)), dim=dims, out=out
+    )
+
+
+def _ifftn_real(spectrum, dims, dtype):
+    """Real part of the inverse Fourier transform of a batch, converted to a
+    data type"""
+    return torch.real(torch.fft.ifftn(spectrum, dim=dims)).to(dtype)
+
+
+def _pad_batch(images, widths, mode="reflect"):
+    """Padding of the spatial dimensions of a batch of frames
+
+    Parameters
+    ----------
+    images: torch.Tensor
+        Batch of frames [B, (Z), Y, X]
+    widths: list
+        (before, after) padding of each spatial dimension (see padding_widths)
+    mode: str
+        Padding strategy (reflect, replicate, zero). `off` is a reflection
+        padding
+
+    Returns
+    -------
+    the padded batch
+
+    """
+    if not any(before or after for before, after in widths):
+        return images
+    torch_mode = {"zero": "constant", "off": "reflect"}.get(mode, mode)
+    # the reflection padding is not implemented for the half precision types
+    padded = images.unsqueeze(1).to(fft_dtype(images.dtype))
+    remaining = [list(axis) for axis in widths]
+    while any(before or after for before, after in remaining):
+        # a reflection cannot be wider than the axis, so wide paddings are
+        # reflected repeatedly
+        step = []
+        for size, axis in zip(padded.shape[2:], remaining):
+            limit = size - 1 if torch_mode == "reflect" else max(axis)
+            step.append([min(width, limit) for width in axis])
+            axis[0] -= step[-1][0]
+            axis[1] -= step[-1][1]
+        torch_pad = tuple(width for axis in reversed(step) for width in axis)
+        padded = torch.nn.functional.pad(padded, torch_pad, mode=torch_mode)
+    return padded.squeeze(1).to(images.dtype)
+
+
+def _unpad_batch(images, widths):
+    """Remove the padding of the spatial dimensions of a batch of frames"""
+    if not any(before or after for before, after in widths):
+        return images
+    return images[
+        (slice(None),)
+        + tuple(
+            slice(before, size - after)
+            for size, (before, after) in zip(images.shape[1:], widths)
+        )
+    ]
+
+
+def _unpadded_monitor(monitor, widths):
+    """Wrap an iteration monitor to give it the estimate without the padding"""
+
+    def _monitor(iteration, niter, estimate, fraction=None):
+        monitor(iteration, niter, _unpad_batch(estimate, widths), fraction)
+
+    return _monitor
+
+
+def release_memory():
+    """Free the memory of the buffers released by a stopped run, and the
+    iteration states kept to resume the runs (see SResumeCache)"""
+    SResumeCache.instance().clear()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def relative_change(previous, current):
+    """Relative change between two estimates of the deconvolved batch"""
+    norm = torch.linalg.vector_norm(previous)
+    if norm == 0:
+        return float("inf")
+    return float(torch.linalg.vector_norm(current - previous) / norm)
+
+
+class SIterationMonitor:
+    """Follow the iterations of a batched deconvolution
+
+    The monitor is called after each iteration. It reports the progress of the
+    whole run and sends a preview of the first frame of the batch every `every`
+    iterations. The progress of the batch is the fraction of its iterations, or
+    the fraction given by an algorithm that stops on a convergence criterion
+
+    Parameters
+    ----------
+    progress: callable
+        Called with the progress of the run in [0, 1]
+    preview: callable
+        Called with the current estimate of the first frame of the batch as a
+        numpy array
+    every: int
+        Number of iterations between two previews. 0 disables the preview
+    token: SCancelToken
+        Cancellation token checked after each iteration
+
+    """
+
+    def __init__(self, progress=None, preview=None, every=0, token=None):
+        self.progress = progress
+        self.preview = preview
+        self.every = every
+        self.token = token
+        self.start = 0.0
+        self.span = 1.0
+
+    def set_batch(self, index, count):
+        """Set the part of the run covered by the current batch"""
+        self.start = index / count
+        self.span = 1 / count
+
+    def __call__(self, iteration, niter, estimate, fraction=None):
+        if self.token is not None:
+            self.token.check()
+        if self.progress is not None:
+            if fraction is None:
+                fraction = iteration / max(1, niter)
+            self.progress(self.start + self.span * min(1.0, fraction))
+        if (
+            self.preview is not None
+            and self.every > 0
+            and iteration % self.every == 0
+        ):
+            self.preview(to_numpy(estimate[0]).copy())
+
+
+class SBatchDeconv:
+    """Interface for a batched deconvolution
+
+    The batch deconvolution is called like a sdeconv function where the PSF is
+    replaced by the OTF calculated with the `otf` method. `stage` is the name
+    of the `deconv` stage in the run profile. The `compute_type` parameter
+    (float32, float64, bfloat16) sets the data type of the tensors of the
+    computation. The frames are padded by `pad` and to the next 5-smooth size
+    with the `fft_padding` strategy (see padding_widths). The OTF can also be a
+    batch of OTFs [B, (Z), Y, X], one per frame (ex: the interpolated OTFs of a
+    spatially varying PSF)
+
+    The iterative algorithms accept a `state` dictionary. They resume from the
+    state of a previous run of the batch when it holds one, and store their
+    final state in it. With `more_iterations`, a resumed run makes this number
+    of iterations instead of stopping at the usual criteria
+    """
+
+    stage = "fft"
+
+    def otf(self, psf, frame_shape, **params):
+        """Calculate the OTF of the PSF for the padded frames
+
+        Parameters
+        ----------
+        psf: np.ndarray
+            Point spread function
+        frame_shape: tuple
+            Shape of one frame
+        params: dict
+            Parameters of the deconvolution
+
+        Returns
+        -------
+        the OTF as a complex torch.Tensor, in double precision for the float64
+        precision
+
+        """
+        widths = padding_widths(
+            frame_shape,
+            params.get("pad", 0),
+            params.get("fft_padding", "reflect"),
+        )
+        shape = padded_shape(frame_shape, widths)
+        dtype = fft_dtype(torch_dtype(params.get("compute_type", "float32")))
+        with profile_stage("fft"):
+            psf = torch.tensor(fit_psf(psf, shape), dtype=dtype)
+            psf = psf / torch.sum(psf)
+            dims = _spatial_dims(psf.ndim)
+            psf = torch.roll(psf, [-(size // 2) for size in shape], dims=dims)
+            return torch.fft.fftn(psf, dim=dims).to(
+                SSettings.instance().device
+            )
+
+    def __call__(
+        self,
+        images,
+        otf,
+        monitor=None,
+        compute_type="float32",
+        fft_padding="reflect",
+        **params
+    ):
+        """Deconvolve a batch of frames
+
+        Parameters
+        ----------
+        images: np.ndarray
+            Batch of frames [B, (Z), Y, X]
+        otf: torch.Tensor
+            OTF calculated with the `otf` method
+        monitor: SIterationMonitor
+            Monitor called after each iteration of the iterative algorithms
+        compute_type: str
+            Precision of the computation (float32, float64, bfloat16)
+        fft_padding: str
+            Padding strategy to the next fast FFT size (reflect, replicate,
+            zero, off)
+        params: dict
+            Parameters of the deconvolution
+
+        Returns
+        -------
+        the deconvolved frames as a numpy array with the storage type of the
+        compute type
+
+        """
+        with profile_stage("dtype conversion"):
+            images = torch.tensor(
+                np.asarray(images),
+                dtype=torch_dtype(compute_type),
+                device=SSettings.instance().device,
+            )
+        widths = padding_widths(
+            images.shape[1:], params.get("pad", 0), fft_padding
+        )
+        if monitor is not None:
+            monitor = _unpadded_monitor(monitor, widths)
+        with profile_stage("padding"):
+            images = _pad_batch(images, widths, fft_padding)
+        with profile_stage(self.stage):
+            out = self.deconv(images, otf, monitor=monitor, **params)
+        with profile_stage("copy back"):
+            return to_numpy(_unpad_batch(out, widths)).astype(
+                storage_dtype(compute_type), copy=False
+            )
+
+    def deconv(self, images, otf, monitor=None, **params):
+        """Deconvolve a batch of padded frames
+
+        Parameters
+        ----------
+        images: torch.Tensor
+            Batch of padded frames [B, (Z), Y, X]
+        otf: torch.Tensor
+            OTF of the PSF
+        monitor: callable
+            Called with (iteration, number of iterations, estimate, fraction)
+            after each iteration. The fraction is the progress of an algorithm
+            stopping on a convergence criterion, or None
+        params: dict
+            Parameters of the deconvolution
+
+        Returns
+        -------
+        the deconvolved batch as a torch.Tensor
+
+        """
+        raise NotImplementedError()
+
+
+class SBatchWiener(SBatchDeconv):
+    """Batched Wiener deconvolution with a Laplacian regularization
+
+    The Laplacian operators are the ones of swiener, so that a batch gives the
+    result of swiener on each frame. The OTF of the Laplacian is cached for
+    each frame shape
+    """
+
+    @staticmethod
+    def _laplacian_otf(shape, device, dtype):
+        """OTF of the discrete Laplacian operator"""
+        key = ("laplacian", tuple(shape), str(dtype), str(device))
+        return SPSFCache.instance().get(
+            key,
+            lambda: SBatchWiener._compute_laplacian_otf(shape, device, dtype),
+        )
+
+    @staticmethod
+    def _compute_laplacian_otf(shape, device, dtype):
+        """Calculate the OTF of the discrete Laplacian operator"""
+        laplacian = laplacian_2d if len(shape) == 2 else laplacian_3d
+        return torch.fft.fftn(laplacian(tuple(shape)).to(device, dtype))
+
+    def deconv(self, images, otf, monitor=None, beta=1e-5, pad=0):
+        dims = _spatial_dims(images.ndim - 1)
+        fft_laplacian = self._laplacian_otf(
+            otf.shape[-len(dims) :], otf.device, otf.real.dtype
+        )
+        den = otf * torch.conj(otf) + beta * fft_laplacian * torch.conj(
+            fft_laplacian
+        )
+        fft_images = _fftn(images, dims)
+        return _ifftn_real(
+            fft_images * torch.conj(otf) / den, dims, images.dtype
+        )
+
+
+def mirror_otf(otf, ndim):
+    """OTF of the mirrored PSF used by srichardsonlucy
+
+    srichardsonlucy mirrors the centered PSF along its first two axes, which
+    also shifts it by one pixel along these axes. The mirror is calculated
+    from the OTF: the Fourier transform of x[N - 1 - n] is
+    exp(2i pi k / N) conj(X[k]) for a real x
+
+    Parameters
+    ----------
+    otf: torch.Tensor
+        OTF of a PSF, or batch of OTFs [B, (Z), Y, X]
+    ndim: int
+        Number of spatial dimensions of the OTF
+
+    Returns
+    -------
+    the OTF of the mirrored PSF
+
+    """
+    mirror = torch.conj(otf)
+    for dim in _spatial_dims(ndim)[:2]:
+        size = otf.shape[dim]
+        shape = [1] * otf.ndim
+        shape[dim] = size
+        frequencies = torch.arange(
+            size, dtype=otf.real.dtype, device=otf.device
+        )
+        phase = torch.exp(2j * np.pi * frequencies / size)
+        mirror = mirror * phase.reshape(shape)
+    return mirror
+
+
+class SBatchRichardsonLucy(SBatchDeconv):
+    """Batched Richardson-Lucy deconvolution
+
+    The adjoint of the PSF is the mirrored PSF of srichardsonlucy (see
+    mirror_otf), so that a batch gives the result of srichardsonlucy on each
+    frame. The iterations stop before `niter` when the relative change of the
+    estimate is lower than `tolerance`. The Fourier transforms of the
+    iterations are calculated in place in one complex workspace allocated for
+    the batch. A run resumes from the estimate of a previous run with at most
+    `niter` iterations
+    """
+
+    stage = "iterations"
+
+    def deconv(
+        self,
+        images,
+        otf,
+        monitor=None,
+        niter=30,
+        pad=0,
+        tolerance=0,
+        state=None,
+        more_iterations=0,
+    ):
+        dims = _spatial_dims(images.ndim - 1)
+        adjoint_otf = mirror_otf(otf, len(dims))
+        out = images.detach().clone()
+        start = 0
+        converged = False
+        if state and (more_iterations > 0 or state["iteration"] <= niter):
+            out, start = state["estimate"], state["iteration"]
+            # a run stopped by the tolerance is not continued with the same
+            # tolerance
+            converged = (
+                more_iterations == 0
+                and state["converged"]
+                and 0 < state["tolerance"] <= tolerance
+            )
+        stop = (
+            start
+            if converged
+            else start + more_iterations
+            if more_iterations > 0
+            else niter
+        )
+        spectrum = torch.empty(
+            images.shape, dtype=otf.dtype, device=images.device
+        )
+        iteration = start
+        for i in range(start, stop):
+            previous = out
+            _fftn(out, dims, spectrum).mul_(otf)
+            blurred = torch.real(
+                torch.fft.ifftn(spectrum, dim=dims, out=spectrum)
+            ).to(out.dtype)
+            _fftn(images / blurred, dims, spectrum).mul_(adjoint_otf)
+            out = out * torch.real(
+                torch.fft.ifftn(spectrum, dim=dims, out=spectrum)
+            ).to(out.dtype)
+            iteration = i + 1
+            if monitor is not None:
+                monitor(iteration - start, stop - start, out)
+            if (
+                tolerance > 0
+                and more_iterations == 0
+                and relative_change(previous, out) < tolerance
+            ):
+                converged = True
+                break
+        if state is not None:
+            state.update(
+                estimate=out,
+                start=start,
+                iteration=iteration,
+                converged=converged,
+                tolerance=tolerance,
+            )
+        return out
+
+
+class SBatchSpitfire(SBatchDeconv):
+    """Batched Spitfire deconvolution
+
+    The frames are normalized independently and the Adam updates are element
+    wise. The loss of each frame is the loss of spitfire on the frame alone,
+    and the gradient of their sum is the gradient of each frame, so the frames
+    of a batch are deconvolved independently. The data term is calculated in
+    the Fourier domain with the OTF.
+
+    Each frame stops when its loss is stable (`precision`), when the relative
+    change of its estimate is lower than `tolerance` or, in 3D like the
+    sdeconv function, when its loss increases. A stopped frame is frozen while
+    the other frames of the batch continue. The progress is
+    estimated from the decrease of the change of the loss of each frame
+    towards the precision, on a log scale, instead of the maximum number of
+    iterations. A run resumes from the estimate and the optimizer state of a
+    previous run, and continues until its own stopping criteria
+    """
+
+    stage = "iterations"
+    max_iter = 2500
+
+    @staticmethod
+    def _losses(estimate, images, otf, dims, weight, delta, reg):
+        """Spitfire loss of each frame of a batch"""
+        blurred = _ifftn_real(
+            _fftn(estimate, dims) * otf, dims, estimate.dtype
+        )
+        data = torch.mean(torch.square(blurred - images), dim=dims)
+        if len(dims) == 3:
+            # the backward of the 3D data term of sdeconv omits the factor 2
+            # of the squared error: the loss is kept, its gradient is halved
+            data = 0.5 * data + 0.5 * data.detach()
+        if len(dims) == 2:
+            regularization = [
+                hv_loss(frame[None, None], weight) for frame in estimate
+            ]
+        else:
+            regularization = [
+                hv_loss_3d(frame[None, None], delta, weight)
+                for frame in estimate
+            ]
+        return reg * data + (1 - reg) * torch.stack(regularization)
+
+    @staticmethod
+    def _convergence(first, change, precision):
+        """Progress of the change of the loss of the frames towards the
+        precision, on a log scale"""
+        if precision <= 0:
+            return torch.zeros_like(change)
+        first = torch.clamp(first, min=precision)
+        change = torch.clamp(change, min=precision * 1e-3)
+        span = torch.log(first / precision)
+        return torch.where(
+            span > 0,
+            torch.clamp(
+                torch.log(first / change) / span.clamp(min=1e-12), 0, 1
+            ),
+            torch.ones_like(change),
+        )
+
+    def deconv(
+        self,
+        images,
+        otf,
+        monitor=None,
+        weight=0.6,
+        delta=1,
+        reg=0.995,
+        gradient_step=0.01,
+        precision=1e-7,
+        pad=0,
+        tolerance=0,
+        state=None,
+        more_iterations=0,
+    ):
+        dims = _spatial_dims(images.ndim - 1)
+        frames = len(images)
+        mini = torch.amin(images, dim=dims, keepdim=True) + 1e-5
+        maxi = torch.amax(images, dim=dims, keepdim=True)
+        images = (images - mini) / (maxi - mini)
+
+        resume = bool(state)
+        estimate = (state["estimate"] if resume else images).detach().clone()
+        estimate.requires_grad = True
+        optimizer = torch.optim.Adam([estimate], lr=gradient_step)
+        scheduler = torch.optim.lr_scheduler.StepLR(
+            optimizer, step_size=100, gamma=0.5
+        )
+        previous_loss = torch.full(
+            (frames,), float("inf"), dtype=torch.float64
+        )
+        count_eq = torch.zeros(frames, dtype=torch.int64)
+        converged = torch.zeros(frames, dtype=torch.bool)
+        first_change = None
+        start = 0
+        if resume:
+            # the moments are updated in place: the stored state is kept for a
+            # cancelled run
+            optimizer.load_state_dict(copy.deepcopy(state["optimizer"]))
+            scheduler.load_state_dict(state["scheduler"])
+            start = state["iteration"]
+            previous_loss = state["loss"].clone()
+            # the converged frames are continued only when a stopping
+            # criterion changes
+            if (
+                state["precision"] == precision
+                and state["tolerance"] == tolerance
+            ):
+                count_eq = state["count_eq"].clone()
+                if more_iterations == 0:
+                    converged = state["converged"].clone()
+        stop = (
+            start + more_iterations
+            if resume and more_iterations > 0
+            else self.max_iter
+        )
+        stopping = not resume or more_iterations == 0
+        progress = torch.where(converged, 1.0, 0.0).to(torch.float64)
+        iteration = start
+        for i in range(start, stop):
+            if stopping and bool(converged.all()):
+                break
+            optimizer.zero_grad()
+            losses = self._losses(
+                estimate, images, otf, dims, weight, delta, reg
+            )
+            values = losses.detach().cpu().to(torch.float64)
+            change = torch.abs(values - previous_loss)
+            # sdeconv stops a 3D run when the loss increases
+            increased = (
+                values > previous_loss
+                if len(dims) == 3
+                else torch.zeros_like(converged)
+            )
+            stable = change < precision
+            count_eq = torch.where(stable, count_eq + 1, 0)
+            previous_loss = torch.where(stable, previous_loss, values)
+            if stopping:
+                converged |= increased | (count_eq > 5)
+                if bool(converged.all()):
+                    break
+                if first_change is None and torch.isfinite(change).all():
+                    first_change = change
+                if first_change is not None:
+                    # the loss of a frame oscillates around the precision
+                    # before it is stable for 6 iterations
+                    progress = torch.maximum(
+                        progress,
+                        0.9
+                        * self._convergence(first_change, change, precision),
+                    )
+                progress[converged] = 1.0
+            frozen = converged.to(estimate.device).reshape(
+                (-1,) + (1,) * len(dims)
+            )
+            kept = estimate.detach().clone() if bool(converged.any()) else None
+            previous = (
+                estimate.detach().clone()
+                if tolerance > 0 and stopping
+                else None
+            )
+            losses[~converged.to(losses.device)].sum().backward()
+            optimizer.step()
+            scheduler.step()
+            if kept is not None:
+                with torch.no_grad():
+                    estimate.copy_(torch.where(frozen, kept, estimate))
+            iteration = i + 1
+            if previous is not None:
+                changes = torch.tensor(
+                    [
+                        relative_change(before, after)
+                        for before, after in zip(previous, estimate.detach())
+                    ]
+                )
+                converged |= changes < tolerance
+            if monitor is not None:
+                monitor(
+                    iteration - start,
+                    stop - start,
+                    (maxi - mini) * estimate.detach() + mini,
+                    float(progress.mean()) if stopping else None,
+                )
+        if state is not None:
+            state.update(
+                estimate=estimate.detach(),
+                optimizer=optimizer.state_dict(),
+                scheduler=scheduler.state_dict(),
+                start=start,
+                iteration=iteration,
+                loss=previous_loss,
+                count_eq=count_eq,
+                converged=converged,
+                precision=precision,
+                tolerance=tolerance,
+            )
+        return (maxi - mini) * estimate.detach() + mini
@@ -0,0 +1,182 @@
+"""Blind Richardson-Lucy deconvolution
+
+The image and the PSF are estimated together. The PSF starts from a Gaussian
+and each iteration updates the image with the current PSF, then the PSF with
+the updated image (Fish et al. 1995), with the Richardson-Lucy multiplicative
+updates. The spectra of the image and of the PSF are kept between the updates:
+each update transforms only the estimate it changes, so an iteration costs 8
+real Fourier transforms instead of recomputing the spectra of both estimates.
+The PSF is kept non negative, normalized and inside the support of the initial
+PSF.
+
+Functions
+---------
+sblind_richardson_lucy
+
+"""
+import numpy as np
+import torch
+from sdeconv.core import SSettings
+from sdeconv.psfs import spsf_gaussian
+
+from ._batch import _pad_batch, _unpad_batch
+from ._fft import padded_shape, padding_widths
+
+# lower bound of the blurred estimate, to divide the image by it
+_eps = 1e-12
+
+
+def _centered_kernel(kernel, shape):
+    """Kernel of the size of the image with its center at the origin"""
+    full = torch.zeros(shape, dtype=kernel.dtype, device=kernel.device)
+    full[tuple(slice(0, size) for size in kernel.shape)] = kernel
+    return torch.roll(
+        full,
+        [-(size // 2) for size in kernel.shape],
+        dims=tuple(range(len(shape))),
+    )
+
+
+def _crop_kernel(full, kernel_shape):
+    """Kernel of a given size centered at the origin of a kernel of the size of
+    the image"""
+    rolled = torch.roll(
+        full,
+        [size // 2 for size in kernel_shape],
+        dims=tuple(range(full.ndim)),
+    )
+    return rolled[tuple(slice(0, size) for size in kernel_shape)]
+
+
+def sblind_richardson_lucy(
+    image,
+    sigma=(1.5, 1.5, 1.5),
+    psf_size=(15, 15, 15),
+    niter=30,
+    pad=13,
+    observers=None,
+    token=None,
+):
+    """Estimate the deconvolved image and the PSF of a 2D or 3D image
+
+    Parameters
+    ----------
+    image: np.ndarray
+        Blurry image [(Z), Y, X]
+    sigma: tuple
+        Standard deviation of the initial Gaussian PSF in each direction. The
+        last values are used for a 2D image
+    psf_size: tuple
+        Size of the estimated PSF in each direction
+    niter: int
+        Number of iterations. Each iteration updates the image and the PSF
+    pad: int
+        Padding to avoid spectrum artifacts
+    observers: list
+        Observers notified of the progress with `progress(int)`
+    token: SCancelToken
+        Cancellation token checked at each iteration
+
+    Returns
+    -------
+    (image, psf) the deconvolved image and the estimated PSF as numpy arrays
+
+    """
+    image = torch.tensor(np.asarray(image, dtype=np.float32))
+    ndim = image.ndim
+    if ndim not in (2, 3):
+        raise ValueError(
+            "Blind Richardson-Lucy can only deblur 2D or 3D images"
+        )
+    device = SSettings.instance().device
+    widths = padding_widths(image.shape, pad)
+    observed = _pad_batch(image[None].to(device), widths)[0].clamp_min(0)
+    shape = padded_shape(image.shape, widths)
+    dims = tuple(range(ndim))
+    psf_size = tuple(
+        min(int(size), full) for size, full in zip(psf_size[-ndim:], shape)
+    )
+
+    def rfftn(value):
+        return torch.fft.rfftn(value, dim=dims)
+
+    def irfftn(spectrum):
+        return torch.fft.irfftn(spectrum, s=shape, dim=dims)
+
+    def ratio_spectrum(image_spectrum, psf_spectrum):
+        """Spectrum of the observed image divided by the blurred estimate"""
+        blurred = irfftn(image_spectrum * psf_spectrum).clamp_min(_eps)
+        return rfftn(observed / blurred)
+
+    initial = spsf_gaussian(tuple(sigma[-ndim:]), psf_size).to(
+        device, torch.float32
+    )
+    support = _centered_kernel(torch.ones(psf_size, device=device), shape)
+    psf = _centered_kernel(initial / initial.sum(), shape)
+
+    # the image estimate starts flat so that the blur is not attributed to the
+    # image
+    estimate = torch.full_like(observed, float(observed.mean()))
+    image_spectrum = rfftn(estimate)
+    psf_spectrum = rfftn(psf)
+    for iteration in range(niter):
+        if token is not None:
+            token.check()
+        # image update with the current PSF
+        ratio = ratio_spectrum(image_spectrum, psf_spectrum)
+        estimate = estimate * irfftn(ratio * psf_spectrum.conj())
+        image_spectrum = rfftn(estimate)
+        # PSF update with the updated image
+        ratio = ratio_spectrum(image_spectrum, psf_spectrum)
+        psf = (psf * irfftn(ratio * image_spectrum.conj())).clamp_min(
+            0
+        ) * support
+        psf = psf / psf.sum()
+        psf_spectrum = rfftn(psf)
+        for observer in observers or []:
+            observer.progress(int(100 * (iteration + 1) / niter))
+
+    estimate = _unpad_batch(estimate[None], widths)[0]
+    return estimate.cpu().numpy(), _crop_kernel(psf, psf_size).cpu().numpy()
+
+
+metadata = {
+    "name": "SBlindRichardsonLucy",
+    "label": "Blind Richardson-Lucy",
+    "fnc": sblind_richardson_lucy,
+    "inputs": {
+        "image": {"type": "Image", "label": "Image", "help": "Input image"},
+        "sigma": {
+            "type": "zyx_float",
+            "label": "Initial sigma",
+            "help": "Standard deviation of the initial Gaussian PSF in each "
+            "direction",
+            "default": [1.5, 1.5, 1.5],
+        },
+        "psf_size": {
+            "type": "zyx_int",
+            "label": "PSF size",
+            "help": "Size of the estimated PSF in each direction",
+            "default": [15, 15, 15],
+        },
+        "niter": {
+            "type": "int",
+            "label": "niter",
+            "help": "Number of iterations. Each iteration updates the image "
+            "and the PSF",
+            "default": 30,
+            "range": (0, 999999),
+        },
+        "pad": {
+            "type": "int",
+            "label": "Padding",
+            "help": "Padding to avoid spectrum artifacts",
+            "default": 13,
+            "range": (0, 999999),
+        },
+    },
+    "outputs": {
+        "image": {"type": "Image", "label": "Blind Richardson-Lucy"},
+        "psf": {"type": "Image", "label": "Blind Richardson-Lucy PSF"},
+    },
+}
@@ -0,0 +1,306 @@
+"""Process wide cache of the generated PSFs and of their OTFs, and of the
+states of the iterative deconvolutions resumed by the next runs
+
+Classes
+-------
+SLRUCache
+SPSFCache
+SResumeCache
+
+Functions
+---------
+array_digest
+cached_psf
+cached_otf
+cache_message
+
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def freeze(value):
+    """Convert a parameter value into a hashable key
+
+    Parameters
+    ----------
+    value: object
+        Parameter value (number, str, list, tuple, dict)
+
+    Returns
+    -------
+    a hashable version of the value
+
+    """
+    if isinstance(value, dict):
+        return tuple(
+            sorted((key, freeze(item)) for key, item in value.items())
+        )
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# size of the pieces of an array passed to the hash function
+_chunk_bytes = 16 * 1024 * 1024
+
+
+def _hasher():
+    """Hash function of the array contents: xxh3 when xxhash is installed, else
+    blake2b"""
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def _contiguous_pieces(array):
+    """Split an array into C contiguous views, copying only the rows of a
+    strided last axis"""
+    if array.flags.c_contiguous:
+        yield array
+    elif array.ndim <= 1:
+        yield np.ascontiguousarray(array)
+    else:
+        for sub_array in array:
+            yield from _contiguous_pieces(sub_array)
+
+
+def array_digest(array):
+    """Hash the content of an array without copying it
+
+    The data are hashed by pieces of 16 MB with xxh3 when the xxhash package is
+    installed, and with blake2b otherwise. A non contiguous array (ex: a slice)
+    is hashed view by view
+
+    Parameters
+    ----------
+    array: np.ndarray
+        Array to hash
+
+    Returns
+    -------
+    str digest of the array shape, dtype and data
+
+    """
+    array = np.asarray(array)
+    digest = _hasher()
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    for piece in _contiguous_pieces(array):
+        data = memoryview(piece.reshape(-1)).cast("B")
+        for start in range(0, len(data), _chunk_bytes):
+            digest.update(data[start : start + _chunk_bytes])
+    return digest.hexdigest()
+
+
+def nbytes(value):
+    """Size in bytes of a numpy array or torch tensor, or of the arrays of a
+    dict, list or tuple"""
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    if hasattr(value, "element_size"):
+        return value.element_size() * value.nelement()
+    return np.asarray(value).nbytes
+
+
+class SLRUCache:
+    """Least recently used cache bounded in bytes
+
+    The cache can be shared between the workers threads. A value is computed
+    outside of the lock so two threads missing the same key at the same time
+    both compute it
+
+    Parameters
+    ----------
+    max_bytes: int
+        Maximum size of the cached values in bytes
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Size of the cached values in bytes"""
+        return self._size
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, compute):
+        """Get a cached value, or compute and cache it
+
+        Parameters
+        ----------
+        key: tuple
+            Hashable key of the value
+        compute: callable
+            Function without argument that computes the value on a cache miss
+
+        Returns
+        -------
+        the cached value
+
+        """
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key][0]
+            self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Add a value to the cache and evict the least recently used values"""
+        size = nbytes(value)
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        """Remove all the cached values and reset the counters"""
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class SPSFCache:
+    """Singleton caching the generated PSFs and the OTFs used by the batched
+    deconvolutions
+
+    PSFs are keyed by the generator name and parameters. OTFs are keyed by the
+    batched algorithm, the PSF content, the frame shape, the padding and the
+    precision
+    """
+
+    __instance = None
+
+    max_bytes = 512 * 1024 * 1024
+
+    @staticmethod
+    def instance():
+        """Static access to the cache"""
+        if SPSFCache.__instance is None:
+            SPSFCache.__instance = SLRUCache(SPSFCache.max_bytes)
+        return SPSFCache.__instance
+
+
+class SResumeCache:
+    """Singleton keeping the states of the last iterative deconvolutions
+
+    The state of a batch of frames (the estimate, and the optimizer of
+    Spitfire) is keyed by the content of the inputs, the parameters that are
+    not stopping criteria and the batch index, so that a run with more
+    iterations resumes from it
+    """
+
+    __instance = None
+
+    max_bytes = 1024 * 1024 * 1024
+
+    @staticmethod
+    def instance():
+        """Static access to the cache"""
+        if SResumeCache.__instance is None:
+            SResumeCache.__instance = SLRUCache(SResumeCache.max_bytes)
+        return SResumeCache.__instance
+
+
+def cached_psf(name, fnc, params):
+    """Generate a PSF or get it from the cache
+
+    Parameters
+    ----------
+    name: str
+        Name of the PSF generator
+    fnc: callable
+        PSF generator function
+    params: dict
+        Parameters of the generator
+
+    Returns
+    -------
+    the PSF as a read only numpy array
+
+    """
+
+    def compute():
+        psf = fnc(**params)
+        if hasattr(psf, "detach"):
+            psf = psf.detach().cpu().numpy()
+        psf.setflags(write=False)
+        return psf
+
+    return SPSFCache.instance().get(("psf", name, freeze(params)), compute)
+
+
+def cached_otf(batch, psf, frame_shape, params):
+    """Calculate an OTF or get it from the cache
+
+    Parameters
+    ----------
+    batch: SBatchDeconv
+        Batched deconvolution computing the OTF
+    psf: np.ndarray
+        Point spread function
+    frame_shape: tuple
+        Shape of one frame
+    params: dict
+        Parameters of the deconvolution
+
+    Returns
+    -------
+    the OTF
+
+    """
+    key = (
+        "otf",
+        type(batch).__name__,
+        array_digest(psf),
+        tuple(frame_shape),
+        params.get("pad", 0),
+        params.get("fft_padding", "reflect") == "off",
+        params.get("compute_type"),
+        np.asarray(psf).dtype.str,
+    )
+    return SPSFCache.instance().get(
+        key, lambda: batch.otf(psf, frame_shape, **params)
+    )
+
+
+def cache_message():
+    """Summary of the cache usage for the log area"""
+    cache = SPSFCache.instance()
+    return (
+        f"PSF cache: {cache.hits} hits, {cache.misses} misses, "
+        f"{len(cache)} items, "
+        f"{cache.size / 1e6:.1f} / {cache.max_bytes / 1e6:.0f} MB"
+    )
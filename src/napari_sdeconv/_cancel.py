@@ -0,0 +1,39 @@
+"""Cancellation of a running deconvolution
+
+Classes
+-------
+SCancelledError
+SCancelToken
+
+"""
+import threading
+
+
+class SCancelledError(Exception):
+    """Raised in the worker thread when the run has been cancelled"""
+
+
+class SCancelToken:
+    """Thread safe flag checked by the worker between iterations, blocks and
+    frames"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        """True if the cancellation has been requested"""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Request the cancellation of the run"""
+        self._event.set()
+
+    def reset(self):
+        """Clear the cancellation request before a new run"""
+        self._event.clear()
+
+    def check(self):
+        """Raise SCancelledError if the cancellation has been requested"""
+        if self._event.is_set():
+            raise SCancelledError("The run has been cancelled")
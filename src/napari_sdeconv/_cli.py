@@ -0,0 +1,404 @@
+"""Command line interface running a saved plugin state on image files
+
+The `napari-sdeconv` command applies the state saved from a plugin widget (JSON
+or YAML) to TIFF, Zarr and npy files. It does not import Qt or napari.
+Example::
+
+    napari-sdeconv wiener.json "data/*.tif" -o results -j 4
+
+Image inputs other than the processed image (ex: the PSF) are given in the
+state as a file path relative to the state file, or as a nested PSF generator
+state::
+
+    {"name": "SWiener",
+     "inputs": {"psf": {"name": "SPSFGaussian",
+                        "inputs": {"sigma": [0, 1.5, 1.5]}},
+                "beta": 1e-5, "pad": 13}}
+
+A manifest in the output directory records the processed files, so a restarted
+command skips the files already processed with the same state. The image
+inputs of the state are compared by content: a PSF file replaced at the same
+path processes the files again
+
+Classes
+-------
+SManifest
+
+Functions
+---------
+build_state
+process_file
+main
+
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from ._io import find_images, load_state, read_image, write_image
+from ._lazy import is_lazy
+from ._metadata import get_metadata
+from ._profiling import SStageProfiler
+from ._result_cache import result_key
+from ._runner import SDictRunner
+
+manifest_name = "napari-sdeconv-manifest.jsonl"
+
+
+def _image_inputs(metadata):
+    """Keys of the image inputs of a plugin"""
+    return [
+        key
+        for key, value in metadata["inputs"].items()
+        if value["type"] == "Image"
+    ]
+
+
+def build_state(state, base_dir="."):
+    """Create the state run by a SDictRunner from a saved state
+
+    The missing inputs are set to their default value. The image inputs given
+    as a file path are read, and the ones given as a plugin state are computed.
+    The first image input of the plugin is left empty: it is set for each
+    processed file
+
+    Parameters
+    ----------
+    state: dict
+        Saved state with the plugin `name` and the `inputs` values
+    base_dir: str
+        Directory of the relative file paths of the state
+
+    Returns
+    -------
+    (metadata, state) of the plugin
+
+    """
+    metadata = get_metadata(state["name"])
+    images = _image_inputs(metadata)
+    inputs = {}
+    for key, value in metadata["inputs"].items():
+        inputs[key] = state["inputs"].get(key, value.get("default"))
+        if key not in images[:1] and value["type"] == "Image":
+            if isinstance(inputs[key], dict):
+                sub_metadata, sub_state = build_state(inputs[key], base_dir)
+                sub_state = SDictRunner(sub_metadata).run(sub_state)
+                inputs[key] = next(iter(sub_state["outputs"].values()))["data"]
+            elif isinstance(inputs[key], str):
+                inputs[key] = read_image(os.path.join(base_dir, inputs[key]))
+            else:
+                raise ValueError(
+                    f'The input {key} of {state["name"]} must be a file path '
+                    "or a plugin state"
+                )
+    outputs = state.get("outputs") or metadata["outputs"]
+    return metadata, {
+        "name": metadata["name"],
+        "label": metadata["label"],
+        "inputs": inputs,
+        "outputs": {key: dict(value) for key, value in outputs.items()},
+    }
+
+
+def state_key(state, base_dir="."):
+    """Digest of a saved state identifying the results in the manifest
+
+    The image inputs are read, or computed from their plugin state, and
+    hashed by content like the results of the result cache (see result_key)
+
+    Parameters
+    ----------
+    state: dict
+        Saved state with the plugin `name` and the `inputs` values
+    base_dir: str
+        Directory of the relative file paths of the state
+
+    Returns
+    -------
+    the str digest of the state
+
+    """
+    _, run_state = build_state(state, base_dir)
+    inputs = {
+        key: np.asarray(value) if is_lazy(value) else value
+        for key, value in run_state["inputs"].items()
+    }
+    return result_key(state["name"], inputs)
+
+
+def _file_key(path):
+    """Size and modification time of an input file or store"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SManifest:
+    """Record of the files processed in an output directory
+
+    The manifest is a JSON lines file. A line is appended when the results of a
+    file are written, so the manifest stays valid if the command is interrupted
+
+    Parameters
+    ----------
+    path: str
+        Path of the manifest file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._entries[entry["input"]] = entry
+
+    def is_done(self, input_path, key, outputs):
+        """Check if a file has already been processed with the same state
+
+        Parameters
+        ----------
+        input_path: str
+            Path of the input file
+        key: str
+            Digest of the state
+        outputs: list
+            Paths of the result files
+
+        Returns
+        -------
+        True if the results are up to date
+
+        """
+        entry = self._entries.get(os.path.abspath(input_path))
+        return (
+            entry is not None
+            and entry["state"] == key
+            and entry["file"] == _file_key(input_path)
+            and all(os.path.exists(path) for path in outputs)
+        )
+
+    def record(self, input_path, key, outputs):
+        """Add a processed file to the manifest"""
+        entry = {
+            "input": os.path.abspath(input_path),
+            "state": key,
+            "file": _file_key(input_path),
+            "outputs": outputs,
+        }
+        with self._lock:
+            self._entries[entry["input"]] = entry
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+
+def output_paths(input_path, output_dir, state, suffix="", extension=None):
+    """Paths of the results of an input file
+
+    Parameters
+    ----------
+    input_path: str
+        Path of the input file
+    output_dir: str
+        Directory of the results
+    state: dict
+        Saved state. A plugin with several outputs writes one file per output
+    suffix: str
+        Suffix added to the file name
+    extension: str
+        Extension of the results. None keeps the input extension
+
+    Returns
+    -------
+    list of the result paths
+
+    """
+    name = os.path.basename(input_path.rstrip("/\\"))
+    stem, ext = os.path.splitext(name)
+    ext = extension or ext
+    keys = list(state.get("outputs") or get_metadata(state["name"])["outputs"])
+    if len(keys) == 1:
+        return [os.path.join(output_dir, f"{stem}{suffix}{ext}")]
+    return [
+        os.path.join(output_dir, f"{stem}{suffix}_{key}{ext}") for key in keys
+    ]
+
+
+def process_file(state, base_dir, input_path, outputs, trace=False):
+    """Run a saved state on an image file and write the results
+
+    Parameters
+    ----------
+    state: dict
+        Saved state of the plugin
+    base_dir: str
+        Directory of the relative file paths of the state
+    input_path: str
+        Path of the image file
+    outputs: list
+        Paths of the result files
+    trace: bool
+        True to save the time and memory of the stages of the run next to the
+        first result
+
+    Returns
+    -------
+    the running time in seconds
+
+    """
+    start = time.perf_counter()
+    profiler = SStageProfiler()
+    with profiler.activate():
+        metadata, run_state = build_state(state, base_dir)
+    with profiler.stage("read input"):
+        run_state["inputs"][_image_inputs(metadata)[0]] = read_image(
+            input_path
+        )
+    SDictRunner(metadata, profiler=profiler).run(run_state)
+    with profiler.stage("write output"):
+        for path, output in zip(outputs, run_state["outputs"].values()):
+            write_image(path, output["data"])
+    if trace:
+        profiler.save(f"{outputs[0]}.trace.json")
+    return time.perf_counter() - start
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="napari-sdeconv",
+        description="Run a plugin state saved from napari-sdeconv on TIFF, "
+        "Zarr or npy files",
+    )
+    parser.add_argument(
+        "state", help="JSON or YAML file of the saved plugin state"
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="Image files, directories or glob patterns"
+    )
+    parser.add_argument(
+        "-o", "--output", required=True, help="Directory of the results"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of files processed in parallel",
+    )
+    parser.add_argument(
+        "-s", "--suffix", default="", help="Suffix added to the result names"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("tif", "zarr", "npy"),
+        default=None,
+        help="Format of the results. Default is the input format",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Save the time and memory of each stage in a JSON file next to "
+        "each result",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Process all the files, even the ones recorded in the manifest",
+    )
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the napari-sdeconv command
+
+    Parameters
+    ----------
+    argv: list
+        Command line arguments. None uses sys.argv
+
+    Returns
+    -------
+    the exit code: 0 if all the files have been processed
+
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+    state = load_state(args.state)
+    if not _image_inputs(get_metadata(state["name"])):
+        parser.error(
+            f'the plugin {state["name"]} has no image input to process'
+        )
+    base_dir = os.path.dirname(os.path.abspath(args.state))
+    os.makedirs(args.output, exist_ok=True)
+    manifest = SManifest(os.path.join(args.output, manifest_name))
+    key = state_key(state, base_dir)
+    extension = f".{args.format}" if args.format else None
+
+    files = find_images(args.inputs)
+    todo = []
+    for path in files:
+        outputs = output_paths(
+            path, args.output, state, args.suffix, extension
+        )
+        if any(
+            os.path.abspath(output) == os.path.abspath(path)
+            for output in outputs
+        ):
+            print(
+                f"Skip {path}: the result would overwrite the input",
+                file=sys.stderr,
+            )
+        elif not args.overwrite and manifest.is_done(path, key, outputs):
+            print(f"Skip {path}: already processed")
+        else:
+            todo.append((path, outputs))
+    print(f"{len(todo)} of {len(files)} files to process")
+
+    failed = 0
+    if args.jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            args.jobs, mp_context=multiprocessing.get_context("spawn")
+        )
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+    with executor:
+        futures = {
+            executor.submit(
+                process_file, state, base_dir, path, outputs, args.trace
+            ): (path, outputs)
+            for path, outputs in todo
+        }
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            path, outputs = futures[future]
+            try:
+                duration = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                failed += 1
+                print(
+                    f"[{i + 1}/{len(todo)}] {path} failed: {err}",
+                    file=sys.stderr,
+                )
+                continue
+            manifest.record(path, key, outputs)
+            print(
+                f"[{i + 1}/{len(todo)}] {path} -> "
+                f'{", ".join(outputs)} ({duration:.1f} s)'
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,36 @@
-import qtpy.QtCore
-from qtpy.QtWidgets import (QWidget, QLabel, QGridLayout, QLineEdit, QGroupBox, QComboBox,
-                            QVBoxLayout, QHBoxLayout, QSizePolicy, QCheckBox)
 import napari
+import qtpy.QtCore
+from qtpy.QtWidgets import (
+    QCheckBox,
+    QComboBox,
+    QGridLayout,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QSizePolicy,
+    QVBoxLayout,
+    QWidget,
+)
+
 from ._framework import SNapariWidget
+from ._sweep import parse_values
 
 
 class SLayerImageWidget(SNapariWidget):
     def __init__(self, label, napari_viewer):
         super().__init__()
-        self.setSizePolicy(QSizePolicy.Expanding,
-                           QSizePolicy.Fixed)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.label = label
         self.viewer = napari_viewer
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
         self.layer_box = QComboBox()
+        self.layer_box.currentIndexChanged.connect(self.changed)
         layout.addWidget(self.layer_box)
         self._on_layer_change(None)
+        self.viewer.layers.events.inserted.connect(self._on_layer_change)
+        self.viewer.layers.events.removed.connect(self._on_layer_change)
 
     def _on_layer_change(self, e):
         """Update the plugin layers lists when napari layers are updated
@@ -26,13 +39,20 @@ class SLayerImageWidget(SNapariWidget):
         e: QObject
             Qt event
         """
+        current = self.layer_box.currentText()
         self.layer_box.clear()
         for layer in self.viewer.layers:
             if isinstance(layer, napari.layers.image.image.Image):
                 self.layer_box.addItem(layer.name)
+        if self.layer_box.findText(current) >= 0:
+            self.layer_box.setCurrentText(current)
 
     def state(self):
-        return self.viewer.layers[self.layer_box.currentText()].data
+        layer = self.viewer.layers[self.layer_box.currentText()]
+        if layer.multiscale:
+            # deconvolve the full resolution level
+            return layer.data[0]
+        return layer.data
 
     def check_inputs(self):
         if self.layer_box.count() == 0:
@@ -44,64 +64,86 @@ class SLayerImageWidget(SNapariWidget):
 class SCoordinatesWidget(SNapariWidget):
     def __init__(self, label, data_type, default):
         super().__init__()
-        self.setSizePolicy(QSizePolicy.Expanding,
-                           QSizePolicy.Fixed)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.data_type = data_type
         self.label = label
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
-        layout.addWidget(QLabel('x'))
+        layout.addWidget(QLabel("x"))
         self.x_edit = QLineEdit(str(default[2]))
         layout.addWidget(self.x_edit)
 
-        layout.addWidget(QLabel('y'))
+        layout.addWidget(QLabel("y"))
         self.y_edit = QLineEdit(str(default[1]))
         layout.addWidget(self.y_edit)
 
-        layout.addWidget(QLabel('z'))
+        layout.addWidget(QLabel("z"))
         self.z_edit = QLineEdit(str(default[0]))
         layout.addWidget(self.z_edit)
 
+        for edit in (self.x_edit, self.y_edit, self.z_edit):
+            edit.textChanged.connect(self.changed)
+
     def state(self):
-        if self.data_type == 'int':
-            return int(self.z_edit.text()), int(self.y_edit.text()), int(self.x_edit.text())
-        if self.data_type == 'float':
-            return [float(self.z_edit.text()), float(self.y_edit.text()), float(self.x_edit.text())]
+        if self.data_type == "int":
+            return (
+                int(self.z_edit.text()),
+                int(self.y_edit.text()),
+                int(self.x_edit.text()),
+            )
+        if self.data_type == "float":
+            return [
+                float(self.z_edit.text()),
+                float(self.y_edit.text()),
+                float(self.x_edit.text()),
+            ]
 
     def check_inputs(self):
-        if self.data_type == 'float':
+        if self.data_type == "float":
             try:
                 _ = float(self.z_edit.text())
             except ValueError:
-                self.show_error(f"Coordinate z for {self.label} must be a number")
+                self.show_error(
+                    f"Coordinate z for {self.label} must be a number"
+                )
                 return False
             try:
                 _ = float(self.y_edit.text())
             except ValueError:
-                self.show_error(f"Coordinate y for {self.label} must be a number")
+                self.show_error(
+                    f"Coordinate y for {self.label} must be a number"
+                )
                 return False
             try:
                 _ = float(self.x_edit.text())
             except ValueError:
-                self.show_error(f"Coordinate x for {self.label} must be a number")
+                self.show_error(
+                    f"Coordinate x for {self.label} must be a number"
+                )
                 return False
-        elif self.data_type == 'int':
+        elif self.data_type == "int":
             try:
                 _ = int(self.z_edit.text())
             except ValueError:
-                self.show_error(f"Coordinate z for {self.label} must be a integer")
+                self.show_error(
+                    f"Coordinate z for {self.label} must be a integer"
+                )
                 return False
             try:
                 _ = int(self.y_edit.text())
             except ValueError:
-                self.show_error(f"Coordinate y for {self.label} must be a integer")
+                self.show_error(
+                    f"Coordinate y for {self.label} must be a integer"
+                )
                 return False
             try:
                 _ = int(self.x_edit.text())
             except ValueError:
-                self.show_error(f"Coordinate x for {self.label} must be a integer")
+                self.show_error(
+                    f"Coordinate x for {self.label} must be a integer"
+                )
                 return False
         return True
 
@@ -109,36 +151,46 @@ class SCoordinatesWidget(SNapariWidget):
 class SLineWidget(SNapariWidget):
     def __init__(self, label, number_type, default_value):
         super().__init__()
-        self.setSizePolicy(QSizePolicy.Expanding,
-                           QSizePolicy.Fixed)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.label = label
         self.data_type = number_type
 
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         self.edit = QLineEdit(str(default_value))
+        if number_type in ("int", "float"):
+            self.edit.setToolTip(
+                "A value, a list of values (1, 2, 5) or a range "
+                "(start:stop:step) to compare the results of several values"
+            )
+        self.edit.textChanged.connect(self.changed)
         layout.addWidget(self.edit, 0, qtpy.QtCore.Qt.AlignTop)
         self.setLayout(layout)
 
     def state(self):
-        if self.data_type == 'int':
-            return int(self.edit.text())
-        if self.data_type == 'float':
-            return float(self.edit.text())
+        if self.data_type in ("int", "float"):
+            # a list (1, 2, 5) or a range (start:stop:step) of values is swept
+            return parse_values(self.edit.text(), self.data_type)
         return self.edit.text()
 
     def check_inputs(self):
-        if self.data_type == 'int':
+        if self.data_type == "int":
             try:
-                _ = int(self.edit.text())
+                _ = parse_values(self.edit.text(), "int")
             except ValueError:
-                self.show_error(f"Value for {self.label} must be an integer")
+                self.show_error(
+                    f"Value for {self.label} must be an integer, a list of "
+                    "integers or a range start:stop:step"
+                )
                 return False
-        if self.data_type == 'float':
+        if self.data_type == "float":
             try:
-                _ = float(self.edit.text())
+                _ = parse_values(self.edit.text(), "float")
             except ValueError:
-                self.show_error(f"Value for {self.label} must be a number")
+                self.show_error(
+                    f"Value for {self.label} must be a number, a list of "
+                    "numbers or a range start:stop:step"
+                )
                 return False
         return True
 
@@ -146,19 +198,19 @@ class SLineWidget(SNapariWidget):
 class SBoolWidget(SNapariWidget):
     def __init__(self, label, default):
         super().__init__()
-        self.setSizePolicy(QSizePolicy.Expanding,
-                           QSizePolicy.Fixed)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         self.combobox = QComboBox()
-        self.combobox.addItems(('True', 'False'))
-        if default == 'False':
+        self.combobox.addItems(("True", "False"))
+        if default in (False, "False"):
             self.combobox.setCurrentIndex(1)
+        self.combobox.currentIndexChanged.connect(self.changed)
         layout.addWidget(self.combobox)
         self.setLayout(layout)
 
     def state(self):
-        if self.combobox.currentText() == 'True':
+        if self.combobox.currentText() == "True":
             return True
         return False
 
@@ -166,6 +218,26 @@ class SBoolWidget(SNapariWidget):
         return True
 
 
+class SSelectWidget(SNapariWidget):
+    def __init__(self, values, default):
+        super().__init__()
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.combobox = QComboBox()
+        self.combobox.addItems([str(x) for x in values])
+        self.combobox.setCurrentText(str(default))
+        self.combobox.currentIndexChanged.connect(self.changed)
+        layout.addWidget(self.combobox)
+        self.setLayout(layout)
+
+    def state(self):
+        return self.combobox.currentText()
+
+    def check_inputs(self):
+        return True
+
+
 class SDictWidget(SNapariWidget):
     """Create a parameters widget from a dictionary
     Parameters
@@ -173,6 +245,7 @@ class SDictWidget(SNapariWidget):
     params: dict
         Dictionary describing the parameters
     """
+
     def __init__(self, params, napari_viewer=None):
         super().__init__()
         self.metadata = params
@@ -186,44 +259,47 @@ class SDictWidget(SNapariWidget):
         self._widgets = []
 
         # advanced button
-        advanced_box = QCheckBox('Advanced')
+        advanced_box = QCheckBox("Advanced")
         advanced_box.stateChanged.connect(self.toggle_advanced)
         self.layout.addWidget(advanced_box, 0, 0, 1, 2)
         self._line_idx += 1
 
         # widgets
-        for key, value in params['inputs'].items():
-            if value['type'] == 'Image':
+        for key, value in params["inputs"].items():
+            if value["type"] == "Image":
                 self.add_layer_image(key, value)
-            elif 'zyx' in value['type']:
+            elif "zyx" in value["type"]:
                 self.add_coordinates(key, value)
-            elif value['type'] == 'float':
+            elif value["type"] == "float":
                 self.add_float(key, value)
-            elif value['type'] == 'int':
+            elif value["type"] == "int":
                 self.add_int(key, value)
-            elif value['type'] == 'bool':
+            elif value["type"] == "bool":
                 self.add_bool(key, value)
-            elif value['type'] == 'select':
+            elif value["type"] == "select":
                 self.add_select_edit(key, value)
             else:
                 self.add_line_edit(key, value)
         # hide empty widget
-        if len(params['inputs']) == 0:
+        if len(params["inputs"]) == 0:
             self.setFixedHeight(0)
 
         self.layout.addWidget(QWidget(), self._line_idx, 0)
         self.toggle_advanced(False)
 
     def toggle_advanced(self, is_advanced):
+        self.is_advanced = bool(is_advanced)
+        self.advanced.emit(self.is_advanced)
         for widget in self._widgets:
-            if widget['widget'].is_advanced:
-                widget['label'].setVisible(is_advanced)
-                widget['widget'].setVisible(is_advanced)
+            if widget["widget"].is_advanced:
+                widget["label"].setVisible(is_advanced)
+                widget["widget"].setVisible(is_advanced)
 
     def _register_widget(self, label, widget, metadata):
-        if 'advanced' in metadata:
-            widget.is_advanced = metadata['advanced']
-        self._widgets.append({'label': label, 'widget': widget})
+        if "advanced" in metadata:
+            widget.is_advanced = metadata["advanced"]
+        widget.changed.connect(self.changed)
+        self._widgets.append({"label": label, "widget": widget})
 
     def add_layer_image(self, key, metadata):
         """Add a combobox to select an image layer
@@ -236,17 +312,17 @@ class SDictWidget(SNapariWidget):
             metadata of the widget
 
         """
-        label = QLabel(metadata['label'])
+        label = QLabel(metadata["label"])
         self.layout.addWidget(label, self._line_idx, 0)
-        widget = SLayerImageWidget(metadata['label'], self.viewer)
+        widget = SLayerImageWidget(metadata["label"], self.viewer)
         self._image_layers.append(widget)
         self.layout.addWidget(widget, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': metadata['type'],
-            'label': metadata['label'],
-            'help': metadata['help'],
-            'widget': widget
+            "type": metadata["type"],
+            "label": metadata["label"],
+            "help": metadata["help"],
+            "widget": widget,
         }
         self._register_widget(label, widget, metadata)
 
@@ -261,40 +337,39 @@ class SDictWidget(SNapariWidget):
             metadata of the widget
 
         """
-        data_type = 'float'
-        if 'int' in metadata['type']:
-            data_type = 'int'
-        widget = SCoordinatesWidget(metadata['label'], data_type, metadata['default'])
-        label = QLabel(metadata['label'])
+        data_type = "float"
+        if "int" in metadata["type"]:
+            data_type = "int"
+        widget = SCoordinatesWidget(
+            metadata["label"], data_type, metadata["default"]
+        )
+        label = QLabel(metadata["label"])
         self.layout.addWidget(label, self._line_idx, 0)
         self.layout.addWidget(widget, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': metadata['type'],
-            'label': metadata['label'],
-            'help': metadata['help'],
-            'default': metadata['default'],
-            'range': None,
-            'widget': widget
+            "type": metadata["type"],
+            "label": metadata["label"],
+            "help": metadata["help"],
+            "default": metadata["default"],
+            "range": None,
+            "widget": widget,
         }
         self._register_widget(label, widget, metadata)
 
     def add_select_edit(self, key, value):
-        print('add select with dict=', value)
-        label = QLabel(value['label'])
+        label = QLabel(value["label"])
         self.layout.addWidget(label, self._line_idx, 0)
-        select_edit = QComboBox()
-        select_edit.addItems([str(x) for x in value['values']])
-        select_edit.setCurrentText(str(value['default']))
+        select_edit = SSelectWidget(value["values"], value["default"])
         self.layout.addWidget(select_edit, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': value['type'],
-            'label': value['label'],
-            'help': value['help'],
-            'default': value['default'],
-            'range': None,
-            'widget': select_edit
+            "type": value["type"],
+            "label": value["label"],
+            "help": value["help"],
+            "default": value["default"],
+            "range": None,
+            "widget": select_edit,
         }
         self._register_widget(label, select_edit, value)
 
@@ -309,18 +384,18 @@ class SDictWidget(SNapariWidget):
             metadata of the widget
 
         """
-        widget = SLineWidget(metadata['label'], 'float', metadata['default'])
-        label = QLabel(metadata['label'])
+        widget = SLineWidget(metadata["label"], "float", metadata["default"])
+        label = QLabel(metadata["label"])
         self.layout.addWidget(label, self._line_idx, 0)
         self.layout.addWidget(widget, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': metadata['type'],
-            'label': metadata['label'],
-            'help': metadata['help'],
-            'default': metadata['default'],
-            'range': None,
-            'widget': widget
+            "type": metadata["type"],
+            "label": metadata["label"],
+            "help": metadata["help"],
+            "default": metadata["default"],
+            "range": None,
+            "widget": widget,
         }
         self._register_widget(label, widget, metadata)
 
@@ -335,56 +410,56 @@ class SDictWidget(SNapariWidget):
             metadata of the widget
 
         """
-        widget = SLineWidget(metadata['label'], 'int', metadata['default'])
-        label = QLabel(metadata['label'])
+        widget = SLineWidget(metadata["label"], "int", metadata["default"])
+        label = QLabel(metadata["label"])
         self.layout.addWidget(label, self._line_idx, 0)
         self.layout.addWidget(widget, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': metadata['type'],
-            'label': metadata['label'],
-            'help': metadata['help'],
-            'default': metadata['default'],
-            'range': None,
-            'widget': widget
+            "type": metadata["type"],
+            "label": metadata["label"],
+            "help": metadata["help"],
+            "default": metadata["default"],
+            "range": None,
+            "widget": widget,
         }
         self._register_widget(label, widget, metadata)
 
     def add_line_edit(self, key, metadata):
-        widget = SLineWidget(metadata['label'], 'str', metadata['default'])
-        label = QLabel(metadata['label'])
+        widget = SLineWidget(metadata["label"], "str", metadata["default"])
+        label = QLabel(metadata["label"])
         self.layout.addWidget(label, self._line_idx, 0)
         self.layout.addWidget(widget, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': metadata['type'],
-            'label': metadata['label'],
-            'help': metadata['help'],
-            'default': metadata['default'],
-            'range': None,
-            'widget': widget
+            "type": metadata["type"],
+            "label": metadata["label"],
+            "help": metadata["help"],
+            "default": metadata["default"],
+            "range": None,
+            "widget": widget,
         }
         self._register_widget(label, widget, metadata)
 
     def add_bool(self, key, metadata):
-        widget = SBoolWidget(metadata['label'], metadata['default'])
-        label = QLabel(metadata['label'])
+        widget = SBoolWidget(metadata["label"], metadata["default"])
+        label = QLabel(metadata["label"])
         self.layout.addWidget(label, self._line_idx, 0)
         self.layout.addWidget(widget, self._line_idx, 1)
         self._line_idx += 1
         self.params[key] = {
-            'type': metadata['type'],
-            'label': metadata['label'],
-            'help': metadata['help'],
-            'default': metadata['default'],
-            'range': None,
-            'widget': widget
+            "type": metadata["type"],
+            "label": metadata["label"],
+            "help": metadata["help"],
+            "default": metadata["default"],
+            "range": None,
+            "widget": widget,
         }
         self._register_widget(label, widget, metadata)
 
     def check_inputs(self):
         for key, value in self.params.items():
-            if not value['widget'].check_inputs():
+            if not value["widget"].check_inputs():
                 return False
         return True
 
@@ -395,10 +470,9 @@ class SDictWidget(SNapariWidget):
         dict of parameters values
         """
         params = self.metadata.copy()
-        params['inputs'] = {}
-        if 'outputs' not in params:
-            params['outputs'] = []
+        params["inputs"] = {}
+        if "outputs" not in params:
+            params["outputs"] = []
         for key, value in self.params.items():
-            params['inputs'][key] = value['widget'].state()
-        print('dict widget state=', params)
+            params["inputs"][key] = value["widget"].state()
         return params
@@ -1,34 +1,112 @@
-import inspect
+import logging
+
+from ._cache import cache_message
+from ._cancel import SCancelledError
 from ._framework import SNapariWorker
 
+_logger = logging.getLogger(__name__)
+
 
 class SDictWorker(SNapariWorker):
     """Create a napari worker from a dictionary
 
+    The calculation is done by a SDictRunner in the worker thread (see
+    SDictRunner for the execution inputs and the caching of the outputs). With
+    the `compute_server` input, the calculation is sent to the persistent
+    compute server (see SComputeServer), except for the lazy images that are
+    read in the napari process. A run stopped by an error logs the error and
+    emits `failed`, so that the queue releases its thread and starts the next
+    job
+
     Parameters
     ----------
     metadata: dict
         Dictionary describing the plugin metadata
     """
+
     def __init__(self, metadata):
         super().__init__()
         self.metadata = metadata
 
+    def _use_server(self):
+        """Check if the run is sent to the compute server"""
+        from ._lazy import is_lazy
+
+        inputs = self._state["inputs"]
+        return inputs.get("compute_server", False) and not any(
+            is_lazy(value) for value in inputs.values()
+        )
+
     def run(self):
-        # run
-        params = self._state['inputs'].copy()
-        fnc_args = inspect.getfullargspec(self.metadata['fnc'])
-        if 'observers' in fnc_args.args:
-            params['observers'] = self._observers
-        outputs_values = self.metadata['fnc'](**params)
+        self._token.reset()
+        use_server = self._use_server()
+        try:
+            if use_server:
+                self._run_server()
+            else:
+                self._run()
+        except SCancelledError:
+            self._release_memory(use_server)
+            self.log.emit("Run cancelled")
+            self.cancelled.emit()
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            _logger.exception("%s run failed", self.metadata["name"])
+            self._release_memory(use_server)
+            self.log.emit(f"Run failed: {error}")
+            self.failed.emit(str(error))
+            return
+        self.finished.emit()
 
-        # copy outputs references to the dictionary
-        if len(self._state['outputs'].keys()) == 1:
-            outputs_values = [outputs_values]
+    @staticmethod
+    def _release_memory(use_server):
+        """Free the buffers of a stopped run in the napari process"""
+        if not use_server:
+            # the deconvolution modules import torch: they are loaded when the
+            # first run starts
+            from ._batch import release_memory
 
-        for i, key in enumerate(self._state['outputs'].keys()):
-            self._state['outputs'][key]['data'] = outputs_values[i].detach().cpu().numpy()
+            release_memory()
 
-        print('outputs dict = ', self._state['outputs'])
+    def _log_messages(self, cache_hit, messages):
+        if cache_hit is not None:
+            self.log.emit(
+                "Result read from the cache"
+                if cache_hit
+                else "Result stored in the cache"
+            )
+        for message in messages:
+            self.log.emit(message)
 
-        self.finished.emit()
+    def _run(self):
+        from ._runner import SDictRunner
+
+        runner = SDictRunner(
+            self.metadata,
+            self._observers,
+            self._token,
+            self.preview.emit,
+            self._profiler,
+        )
+        runner.run(self._state)
+        self._log_messages(
+            runner.cache_hit, runner.messages + [cache_message()]
+        )
+
+    def _run_server(self):
+        from ._server import SComputeServer
+
+        server = SComputeServer.instance()
+        if not server.running:
+            self.log.emit("Starting the compute server")
+        cache_hit, messages = server.run(
+            self.metadata["name"],
+            self._state,
+            self._observers,
+            self._token,
+            self.preview.emit,
+            self._profiler,
+        )
+        self._log_messages(
+            cache_hit, [f"Compute server: {message}" for message in messages]
+        )
@@ -0,0 +1,81 @@
+"""Fast sizes of the Fourier transforms
+
+The FFT of a size with large prime factors (ex: 1021, 97) is several times
+slower than the FFT of a nearby 5-smooth size (ex: 1024, 100), whose only prime
+factors are 2, 3 and 5. The batched deconvolutions pad each spatial axis to the
+next 5-smooth size and crop the result back.
+
+Functions
+---------
+next_fast_size
+padding_widths
+padded_shape
+
+"""
+import functools
+
+padding_modes = ("reflect", "replicate", "zero", "off")
+
+
+@functools.lru_cache(maxsize=None)
+def next_fast_size(size):
+    """Smallest 5-smooth number greater than or equal to a size
+
+    Parameters
+    ----------
+    size: int
+        Size of an axis
+
+    Returns
+    -------
+    the smallest number >= size whose prime factors are 2, 3 and 5
+
+    """
+    candidate = max(1, size)
+    while True:
+        remainder = candidate
+        for factor in (2, 3, 5):
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return candidate
+        candidate += 1
+
+
+def padding_widths(shape, pad=0, mode="reflect"):
+    """Padding of each axis of a frame before its Fourier transform
+
+    Parameters
+    ----------
+    shape: tuple
+        Shape of the frame
+    pad: int
+        Padding added on both sides of each axis
+    mode: str
+        Padding strategy (reflect, replicate, zero). `off` adds only `pad`,
+        without padding to a fast size
+
+    Returns
+    -------
+    list of (before, after) padding of each axis
+
+    """
+    if mode not in padding_modes:
+        raise ValueError(
+            f"Unknown padding {mode}. Available paddings are: "
+            f'{", ".join(padding_modes)}'
+        )
+    if mode == "off":
+        return [(pad, pad) for _ in shape]
+    widths = []
+    for size in shape:
+        total = next_fast_size(size + 2 * pad) - size
+        widths.append((total // 2, total - total // 2))
+    return widths
+
+
+def padded_shape(shape, widths):
+    """Shape of a frame after padding"""
+    return tuple(
+        size + before + after for size, (before, after) in zip(shape, widths)
+    )
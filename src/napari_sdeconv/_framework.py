@@ -6,24 +6,55 @@ SNapariWidget
 SNapariWorker
 SLogWidget
 SProgressObserver
+SJob
+SJobQueue
+SJobQueueWidget
+SNapariPlugin
 
 
 """
-from qtpy.QtWidgets import (QWidget, QGridLayout, QLabel, QPushButton,
-                            QHBoxLayout, QVBoxLayout, QProgressBar,
-                            QTextEdit, QMessageBox)
-from qtpy.QtCore import Signal, QThread, QObject
+import os
+import time
+from types import MappingProxyType
+
+import numpy as np
+from qtpy.QtCore import QObject, QThread, QTimer, Signal
+from qtpy.QtGui import QFontDatabase
+from qtpy.QtWidgets import (
+    QCheckBox,
+    QFileDialog,
+    QGridLayout,
+    QHBoxLayout,
+    QLabel,
+    QListWidget,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
+    QSpinBox,
+    QTextEdit,
+    QVBoxLayout,
+    QWidget,
+)
+
+from ._cancel import SCancelToken
+from ._io import save_state
+from ._profiling import SStageProfiler
 
 
 class SNapariWidget(QWidget):
     """Interface for a napari widget with state
     This interface implements three methods
     - show_error: to display a user input error
-    - check_inputs (abstract): to check all the user input from the plugin widget
-    - state (abstract): to get the plugin widget state, ie the user inputs values set in the widget
+    - check_inputs (abstract): to check all the user input from the plugin
+      widget
+    - state (abstract): to get the plugin widget state, ie the user inputs
+      values set in the widget
+    The `changed` signal is emitted when the user edits an input
     """
+
     advanced = Signal(bool)
     enable = Signal(bool)
+    changed = Signal()
 
     def __init__(self, napari_viewer=None):
         super().__init__()
@@ -77,17 +108,30 @@ class SNapariWidget(QWidget):
 
 class SNapariWorker(QObject):
     """Interface for a napari plugin worker
-    The worker is an object that run the calculation (run method) using the inputs
-    from the plugin widget interface (SNapariWidget state)
+    The worker is an object that run the calculation (run method) using the
+    inputs from the plugin widget interface (SNapariWidget state).
+    A run can be cancelled from another thread with the cancel method. The
+    worker must then check its token and emit `cancelled` instead of
+    `finished`. A run stopped by an error emits `failed` with the error message
     """
+
     finished = Signal()
+    cancelled = Signal()
+    failed = Signal(str)
     progress = Signal(int)
     log = Signal(str)
+    preview = Signal(object)
 
     def __init__(self):
         super().__init__()
         self._state = None
         self._observers = []
+        self._token = SCancelToken()
+        self._profiler = None
+
+    def cancel(self):
+        """Request the cancellation of the current run"""
+        self._token.cancel()
 
     def add_observer(self, observer):
         self._observers.append(observer)
@@ -99,13 +143,19 @@ class SNapariWorker(QObject):
     def set_state(self, state_dict):
         self._state = state_dict
 
+    def set_profiler(self, profiler):
+        """Set the SStageProfiler recording the stages of the run"""
+        self._profiler = profiler
+
     def run(self):
         """Exec the data processing"""
         raise NotImplementedError()
 
 
 class SLogWidget(QWidget):
-    """Widget to log the STracking plugins messages in the graphical interface"""
+    """Widget to log the STracking plugins messages in the graphical
+    interface"""
+
     def __init__(self):
         super().__init__()
 
@@ -113,6 +163,9 @@ class SLogWidget(QWidget):
         layout.setContentsMargins(0, 0, 0, 0)
         self.progress_bar = QProgressBar()
         self.log_area = QTextEdit()
+        self.log_area.setFont(
+            QFontDatabase.systemFont(QFontDatabase.FixedFont)
+        )
         layout.addWidget(self.progress_bar)
         layout.addWidget(self.log_area)
         self.setLayout(layout)
@@ -139,6 +192,7 @@ class SLogWidget(QWidget):
 
 class SProgressObserver(QObject):
     """Implement the observer design pattern to display tools progress"""
+
     progress_signal = Signal(int)
     notify_signal = Signal(str)
 
@@ -154,9 +208,335 @@ class SProgressObserver(QObject):
         self.notify_signal.emit(message)
 
 
+def _read_only(value):
+    """Read-only view of an array input, other inputs unchanged"""
+    if isinstance(value, np.ndarray):
+        value = value.view()
+        value.flags.writeable = False
+    return value
+
+
+def _same_array_type(layer, data):
+    """Check if an array can replace the data of a layer in place"""
+    return (
+        layer is not None
+        and isinstance(data, np.ndarray)
+        and layer.data.shape == data.shape
+        and layer.data.dtype == data.dtype
+    )
+
+
+class SJob:
+    """Read-only copy of a plugin widget state submitted to the run queue
+
+    The inputs of the job cannot be modified: the mapping is read only and its
+    arrays are read-only views. The views share the memory of the layers, they
+    are not copied: a layer modified in place before the job runs changes the
+    input of the job. Each call to `state` creates a new state dictionary for
+    the worker running the job, so jobs never share their outputs. The
+    `buffers` of the job are the arrays where the outputs are written in
+    place, if any. The queue releases the arrays of a job once it is finished
+
+    Parameters
+    ----------
+    job_id: int
+        Unique number of the job in the queue
+    state: dict
+        State of the plugin widget (see SNapariWidget.state)
+    profiler: SStageProfiler
+        Profiler recording the stages of the job. None creates a new profiler
+
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+    def __init__(self, job_id, state, profiler=None):
+        self._id = job_id
+        self.profiler = profiler if profiler is not None else SStageProfiler()
+        self._info = MappingProxyType(
+            {
+                key: value
+                for key, value in state.items()
+                if key not in ("inputs", "outputs")
+            }
+        )
+        self._inputs = MappingProxyType(
+            {key: _read_only(value) for key, value in state["inputs"].items()}
+        )
+        self._outputs = MappingProxyType(
+            {
+                key: MappingProxyType(dict(value))
+                for key, value in state["outputs"].items()
+            }
+        )
+        self.buffers = tuple(
+            value["buffer"]
+            for value in state["outputs"].values()
+            if value.get("buffer") is not None
+        )
+        self.status = SJob.PENDING
+        self.result = None
+        self.error = None
+
+    @property
+    def id(self):
+        """Number of the job in the queue"""
+        return self._id
+
+    @property
+    def name(self):
+        """Name displayed in the queue"""
+        return self._info.get("label", self._info.get("name", "Job"))
+
+    @property
+    def inputs(self):
+        """Read only inputs of the job"""
+        return self._inputs
+
+    def release(self):
+        """Drop the result, the output buffers and the array inputs of a
+        finished job. The job keeps its status and its other inputs"""
+        self.result = None
+        self.buffers = ()
+        self._inputs = MappingProxyType(
+            {
+                key: value
+                for key, value in self._inputs.items()
+                if not hasattr(value, "shape")
+            }
+        )
+
+    def state(self):
+        """Create the state dictionary of the worker running the job"""
+        state = dict(self._info)
+        state["inputs"] = dict(self._inputs)
+        state["outputs"] = {
+            key: dict(value) for key, value in self._outputs.items()
+        }
+        return state
+
+    def __str__(self):
+        return f"#{self._id} {self.name}: {self.status}"
+
+
+class SJobQueue(QObject):
+    """Queue of the jobs submitted by a plugin
+
+    Each job is run by a new worker in its own thread. At most `max_running`
+    jobs run at the same time, the other ones wait in the queue. The result of
+    a finished job is available to the slots of `job_finished` only: the
+    arrays of the job are then released (see SJob.release)
+
+    Parameters
+    ----------
+    worker_factory: callable
+        Function creating a new SNapariWorker
+    observer: SProgressObserver
+        Observer added to the workers to display the progress
+    max_running: int
+        Maximum number of jobs running at the same time
+
+    """
+
+    changed = Signal()
+    job_finished = Signal(object)
+    job_cancelled = Signal(object)
+    job_failed = Signal(object)
+    job_preview = Signal(object, object)
+    job_log = Signal(str)
+
+    def __init__(self, worker_factory, observer=None, max_running=1):
+        super().__init__()
+        self._worker_factory = worker_factory
+        self._observer = observer
+        self.max_running = max_running
+        self.jobs = []
+        self._running = {}
+        self._next_id = 1
+
+    def submit(self, state, profiler=None):
+        """Add a job to the queue
+
+        Parameters
+        ----------
+        state: dict
+            State of the plugin widget
+        profiler: SStageProfiler
+            Profiler recording the stages of the job
+
+        Returns
+        -------
+        the created SJob
+
+        """
+        job = SJob(self._next_id, state, profiler)
+        self._next_id += 1
+        self.jobs.append(job)
+        self._start_next()
+        self.changed.emit()
+        return job
+
+    def set_max_running(self, value):
+        """Set the maximum number of jobs running at the same time"""
+        self.max_running = max(1, value)
+        self._start_next()
+
+    def unfinished(self):
+        """List of the pending and running jobs"""
+        return [
+            job
+            for job in self.jobs
+            if job.status in (SJob.PENDING, SJob.RUNNING)
+        ]
+
+    def clear_finished(self):
+        """Remove the finished, cancelled and failed jobs from the queue"""
+        self.jobs = self.unfinished()
+        self.changed.emit()
+
+    def cancel(self, job=None):
+        """Cancel a job, or all the unfinished jobs
+
+        Parameters
+        ----------
+        job: SJob
+            Job to cancel. None cancels all the pending and running jobs
+
+        """
+        jobs = self.unfinished() if job is None else [job]
+        for job_ in jobs:
+            if job_.status == SJob.PENDING:
+                job_.status = SJob.CANCELLED
+                job_.release()
+            elif job_.status == SJob.RUNNING:
+                for worker, (running_job, _) in self._running.items():
+                    if running_job is job_:
+                        worker.cancel()
+        self.changed.emit()
+
+    def _start_next(self):
+        while len(self._running) < self.max_running:
+            job = next(
+                (job for job in self.jobs if job.status == SJob.PENDING), None
+            )
+            if job is None:
+                return
+            worker = self._worker_factory()
+            worker.set_state(job.state())
+            worker.set_profiler(job.profiler)
+            if self._observer is not None:
+                worker.add_observer(self._observer)
+            thread = QThread()
+            worker.moveToThread(thread)
+            thread.started.connect(worker.run)
+            worker.finished.connect(self._on_finished)
+            worker.cancelled.connect(self._on_cancelled)
+            worker.failed.connect(self._on_failed)
+            worker.preview.connect(self._on_preview)
+            worker.log.connect(self.job_log)
+            job.status = SJob.RUNNING
+            self._running[worker] = (job, thread)
+            thread.start()
+
+    def _release(self, worker):
+        job, thread = self._running.pop(worker)
+        thread.quit()
+        thread.wait()
+        return job
+
+    def _on_finished(self):
+        worker = self.sender()
+        job = self._release(worker)
+        job.result = worker.state()["outputs"]
+        job.status = SJob.DONE
+        self.job_finished.emit(job)
+        # the result is kept by the layers added by the job_finished slots
+        job.release()
+        self._start_next()
+        self.changed.emit()
+
+    def _on_cancelled(self):
+        job = self._release(self.sender())
+        job.status = SJob.CANCELLED
+        self.job_cancelled.emit(job)
+        job.release()
+        self._start_next()
+        self.changed.emit()
+
+    def _on_failed(self, message):
+        job = self._release(self.sender())
+        job.status = SJob.FAILED
+        job.error = message
+        self.job_failed.emit(job)
+        job.release()
+        self._start_next()
+        self.changed.emit()
+
+    def _on_preview(self, data):
+        job, _ = self._running[self.sender()]
+        self.job_preview.emit(job, data)
+
+
+class SJobQueueWidget(QWidget):
+    """Widget displaying the jobs of a SJobQueue
+
+    Parameters
+    ----------
+    queue: SJobQueue
+        Queue to display
+
+    """
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        layout = QGridLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+        layout.addWidget(QLabel("Concurrent jobs"), 0, 0)
+        self.max_running_box = QSpinBox()
+        self.max_running_box.setRange(1, os.cpu_count() or 1)
+        self.max_running_box.setValue(queue.max_running)
+        self.max_running_box.valueChanged.connect(queue.set_max_running)
+        layout.addWidget(self.max_running_box, 0, 1)
+
+        self.jobs_list = QListWidget()
+        self.jobs_list.setMaximumHeight(100)
+        layout.addWidget(self.jobs_list, 1, 0, 1, 2)
+        queue.changed.connect(self.refresh)
+
+    def refresh(self):
+        """Update the list of jobs"""
+        selected = self.selected_job()
+        self.jobs_list.clear()
+        for job in self.queue.jobs:
+            self.jobs_list.addItem(str(job))
+            if job is selected:
+                self.jobs_list.setCurrentRow(self.jobs_list.count() - 1)
+
+    def selected_job(self):
+        """Job selected in the list, or None"""
+        row = self.jobs_list.currentRow()
+        if 0 <= row < len(self.queue.jobs):
+            return self.queue.jobs[row]
+        return None
+
+
 class SNapariPlugin(QWidget):
     """Interface for a SNapariPlugin
-       This is a generic interface for a recordable napari plugin using a worker
+       This is a generic interface for a recordable napari plugin using a
+       worker
+
+    A plugin with `live_preview` has a `Live preview` check box. When it is
+    checked, the state returned by `preview_state` is run in a dedicated queue
+    each time an input, the displayed slice or a Shapes layer changes, after
+    `preview_delay` milliseconds without change. Only the last preview runs: a
+    new preview cancels the previous one
 
     Parameters
     ----------
@@ -164,35 +544,77 @@ class SNapariPlugin(QWidget):
         Instance of the napari viewer
 
     """
+
+    live_preview = False
+    preview_delay = 300
+
     def __init__(self, napari_viewer):
         super().__init__()
         self.viewer = napari_viewer
-        self.thread = QThread()
-        self._worker = None
         self._observer = SProgressObserver()
 
         # init the widget
         self._widget = self.init_widget(self.viewer)
         self.setLayout(QGridLayout())
-        self.layout().addWidget(self._widget, 0, 0, 1, 2)
-
-        # init the worker
-        self._worker = self.init_worker()
-        self._worker.moveToThread(self.thread)
-        self.thread.started.connect(self._worker.run)
-        self._worker.finished.connect(self.thread.quit)
-        self._worker.finished.connect(self.set_outputs)
+        self.layout().addWidget(self._widget, 0, 0, 1, 3)
+
+        # init the run queue: each job is run by a new worker
+        self.queue = SJobQueue(self.init_worker, self._observer)
+        self.queue.job_finished.connect(self.set_outputs)
+        self.queue.job_cancelled.connect(self._on_cancelled)
+        self.queue.job_failed.connect(self._on_failed)
+        self.queue.job_preview.connect(self.set_preview)
+        self.queue.changed.connect(self._on_queue_changed)
         self._observer.progress_signal.connect(self._on_progress)
-        self._worker.add_observer(self._observer)
 
         # add the run area
         self.run_btn = QPushButton("Run")
-        self.layout().addWidget(self.run_btn, 1, 0, 1, 2)
+        self.layout().addWidget(self.run_btn, 1, 0, 1, 1)
         self.run_btn.clicked.connect(self._on_click_run)
-
-        self.progress_bar = QProgressBar()
-        self.layout().addWidget(self.progress_bar, 2, 0, 1, 2)
-        self.layout().addWidget(QWidget(), 3, 0, 1, 2)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.layout().addWidget(self.cancel_btn, 1, 1, 1, 1)
+        self.cancel_btn.clicked.connect(self._on_click_cancel)
+        self.save_btn = QPushButton("Save parameters")
+        self.save_btn.setToolTip(
+            "Save the parameters for the napari-sdeconv command line"
+        )
+        self.layout().addWidget(self.save_btn, 1, 2, 1, 1)
+        self.save_btn.clicked.connect(self._on_click_save)
+
+        # the plugins add their own actions below the run area
+        self.actions_layout = QHBoxLayout()
+        self.actions_layout.setContentsMargins(0, 0, 0, 0)
+        self.layout().addLayout(self.actions_layout, 2, 0, 1, 3)
+
+        self.preview_box = QCheckBox("Live preview")
+        self.preview_box.setToolTip(
+            "Deconvolve the displayed slice, or the selected shape of a "
+            "Shapes layer, when a parameter changes"
+        )
+        self.preview_box.setVisible(self.live_preview)
+        self.layout().addWidget(self.preview_box, 3, 0, 1, 3)
+
+        self.queue_widget = SJobQueueWidget(self.queue)
+        self.layout().addWidget(self.queue_widget, 4, 0, 1, 3)
+
+        self.log_widget = SLogWidget()
+        self.progress_bar = self.log_widget.progress_bar
+        self.layout().addWidget(self.log_widget, 5, 0, 1, 3)
+        self.layout().addWidget(QWidget(), 6, 0, 1, 3)
+        self.queue.job_log.connect(self.log_widget.add_log)
+        self._widget.advanced.connect(self.log_widget.set_advanced)
+        self.log_widget.set_advanced(self._widget.is_advanced)
+
+        self._sweep_layer = None
+        # label of an output layer: array swapped out of the layer by the last
+        # run updating it, where the next run writes its result
+        self._scratch = {}
+        self.viewer.layers.events.removed.connect(self._on_layer_removed)
+        self.viewer.dims.events.current_step.connect(self._update_sweep_label)
+
+        if self.live_preview:
+            self._init_preview()
 
     def state(self):
         return self._widget.state()
@@ -224,18 +646,302 @@ class SNapariPlugin(QWidget):
         """
         raise NotImplementedError()
 
-    def set_outputs(self):
-        for key in self._worker.state()['outputs'].keys():
-            output = self._worker.state()['outputs'][key]
-            if output['type'] == 'Image':
-                self.viewer.add_image(output['data'], name=output['label'])
+    def set_outputs(self, job):
+        """Add the outputs of a finished job to the viewer
+
+        Parameters
+        ----------
+        job: SJob
+            Finished job
+
+        """
+        with job.profiler.stage("add layer"):
+            for key in job.result.keys():
+                output = job.result[key]
+                if output["type"] != "Image":
+                    continue
+                layer = self._output_layer(output)
+                if job.inputs.get("reuse_output", False) and _same_array_type(
+                    layer, output["data"]
+                ):
+                    self._scratch[output["label"]] = layer.data
+                    layer.data = output["data"]
+                else:
+                    layer = self.viewer.add_image(
+                        output["data"], name=output["label"]
+                    )
+                if "sweep" in output:
+                    self._show_sweep(layer, output["sweep"])
+                    self.log_widget.add_log(
+                        "\n".join(
+                            f"{layer.name} [{i}]: {label}"
+                            for i, label in enumerate(output["sweep"])
+                        )
+                    )
         self.progress_bar.setValue(100)
+        self.log_widget.add_log(
+            f"Job #{job.id} {job.name}\n{job.profiler.report()}"
+        )
+        trace_file = job.inputs.get("trace_file", "")
+        if trace_file:
+            job.profiler.save(trace_file)
+
+    def _show_sweep(self, layer, labels):
+        """Display the parameters of the result of a sweep displayed in the
+        viewer
+
+        Parameters
+        ----------
+        layer: napari.layers.Image
+            Layer of the results stacked along the first axis
+        labels: list
+            Parameters of each result
+
+        """
+        layer.metadata["sweep"] = list(labels)
+        self._sweep_layer = layer
+        self._text_overlay().visible = True
+        self._update_sweep_label()
+
+    def _text_overlay(self):
+        """Text overlay of the viewer canvas"""
+        canvas = getattr(self.viewer, "canvas", None)
+        if canvas is not None:
+            return canvas.overlays["text"]
+        # older napari versions
+        return self.viewer.text_overlay
+
+    def _update_sweep_label(self, *args):
+        """Show the parameters of the displayed result of the last sweep"""
+        layer = self._sweep_layer
+        if layer is None or layer not in self.viewer.layers:
+            return
+        labels = layer.metadata["sweep"]
+        index = int(round(layer.world_to_data(self.viewer.dims.point)[0]))
+        index = min(len(labels) - 1, max(0, index))
+        self._text_overlay().text = f"{layer.name} [{index}]: {labels[index]}"
+
+    def _output_layer(self, output):
+        """Get the image layer of the previous result of an output, or None"""
+        from napari.layers import Image
+
+        if output["label"] not in self.viewer.layers:
+            return None
+        layer = self.viewer.layers[output["label"]]
+        if isinstance(layer, Image) and isinstance(layer.data, np.ndarray):
+            return layer
+        return None
+
+    def _on_layer_removed(self, event):
+        """Free the scratch array of a removed output layer"""
+        self._scratch.pop(event.value.name, None)
+
+    def _attach_buffers(self, state):
+        """Give the worker a scratch array to write the results that update
+        the previous output layers
+
+        The layers are updated only when the `reuse_output` input of the state
+        is set. The layer itself is not written during the run: the result is
+        written into the data swapped out of the layer by the previous update,
+        and swapped into the layer when the job finishes (see set_outputs). A
+        cancelled or failed run leaves the layer unchanged. A scratch array
+        used by a pending or running job is not reused
+        """
+        if not state["inputs"].get("reuse_output", False):
+            return state
+        unfinished = self.queue.unfinished()
+        for output in state["outputs"].values():
+            layer = self._output_layer(output)
+            scratch = self._scratch.get(output["label"])
+            if (
+                scratch is None
+                or layer is None
+                or not _same_array_type(layer, scratch)
+            ):
+                self._scratch.pop(output["label"], None)
+                continue
+            if not any(
+                scratch is buffer
+                or any(
+                    np.may_share_memory(scratch, value)
+                    for value in job.inputs.values()
+                    if isinstance(value, np.ndarray)
+                )
+                for job in unfinished
+                for buffer in job.buffers
+            ):
+                output["buffer"] = scratch
+        return state
+
+    def set_preview(self, job, data):
+        """Display an intermediate result of a job in a preview layer
+
+        Parameters
+        ----------
+        job: SJob
+            Running job
+        data: np.ndarray
+            Intermediate result
+
+        """
+        name = f"{job.name} preview"
+        if name in self.viewer.layers:
+            self.viewer.layers[name].data = data
+        else:
+            self.viewer.add_image(data, name=name)
+
+    def preview_state(self):
+        """State of the live preview
+
+        The state has a `preview` entry with the `keep` slices of the output
+        displayed in the preview layer, and its `translate` and `scale`
+
+        Returns
+        -------
+        the state of the preview job, or None if the preview cannot run with
+        the current inputs
+
+        """
+        raise NotImplementedError()
+
+    def _init_preview(self):
+        """Create the preview queue and connect the events refreshing the
+        preview"""
+        self.preview_queue = SJobQueue(self.init_worker)
+        self.preview_queue.job_finished.connect(self.set_live_preview)
+        self._preview_job = None
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(self.preview_delay)
+        self._preview_timer.timeout.connect(self._run_preview)
+        self.preview_box.toggled.connect(self._on_preview_toggled)
+        self._widget.changed.connect(self._request_preview)
+        self.viewer.dims.events.current_step.connect(self._request_preview)
+        self.viewer.layers.events.inserted.connect(self._on_layer_inserted)
+        for layer in self.viewer.layers:
+            self._connect_shapes(layer)
+
+    def _connect_shapes(self, layer):
+        """Refresh the preview when the shapes of a Shapes layer change"""
+        from napari.layers import Shapes
+
+        if isinstance(layer, Shapes):
+            layer.events.data.connect(self._request_preview)
+
+    def _on_layer_inserted(self, event):
+        from napari.layers import Shapes
+
+        if isinstance(event.value, Shapes):
+            self._connect_shapes(event.value)
+            self._request_preview()
+
+    def _on_preview_toggled(self, checked):
+        if checked:
+            self._run_preview()
+        else:
+            self._preview_timer.stop()
+            self.preview_queue.cancel()
+
+    def _request_preview(self, *args):
+        """Run the preview after `preview_delay` milliseconds without a new
+        request"""
+        if self.preview_box.isChecked():
+            self._preview_timer.start()
+
+    def _run_preview(self):
+        state = self.preview_state()
+        if state is None:
+            return
+        self.preview_queue.cancel()
+        self.preview_queue.clear_finished()
+        self._preview_start = time.perf_counter()
+        self._preview_job = self.preview_queue.submit(state)
+
+    def set_live_preview(self, job):
+        """Display the result of the last preview job in the live preview layer
+
+        Parameters
+        ----------
+        job: SJob
+            Finished preview job
+
+        """
+        if job is not self._preview_job:
+            return
+        preview = job.state()["preview"]
+        for output in job.result.values():
+            if output["type"] != "Image":
+                continue
+            keep, scale, translate = (
+                preview["keep"],
+                preview["scale"],
+                preview["translate"],
+            )
+            if "sweep" in output:
+                # the previews of a sweep are stacked along a first axis
+                keep = (slice(None),) + tuple(keep)
+                scale = (1,) + tuple(scale)
+                translate = (0,) + tuple(translate)
+            data = output["data"][keep]
+            name = f"{output['label']} live preview"
+            if (
+                name in self.viewer.layers
+                and self.viewer.layers[name].ndim == data.ndim
+            ):
+                layer = self.viewer.layers[name]
+                layer.data = data
+                layer.scale = scale
+                layer.translate = translate
+            else:
+                if name in self.viewer.layers:
+                    self.viewer.layers.remove(name)
+                layer = self.viewer.add_image(
+                    data, name=name, scale=scale, translate=translate
+                )
+            if "sweep" in output:
+                self._show_sweep(layer, output["sweep"])
+        latency = time.perf_counter() - self._preview_start
+        self.log_widget.add_log(f"Live preview in {latency:.2f} s")
 
     def _on_click_run(self):
         self.progress_bar.setValue(0)
         if self._widget.check_inputs():
-            self._worker.set_state(self._widget.state())
-            self.thread.start()
+            self.submit(self._widget.state)
+
+    def submit(self, read_state):
+        """Add a job to the run queue
+
+        Parameters
+        ----------
+        read_state: callable
+            Function without argument returning the state of the job. It is
+            profiled as the reading of the inputs
+
+        """
+        profiler = SStageProfiler()
+        with profiler.stage("read input"):
+            state = read_state()
+        self.queue.submit(self._attach_buffers(state), profiler)
+
+    def _on_click_cancel(self):
+        self.queue.cancel(self.queue_widget.selected_job())
+
+    def _on_click_save(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Save parameters", "", "Parameters (*.json *.yaml *.yml)"
+        )
+        if filename:
+            save_state(self._widget.state(), filename)
+
+    def _on_cancelled(self, job):
+        self.progress_bar.setValue(0)
+
+    def _on_failed(self, job):
+        self.progress_bar.setValue(0)
+        self.log_widget.add_log(f"Job #{job.id} {job.name} failed")
+
+    def _on_queue_changed(self):
+        self.cancel_btn.setEnabled(len(self.queue.unfinished()) > 0)
 
     def _on_progress(self, value):
         self.progress_bar.setValue(value)
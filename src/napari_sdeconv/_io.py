@@ -0,0 +1,315 @@
+"""Read and write the images and the saved plugin states
+
+This module does not import Qt or napari. TIFF files are read with tifffile and
+Zarr stores with zarr, which are imported only when such a file is used
+
+Functions
+---------
+user_cache_dir
+find_images
+read_image
+open_image
+write_image
+save_state
+load_state
+
+"""
+import glob
+import importlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+image_extensions = (".tif", ".tiff", ".zarr", ".npy")
+
+
+def _is_zarr(path):
+    """Check if a path is a Zarr store"""
+    return (
+        path.rstrip("/\\").endswith(".zarr")
+        or os.path.isfile(os.path.join(path, ".zarray"))
+        or os.path.isfile(os.path.join(path, "zarr.json"))
+    )
+
+
+def optional_import(module, purpose, package=None):
+    """Import an optional dependency with a readable error message
+
+    Parameters
+    ----------
+    module: str
+        Name of the module (ex: zarr, dask.array)
+    purpose: str
+        What the module is needed for, for the error message
+    package: str
+        Name of the package to install. Default is the module name
+
+    Returns
+    -------
+    the imported module
+
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as err:
+        package = package or module
+        raise ImportError(
+            f"{purpose} needs the {package} package: pip install {package}"
+        ) from err
+
+
+def user_cache_dir(*parts):
+    """Directory of the files cached by the package in the user cache directory
+
+    Parameters
+    ----------
+    parts: str
+        Sub directories (ex: results)
+
+    Returns
+    -------
+    the path of the directory. It is not created
+
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "napari-sdeconv", *parts)
+
+
+def find_images(patterns):
+    """List the image files of directories and glob patterns
+
+    Parameters
+    ----------
+    patterns: list
+        Directories, files or glob patterns
+
+    Returns
+    -------
+    sorted list of the TIFF, Zarr and npy paths without duplicates
+
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern) and not _is_zarr(pattern):
+            candidates = [
+                os.path.join(pattern, name) for name in os.listdir(pattern)
+            ]
+        else:
+            candidates = glob.glob(pattern)
+        paths.extend(
+            path
+            for path in candidates
+            if path.lower().rstrip("/\\").endswith(image_extensions)
+            or _is_zarr(path)
+        )
+    return sorted(set(paths))
+
+
+def read_image(path):
+    """Read a TIFF, Zarr or npy image
+
+    Parameters
+    ----------
+    path: str
+        Path of the image
+
+    Returns
+    -------
+    the image as a numpy array, or as a lazy dask array for Zarr stores when
+    dask is installed
+
+    """
+    if _is_zarr(path):
+        zarr = optional_import("zarr", "Reading Zarr stores")
+        array = zarr.open_array(store=path, mode="r")
+        try:
+            import dask.array as da
+        except ImportError:
+            return np.asarray(array)
+        return da.from_zarr(array)
+    if path.lower().endswith(".npy"):
+        return np.load(path)
+    tifffile = optional_import("tifffile", "Reading TIFF files")
+    return tifffile.imread(path)
+
+
+def _zarr_levels(node):
+    """Arrays of a Zarr array or group, from the full resolution to the lowest
+    resolution"""
+    if hasattr(node, "shape"):
+        return [node]
+    multiscales = node.attrs.get("multiscales")
+    if multiscales:
+        paths = [dataset["path"] for dataset in multiscales[0]["datasets"]]
+    else:
+        paths = sorted(
+            (name for name, _ in node.arrays()),
+            key=lambda name: (len(name), name),
+        )
+    return [node[path] for path in paths]
+
+
+def open_image(path):
+    """Open a TIFF, OME-TIFF, Zarr or npy image without reading its data
+
+    Uncompressed TIFF and npy files are memory-mapped. Compressed or tiled TIFF
+    files and Zarr stores are opened as dask arrays read chunk by chunk. The
+    levels of a pyramidal OME-TIFF or of an OME-Zarr are all opened. Without
+    zarr, compressed TIFF files are read into memory
+
+    Parameters
+    ----------
+    path: str
+        Path of the image
+
+    Returns
+    -------
+    list of the levels of the image, from the full resolution to the lowest
+    resolution
+
+    """
+    if path.lower().endswith(".npy"):
+        return [np.load(path, mmap_mode="r")]
+    if _is_zarr(path) or os.path.isdir(path):
+        zarr = optional_import("zarr", "Reading Zarr stores")
+        node = zarr.open(store=path, mode="r")
+    else:
+        tifffile = optional_import("tifffile", "Reading TIFF files")
+        try:
+            return [tifffile.memmap(path, mode="r")]
+        except ValueError:
+            # compressed or non contiguous image data
+            try:
+                import zarr
+            except ImportError:
+                with tifffile.TiffFile(path) as tif:
+                    return [level.asarray() for level in tif.series[0].levels]
+            node = zarr.open(
+                store=tifffile.imread(path, aszarr=True), mode="r"
+            )
+    da = optional_import("dask.array", "Reading chunked images", "dask")
+    return [da.from_zarr(level) for level in _zarr_levels(node)]
+
+
+def write_image(path, data):
+    """Write an image to a TIFF file, a Zarr store or a npy file
+
+    The image is written to a temporary path and renamed, so an interrupted
+    write never leaves a truncated image at `path`. A lazy dask image is
+    computed chunk by chunk when it is written to a Zarr store
+
+    Parameters
+    ----------
+    path: str
+        Path of the image. The format is given by the extension
+    data: np.ndarray
+        Image to write
+
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    if ext.lower() == ".zarr":
+        zarr = optional_import("zarr", "Writing Zarr stores")
+        if hasattr(data, "dask"):
+            chunks = tuple(size[0] for size in data.chunks)
+            array = zarr.open_array(
+                store=tmp_path,
+                mode="w",
+                shape=data.shape,
+                dtype=data.dtype,
+                chunks=chunks,
+            )
+            # the dask chunks are aligned on the zarr chunks, so the writes do
+            # not overlap
+            data.rechunk(chunks).store(array, lock=False)
+        else:
+            array = zarr.open_array(
+                store=tmp_path, mode="w", shape=data.shape, dtype=data.dtype
+            )
+            array[...] = data
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return
+    data = np.asarray(data)
+    if ext.lower() == ".npy":
+        with open(tmp_path, "wb") as file:
+            np.save(file, data)
+    else:
+        tifffile = optional_import("tifffile", "Writing TIFF files")
+        tifffile.imwrite(tmp_path, data)
+    os.replace(tmp_path, path)
+
+
+def _serializable(value):
+    """Convert a state value to a JSON value, or None for the images"""
+    if isinstance(value, np.ndarray) or hasattr(value, "detach"):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [_serializable(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def save_state(state, path):
+    """Save the state of a plugin widget to a JSON or YAML file
+
+    The images of the state are not saved. They are given to the command line
+    interface as files
+
+    Parameters
+    ----------
+    state: dict
+        State of a SDictWidget
+    path: str
+        Path of the file. A .yaml or .yml extension saves the state in YAML
+
+    """
+    content = {
+        "name": state["name"],
+        "inputs": {
+            key: _serializable(value) for key, value in state["inputs"].items()
+        },
+        "outputs": {
+            key: {"type": value["type"], "label": value["label"]}
+            for key, value in state["outputs"].items()
+        },
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        if path.lower().endswith((".yaml", ".yml")):
+            yaml = optional_import("yaml", "Saving YAML states")
+            yaml.safe_dump(content, file, sort_keys=False)
+        else:
+            json.dump(content, file, indent=2)
+
+
+def load_state(path):
+    """Load a plugin state saved in a JSON or YAML file
+
+    Parameters
+    ----------
+    path: str
+        Path of the file
+
+    Returns
+    -------
+    the state dictionary with the `name`, `inputs` and `outputs` keys
+
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        if path.lower().endswith((".yaml", ".yml")):
+            yaml = optional_import("yaml", "Loading YAML states")
+            state = yaml.safe_load(file)
+        else:
+            state = json.load(file)
+    if not isinstance(state, dict) or "name" not in state:
+        raise ValueError(
+            f"{path} is not a plugin state: the name of the plugin is missing"
+        )
+    state.setdefault("inputs", {})
+    return state
@@ -0,0 +1,242 @@
+"""Block-wise deconvolution of lazy images (dask, zarr)
+
+A lazy image is deconvolved chunk by chunk with `dask.array.map_overlap`. Each
+chunk is extended by the PSF half size in the spatial dimensions, so the result
+is a lazy dask array that is computed on demand (ex: when napari displays a
+slice) or written chunk by chunk to a Zarr store. The whole image is never
+loaded in memory. A lazy result does not keep its computed chunks: each display
+of a slice deconvolves again the chunks it needs, and a Zarr store is written
+to compute them once.
+
+Classes
+-------
+SDaskProgress
+
+Functions
+---------
+is_lazy
+deconv_lazy
+
+"""
+import functools
+
+import dask.array as da
+import numpy as np
+from dask.array.overlap import ensure_minimum_chunksize
+from dask.callbacks import Callback
+
+from ._parallel import (
+    SUnitExecutor,
+    check_channel_psf,
+    deconv_frames,
+    output_dtype,
+)
+from ._tiling import block_psf, psf_halo
+
+
+def is_lazy(image):
+    """Check if an image is a lazy chunked array (dask, zarr) that must not be
+    loaded at once
+
+    Parameters
+    ----------
+    image: object
+        Image of a layer or of a state
+
+    Returns
+    -------
+    True if the image is lazy
+
+    """
+    return (
+        image is not None
+        and not isinstance(image, np.ndarray)
+        and hasattr(image, "chunks")
+        and hasattr(image, "shape")
+    )
+
+
+def _deconv_chunk(
+    chunk,
+    fnc,
+    psf,
+    params,
+    batch,
+    batch_size,
+    batch_params,
+    token,
+    compute_type,
+):
+    """Deconvolve one extended chunk of a lazy image"""
+    if token is not None:
+        token.check()
+    chunk_psf = block_psf(psf, chunk.shape[chunk.ndim - psf.ndim :])
+    with SUnitExecutor(token=token) as executor:
+        return deconv_frames(
+            fnc,
+            np.asarray(chunk),
+            chunk_psf,
+            params,
+            executor,
+            batch=batch,
+            batch_size=batch_size,
+            batch_params=batch_params,
+            compute_type=compute_type,
+        )
+
+
+def deconv_lazy(
+    fnc,
+    image,
+    psf,
+    params,
+    block_size=None,
+    overlap=None,
+    batch=None,
+    batch_size=1,
+    batch_params=None,
+    token=None,
+    compute_type=None,
+    channel_axis=None,
+):
+    """Deconvolve a lazy image chunk by chunk
+
+    With a channel axis, each channel is deconvolved with its PSF (see
+    deconv_frames) and the channels are stacked back
+
+    The overlap of a spatial dimension is at most its size, and the chunks
+    smaller than the overlap are merged with their neighbours. The result is
+    not persisted: each computation of a chunk of the result (ex: each display
+    of a slice in napari) deconvolves its extended chunk again
+
+    Parameters
+    ----------
+    fnc: callable
+        sdeconv deconvolution function with the signature fnc(image, psf,
+        **params)
+    image: dask.array.Array or zarr.Array
+        Image to deconvolve
+    psf: np.ndarray
+        Point spread function
+    params: dict
+        Other parameters of the deconvolution function
+    block_size: tuple
+        Size of the chunks in the spatial dimensions (0 keeps the whole
+        dimension). None keeps the chunks of the image
+    overlap: tuple
+        Overlap between two chunks in the spatial dimensions. A negative value
+        (or None) uses twice the PSF half size
+    batch: SBatchDeconv
+        Batched implementation of the deconvolution function
+    batch_size: int
+        Number of frames in a batch
+    batch_params: dict
+        Parameters of the batched deconvolution that the deconvolution function
+        does not have
+    token: SCancelToken
+        Cancellation token checked before each chunk
+    compute_type: str
+        Precision of the computation (float32, float64, bfloat16). None
+        computes in the precision of the image, at least float32
+    channel_axis: int
+        Axis of the channels in the image. None deconvolves all the frames with
+        the same PSF
+
+    Returns
+    -------
+    the lazy deconvolved image as a dask array
+
+    """
+    psf = np.asarray(psf)
+    if not hasattr(image, "dask"):
+        image = da.from_array(image, chunks=image.chunks)
+    if channel_axis is not None:
+        check_channel_psf(image.shape, psf.shape, channel_axis)
+        channels = [
+            deconv_lazy(
+                fnc,
+                da.take(image, channel, axis=channel_axis),
+                psf[channel],
+                params,
+                block_size,
+                overlap,
+                batch,
+                batch_size,
+                batch_params,
+                token,
+                compute_type,
+            )
+            for channel in range(image.shape[channel_axis])
+        ]
+        return da.stack(channels, axis=channel_axis)
+    frame_ndim = image.ndim - psf.ndim
+    if block_size is not None:
+        chunks = [size if size > 0 else -1 for size in block_size]
+        image = image.rechunk(image.chunks[:frame_ndim] + tuple(chunks))
+
+    halo = psf_halo(psf)
+    if overlap is None:
+        overlap = (-1,) * psf.ndim
+    depth = {axis: 0 for axis in range(frame_ndim)}
+    boundary = {axis: "none" for axis in range(frame_ndim)}
+    chunks = list(image.chunks)
+    for i, (size, over) in enumerate(zip(halo, overlap)):
+        axis = frame_ndim + i
+        # the reflected boundary cannot be wider than the axis, and map_overlap
+        # needs chunks at least as large as the depth
+        depth[axis] = min(size if over < 0 else over // 2, image.shape[axis])
+        boundary[axis] = "reflect"
+        if depth[axis] > 0:
+            chunks[axis] = ensure_minimum_chunksize(depth[axis], chunks[axis])
+    if tuple(chunks) != image.chunks:
+        image = image.rechunk(tuple(chunks))
+
+    dtype = output_dtype(image, compute_type)
+    deconv_chunk = functools.partial(
+        _deconv_chunk,
+        fnc=fnc,
+        psf=psf,
+        params=params,
+        batch=batch,
+        batch_size=batch_size,
+        batch_params=batch_params,
+        token=token,
+        compute_type=compute_type,
+    )
+    return da.map_overlap(
+        deconv_chunk,
+        image,
+        depth=depth,
+        boundary=boundary,
+        dtype=dtype,
+        meta=np.empty((0,) * image.ndim, dtype=dtype),
+    )
+
+
+class SDaskProgress(Callback):
+    """Dask callback notifying the observers of the progress of a computation
+
+    Parameters
+    ----------
+    observers: list
+        Observers notified with `progress(int)`
+
+    """
+
+    def __init__(self, observers):
+        super().__init__()
+        self.observers = observers
+        self._total = 1
+
+    def _start_state(self, dsk, state):
+        self._total = max(
+            1,
+            sum(
+                len(state[key])
+                for key in ("ready", "waiting", "running", "finished")
+            ),
+        )
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        for observer in self.observers:
+            observer.progress(int(100 * len(state["finished"]) / self._total))
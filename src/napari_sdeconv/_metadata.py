@@ -0,0 +1,426 @@
+"""Plugins metadata shared by the napari widgets and the command line interface
+
+The metadata of the sdeconv functions are extended with the execution inputs of
+the plugins (channels, precision, tiling, parallelism, batches, spatially
+varying PSF, iterations, result cache, compute server). This module does not
+import Qt or napari
+
+The metadata of a plugin is built when it is first requested: sdeconv and torch
+are not imported with this module, so that napari lists the plugins without
+loading them
+
+Functions
+---------
+deconv_metadata
+psf_metadata
+blind_metadata
+get_metadata
+
+"""
+import functools
+import importlib
+
+from ._fft import padding_modes
+from ._precision import output_types, precisions
+
+tiling_inputs = {
+    "block_size": {
+        "type": "zyx_int",
+        "label": "Block size",
+        "help": "Deconvolve the image by blocks of this size to limit the "
+        "memory usage. 0 means that the dimension is not split",
+        "default": [0, 0, 0],
+        "advanced": True,
+        "execution": True,
+    },
+    "block_overlap": {
+        "type": "zyx_int",
+        "label": "Block overlap",
+        "help": "Overlap between two blocks. -1 uses twice the PSF half size",
+        "default": [-1, -1, -1],
+        "advanced": True,
+        "execution": True,
+    },
+}
+
+parallel_inputs = {
+    "workers": {
+        "type": "int",
+        "label": "Workers",
+        "help": "Number of processes deconvolving the frames and blocks in "
+        "parallel",
+        "default": 1,
+        "advanced": True,
+        "execution": True,
+    },
+    "threads": {
+        "type": "int",
+        "label": "Threads per worker",
+        "help": "Number of torch threads in each worker process. 0 shares "
+        "the CPU cores between the workers",
+        "default": 0,
+        "advanced": True,
+        "execution": True,
+    },
+}
+
+
+batch_inputs = {
+    "batch_size": {
+        "type": "int",
+        "label": "Batch size",
+        "help": "Number of time points or channels deconvolved in one call",
+        "default": 8,
+        "advanced": True,
+        "execution": True,
+    },
+    "fft_padding": {
+        "type": "select",
+        "label": "FFT padding",
+        "help": "Pad each axis to the next size whose prime factors are 2, 3 "
+        "and 5, where the Fourier transforms are fast, and crop the result "
+        'back. The strategy sets the values of the padding. "off" pads only '
+        "by the Padding parameter",
+        "values": list(padding_modes),
+        "default": "reflect",
+        "advanced": True,
+        "execution": True,
+    },
+}
+
+
+iterative_inputs = {
+    "tolerance": {
+        "type": "float",
+        "label": "Tolerance",
+        "help": "Stop the iterations when the relative change of the "
+        "deconvolved image is lower than the tolerance. 0 runs all the "
+        "iterations",
+        "default": 0,
+        "advanced": True,
+        "execution": True,
+    },
+    "resume": {
+        "type": "bool",
+        "label": "Resume iterations",
+        "help": "Keep the last deconvolved image and the state of the "
+        "algorithm in memory (up to 1 GB). A run on the same image with more "
+        "iterations, or another tolerance, resumes from it instead of "
+        "starting again. A cancelled or failed run frees the kept states",
+        "default": False,
+        "advanced": True,
+        "execution": True,
+    },
+    "preview_every": {
+        "type": "int",
+        "label": "Preview every",
+        "help": "Number of iterations between two previews of the deconvolved "
+        "image. 0 disables the preview",
+        "default": 0,
+        "advanced": True,
+        "execution": True,
+    },
+}
+
+
+precision_inputs = {
+    "compute_type": {
+        "type": "select",
+        "label": "Precision",
+        "help": "Data type of the computation. The image is converted once to "
+        "this type. bfloat16 halves the memory of float32: the Fourier "
+        "transforms are calculated in float32 and the result is float32",
+        "values": list(precisions),
+        "default": "float32",
+        "advanced": True,
+        "execution": True,
+    },
+    "output_type": {
+        "type": "select",
+        "label": "Output type",
+        "help": 'Data type of the result. "precision" keeps the type of the '
+        'computation, "input" the type of the input image, and the integer '
+        "types rescale the result to their full range",
+        "values": list(output_types),
+        "default": "precision",
+        "advanced": True,
+        "execution": True,
+    },
+}
+
+
+output_inputs = {
+    "reuse_output": {
+        "type": "bool",
+        "label": "Update output layer",
+        "help": "Replace the data of the output layer of the previous run "
+        "when it has the same shape and data type, instead of adding a new "
+        "layer. The layer is updated when the run finishes, and the next runs "
+        "write into the replaced data",
+        "default": False,
+        "advanced": True,
+        "execution": True,
+    }
+}
+
+
+lazy_inputs = {
+    "output_store": {
+        "type": "str",
+        "label": "Output Zarr store",
+        "help": "Path of the Zarr store where the deconvolution of a lazy "
+        "(dask, zarr) image is written chunk by chunk. Empty keeps the result "
+        "lazy: the displayed chunks are deconvolved again each time they are "
+        "displayed",
+        "default": "",
+        "advanced": True,
+        "execution": True,
+    }
+}
+
+
+trace_inputs = {
+    "trace_file": {
+        "type": "str",
+        "label": "Trace file",
+        "help": "Path of a JSON file where the time and memory of each stage "
+        "of the run are saved. Empty does not save the trace",
+        "default": "",
+        "advanced": True,
+        "execution": True,
+    }
+}
+
+
+channel_inputs = {
+    "channel_axis": {
+        "type": "int",
+        "label": "Channel axis",
+        "help": "Axis of the channels of the image when the PSF layer stacks "
+        "one PSF per channel (ex: a PSF Gibson-Lanni run with one wavelength "
+        "per channel). The channels are deconvolved in one run. -1 "
+        "deconvolves all the frames with the same PSF",
+        "default": -1,
+        "advanced": True,
+        "execution": True,
+    }
+}
+
+
+varying_inputs = {
+    "psf_grid": {
+        "type": "zyx_int",
+        "label": "PSF grid",
+        "help": "Number of PSFs of a spatially varying PSF in each direction. "
+        "The PSF layer stacks the PSFs of the grid on its first axis in z, y, "
+        "x order (ex: PSFs measured or generated at several depths). "
+        "Overlapping patches are deconvolved with the PSF interpolated at "
+        "their center. 1, 1, 1 uses one PSF",
+        "default": [1, 1, 1],
+        "advanced": True,
+        "execution": True,
+    }
+}
+
+
+server_inputs = {
+    "compute_server": {
+        "type": "bool",
+        "label": "Compute server",
+        "help": "Run in a persistent compute process that keeps sdeconv and "
+        "torch loaded between the runs. The images are exchanged through "
+        "shared memory",
+        "default": False,
+        "advanced": True,
+        "execution": True,
+    }
+}
+
+
+cache_inputs = {
+    "result_cache": {
+        "type": "bool",
+        "label": "Cache results",
+        "help": "Store the result on disk and read it back when the plugin is "
+        "run again with the same images and parameters",
+        "default": False,
+        "advanced": True,
+        "execution": True,
+    },
+    "cache_dir": {
+        "type": "str",
+        "label": "Cache directory",
+        "help": "Directory of the stored results. Empty uses the user cache "
+        "directory",
+        "default": "",
+        "advanced": True,
+        "execution": True,
+    },
+    "cache_size": {
+        "type": "float",
+        "label": "Cache size (GB)",
+        "help": "Maximum size of the stored results. The least recently used "
+        "results are removed above this size",
+        "default": 10,
+        "advanced": True,
+        "execution": True,
+    },
+}
+
+
+def deconv_metadata(metadata, batch=None, iterative=False):
+    """Add the execution inputs shared by all the deconvolution plugins to the
+    sdeconv metadata
+
+    Parameters
+    ----------
+    metadata: dict
+        Metadata of a sdeconv deconvolution function
+    batch: SBatchDeconv
+        Batched implementation of the deconvolution function, if the algorithm
+        supports it
+    iterative: bool
+        True to add the inputs of the iterative algorithms (tolerance, preview)
+
+    Returns
+    -------
+    a copy of the metadata with the execution inputs
+
+    """
+    plugin_metadata = metadata.copy()
+    plugin_metadata["inputs"] = {
+        **metadata["inputs"],
+        **channel_inputs,
+        **precision_inputs,
+        **tiling_inputs,
+        **parallel_inputs,
+        **output_inputs,
+        **lazy_inputs,
+        **cache_inputs,
+        **server_inputs,
+        **trace_inputs,
+    }
+    if batch is not None:
+        plugin_metadata["batch"] = batch
+        plugin_metadata["inputs"].update(batch_inputs)
+        plugin_metadata["inputs"].update(varying_inputs)
+    if iterative:
+        plugin_metadata["inputs"].update(iterative_inputs)
+    return plugin_metadata
+
+
+def psf_metadata(metadata):
+    """Enable the caching of the PSFs generated with a sdeconv PSF generator
+    and add the compute server and trace inputs
+
+    Parameters
+    ----------
+    metadata: dict
+        Metadata of a sdeconv PSF generator
+
+    Returns
+    -------
+    a copy of the metadata with caching enabled
+
+    """
+    plugin_metadata = metadata.copy()
+    plugin_metadata["cache"] = True
+    plugin_metadata["inputs"] = {
+        **metadata["inputs"],
+        **server_inputs,
+        **trace_inputs,
+    }
+    return plugin_metadata
+
+
+def blind_metadata(metadata):
+    """Add the execution inputs of the blind deconvolution: the image and the
+    PSF are estimated together on the whole image, so it is not split into
+    frames or blocks
+
+    Parameters
+    ----------
+    metadata: dict
+        Metadata of the blind deconvolution function
+
+    Returns
+    -------
+    a copy of the metadata with the execution inputs
+
+    """
+    plugin_metadata = metadata.copy()
+    plugin_metadata["inputs"] = {
+        **metadata["inputs"],
+        **cache_inputs,
+        **server_inputs,
+        **trace_inputs,
+    }
+    return plugin_metadata
+
+
+# name of each plugin: (kind of plugin, module of the metadata, batched
+# deconvolution class)
+_plugins = {
+    "SWiener": ("deconv", "sdeconv.deconv.wiener", "SBatchWiener"),
+    "SRichardsonLucy": (
+        "iterative",
+        "sdeconv.deconv.richardson_lucy",
+        "SBatchRichardsonLucy",
+    ),
+    "Spitfire": ("iterative", "sdeconv.deconv.spitfire", "SBatchSpitfire"),
+    "SBlindRichardsonLucy": ("blind", "napari_sdeconv._blind", None),
+    "SPSFGaussian": ("psf", "sdeconv.psfs.gaussian", None),
+    "SPSFGibsonLanni": ("psf", "sdeconv.psfs.gibson_lanni", None),
+}
+
+plugin_names = tuple(_plugins)
+
+# module attributes of the metadata of each plugin
+_plugin_attributes = {
+    "wiener_plugin_metadata": "SWiener",
+    "rl_plugin_metadata": "SRichardsonLucy",
+    "spitfire_plugin_metadata": "Spitfire",
+    "blind_plugin_metadata": "SBlindRichardsonLucy",
+    "gaussian_plugin_metadata": "SPSFGaussian",
+    "gl_plugin_metadata": "SPSFGibsonLanni",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_metadata(name):
+    """Get the metadata of a plugin from its name
+
+    The module of the plugin is imported on the first call
+
+    Parameters
+    ----------
+    name: str
+        Name of the plugin (ex: SWiener, SRichardsonLucy, Spitfire,
+        SBlindRichardsonLucy, SPSFGaussian)
+
+    Returns
+    -------
+    the plugin metadata
+
+    """
+    if name not in _plugins:
+        raise ValueError(
+            f"Unknown plugin {name}. Available plugins are: "
+            f'{", ".join(_plugins)}'
+        )
+    kind, module, batch = _plugins[name]
+    metadata = importlib.import_module(module).metadata
+    if kind == "psf":
+        return psf_metadata(metadata)
+    if kind == "blind":
+        return blind_metadata(metadata)
+    batch = getattr(importlib.import_module("._batch", __package__), batch)()
+    return deconv_metadata(metadata, batch, kind == "iterative")
+
+
+def __getattr__(name):
+    if name in _plugin_attributes:
+        return get_metadata(_plugin_attributes[name])
+    if name == "plugins_metadata":
+        return {plugin: get_metadata(plugin) for plugin in _plugins}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,587 @@
+"""Parallel execution of independent deconvolution units
+
+A unit is an image and its PSF that can be deconvolved independently of the
+others: a time point, a channel or a spatial block. Units are sent to a process
+pool and the results are gathered in the submission order. The frames
+deconvolved in the pool are written by the pool processes directly into an
+output array in shared memory.
+
+With a channel axis, the PSF has one PSF per channel on its first axis and each
+frame is deconvolved with the PSF of its channel. The units of all the channels
+are sent to the same pool, so the channels are deconvolved in parallel.
+
+Classes
+-------
+SUnitExecutor
+
+Functions
+---------
+deconv_unit
+deconv_unit_shared
+output_dtype
+check_channel_psf
+deconv_frames
+
+"""
+import contextlib
+import multiprocessing
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import numpy as np
+
+from ._cache import SResumeCache, cached_otf
+from ._precision import storage_dtype
+from ._profiling import profile_stage
+from ._shared import shared_empty, shared_spec, write_shared
+from ._tiling import block_psf, deconv_tiled
+
+
+def _init_process(threads, pids=None):
+    """Initialize a pool process
+
+    Parameters
+    ----------
+    threads: int
+        Number of torch threads in the process. 0 keeps the torch default
+    pids: multiprocessing.SimpleQueue
+        Queue receiving the PID of the process, so that the executor can
+        terminate it
+
+    """
+    if pids is not None:
+        pids.put(os.getpid())
+    if threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+def deconv_unit(fnc, image, psf, params):
+    """Deconvolve one unit and return the result as a numpy array
+
+    Parameters
+    ----------
+    fnc: callable
+        sdeconv deconvolution function with the signature fnc(image, psf,
+        **params)
+    image: np.ndarray
+        Image of the unit
+    psf: np.ndarray
+        Point spread function of the unit
+    params: dict
+        Other parameters of the deconvolution function
+
+    Returns
+    -------
+    the deconvolved unit
+
+    """
+    # the batched deconvolutions profile their own stages
+    stage = (
+        contextlib.nullcontext()
+        if hasattr(fnc, "stage")
+        else profile_stage("deconvolution")
+    )
+    with stage:
+        result = fnc(image, psf, **params)
+    if hasattr(result, "detach"):
+        with profile_stage("copy back"):
+            result = result.detach().cpu().numpy()
+    return result
+
+
+def deconv_unit_shared(fnc, image, psf, params, spec, indices):
+    """Deconvolve one unit and write the result into a shared array
+
+    Parameters
+    ----------
+    fnc: callable
+        sdeconv deconvolution function with the signature fnc(image, psf,
+        **params)
+    image: np.ndarray
+        Image of the unit
+    psf: np.ndarray
+        Point spread function of the unit
+    params: dict
+        Other parameters of the deconvolution function
+    spec: tuple
+        Description of the shared output array (see shared_spec)
+    indices: tuple or list
+        Index of the unit frame in the output, or list of the indices of a
+        batch of frames
+
+    """
+    write_shared(spec, indices, deconv_unit(fnc, image, psf, params))
+
+
+def _unit_params(params, unit_params):
+    """Parameters of a unit given as (image, psf) or (image, psf,
+    unit_params)"""
+    return {**params, **unit_params[0]} if unit_params else params
+
+
+class SUnitExecutor:
+    """Run deconvolution units sequentially or in a process pool
+
+    With one worker the units are run in the calling thread. Otherwise, at most
+    two units per worker are in flight at the same time so that the memory does
+    not grow with the number of units.
+
+    Parameters
+    ----------
+    workers: int
+        Number of processes
+    threads: int
+        Number of torch threads per process. 0 shares the CPU cores between
+        the processes (`cpu_count // workers`, at least 1)
+    token: SCancelToken
+        Cancellation token checked before each unit. On cancellation the pool
+        processes are terminated without waiting for the running units
+
+    """
+
+    def __init__(self, workers=1, threads=0, token=None):
+        self.workers = max(1, workers)
+        if threads <= 0:
+            # the torch default of each process uses all the cores
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads = threads
+        self.token = token
+        self._pool = None
+        self._pids = None
+        if self.workers > 1:
+            context = multiprocessing.get_context("spawn")
+            self._pids = context.SimpleQueue()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_process,
+                initargs=(self.threads, self._pids),
+            )
+
+    @property
+    def in_process(self):
+        """True if the units are run in the calling thread"""
+        return self._pool is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def close(self):
+        """Shutdown the process pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._pids.close()
+
+    def terminate(self):
+        """Stop the process pool without waiting for the running units
+
+        ProcessPoolExecutor cannot stop its running tasks, so the processes
+        that reported their PID when they started are terminated. A process
+        that has not reported it yet runs no unit and exits with the pool
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            while not self._pids.empty():
+                with contextlib.suppress(OSError):
+                    os.kill(self._pids.get(), signal.SIGTERM)
+            self._pool = None
+            self._pids.close()
+
+    def _check(self):
+        """Raise SCancelledError if the run has been cancelled"""
+        if self.token is not None:
+            self.token.check()
+
+    def map(self, fnc, units, params, out=None, indices=None):
+        """Deconvolve units
+
+        Parameters
+        ----------
+        fnc: callable
+            sdeconv deconvolution function with the signature fnc(image, psf,
+            **params)
+        units: iterable
+            (image, psf) of each unit, or (image, psf, unit_params) where
+            unit_params update params for this unit
+        params: dict
+            Other parameters of the deconvolution function
+        out: np.ndarray
+            Output array allocated with shared_empty. The pool processes write
+            the units directly into it
+        indices: iterable
+            Index (or list of indices for a batch) of each unit in `out`
+
+        Returns
+        -------
+        iterator on the deconvolved units, in the units order. The units
+        written into `out` by the pool processes are None
+
+        """
+        if self._pool is None:
+            for image, psf, *unit_params in units:
+                self._check()
+                yield deconv_unit(
+                    fnc, image, psf, _unit_params(params, unit_params)
+                )
+            return
+
+        spec = shared_spec(out) if out is not None else None
+        indices = iter(indices) if spec is not None else None
+        futures = deque()
+        for image, psf, *unit_params in units:
+            self._check()
+            image = np.ascontiguousarray(image)
+            unit_params = _unit_params(params, unit_params)
+            if spec is None:
+                futures.append(
+                    self._pool.submit(
+                        deconv_unit, fnc, image, psf, unit_params
+                    )
+                )
+            else:
+                futures.append(
+                    self._pool.submit(
+                        deconv_unit_shared,
+                        fnc,
+                        image,
+                        psf,
+                        unit_params,
+                        spec,
+                        next(indices),
+                    )
+                )
+            if len(futures) >= 2 * self.workers:
+                yield self._result(futures.popleft())
+        while futures:
+            yield self._result(futures.popleft())
+
+    def _result(self, future):
+        """Wait for the result of a unit while checking the cancellation"""
+        while True:
+            self._check()
+            try:
+                return future.result(timeout=0.1)
+            except TimeoutError:
+                continue
+
+
+def _frame_psf(psf, index, channel_axis):
+    """PSF of a frame: the PSF of its channel when there is one PSF per
+    channel"""
+    return psf if channel_axis is None else psf[index[channel_axis]]
+
+
+def _deconv_batches(
+    batch,
+    image,
+    psf,
+    params,
+    frames,
+    batch_size,
+    executor,
+    monitor,
+    out,
+    channel_axis=None,
+    resume=None,
+):
+    """Deconvolve frames by batches sharing the same OTF
+
+    With a channel axis, the batches are made of frames of the same channel,
+    deconvolved with the OTF of the channel. With a resume key, the batches run
+    in the calling process resume from the states of the previous run kept in
+    the SResumeCache, and store their new states
+
+    Returns
+    -------
+    iterator on the deconvolved frames in the order of `frames`, which must
+    list the frames of a channel consecutively. The frames written into `out`
+    by the pool are None
+
+    """
+    frame_shape = image.shape[
+        image.ndim - psf.ndim + (channel_axis is not None) :
+    ]
+    channels = {}
+    for index in frames:
+        channels.setdefault(
+            None if channel_axis is None else index[channel_axis], []
+        ).append(index)
+    batch_size = max(1, batch_size)
+    groups = [
+        indices[i : i + batch_size]
+        for indices in channels.values()
+        for i in range(0, len(indices), batch_size)
+    ]
+    if monitor is not None and executor.in_process:
+        params = {**params, "monitor": monitor}
+    else:
+        monitor = None
+    states = {}
+    cache = (
+        SResumeCache.instance()
+        if resume is not None and executor.in_process
+        else None
+    )
+
+    def units():
+        otfs = {}
+        for i, group in enumerate(groups):
+            if monitor is not None:
+                monitor.set_batch(i, len(groups))
+            channel = None if channel_axis is None else group[0][channel_axis]
+            if channel not in otfs:
+                otfs[channel] = cached_otf(
+                    batch,
+                    _frame_psf(psf, group[0], channel_axis),
+                    frame_shape,
+                    params,
+                )
+            images = np.stack([image[index] for index in group])
+            if cache is None:
+                yield images, otfs[channel]
+            else:
+                states[i] = cache.get((resume, i), dict)
+                yield images, otfs[channel], {"state": states[i]}
+
+    for i, (group, result) in enumerate(
+        zip(groups, executor.map(batch, units(), params, out, groups))
+    ):
+        if cache is not None:
+            # the size of the state is known once the batch is deconvolved
+            cache.put((resume, i), states.pop(i))
+        yield from [None] * len(group) if result is None else result
+
+
+def output_dtype(image, compute_type=None):
+    """Data type of the deconvolution of an image
+
+    Parameters
+    ----------
+    image: np.ndarray
+        Image to deconvolve
+    compute_type: str
+        Precision of the computation (float32, float64, bfloat16). None
+        computes in the precision of the image, at least float32
+
+    Returns
+    -------
+    the numpy data type of the deconvolved image
+
+    """
+    if compute_type is not None:
+        return storage_dtype(compute_type)
+    return np.result_type(image.dtype, np.float32)
+
+
+def check_channel_psf(image_shape, psf_shape, channel_axis):
+    """Check that a PSF has one PSF per channel of an image
+
+    Parameters
+    ----------
+    image_shape: tuple
+        Shape of the image
+    psf_shape: tuple
+        Shape of the PSF, with the channels on the first axis
+    channel_axis: int
+        Axis of the channels in the image. It must be an axis before the
+        spatial axes
+
+    Raises
+    ------
+    ValueError if the PSF does not match the channels of the image
+
+    """
+    spatial_ndim = len(psf_shape) - 1
+    if (
+        spatial_ndim < 2
+        or not 0 <= channel_axis < len(image_shape) - spatial_ndim
+    ):
+        raise ValueError(
+            f"The channel axis {channel_axis} of an image of shape "
+            f"{image_shape} must be before the axes of the PSFs of shape "
+            f"{psf_shape[1:]}"
+        )
+    if psf_shape[0] != image_shape[channel_axis]:
+        raise ValueError(
+            f"The PSF of shape {psf_shape} must have one PSF per channel on "
+            f"its first axis ({image_shape[channel_axis]} channels)"
+        )
+
+
+def deconv_frames(
+    fnc,
+    image,
+    psf,
+    params,
+    executor,
+    block_size=None,
+    overlap=None,
+    observers=None,
+    batch=None,
+    batch_size=1,
+    batch_params=None,
+    monitor=None,
+    out=None,
+    compute_type=None,
+    channel_axis=None,
+    resume=None,
+):
+    """Deconvolve an image frame by frame
+
+    The axes of the image before the PSF dimensions (time, channels...) are
+    frames deconvolved independently. When a batched implementation of the
+    deconvolution is given, the frames are deconvolved by batches with an OTF
+    calculated once for all the frames.
+
+    The frames are written into `out` when it has the shape of the image and
+    the output data type. Otherwise the output is allocated, in shared memory
+    when the units run in a pool.
+
+    With a compute type, each frame (or block) is converted once to this
+    precision when it is deconvolved, and the output has the storage type of
+    the precision
+
+    With a channel axis, `psf` stacks one PSF per channel (see
+    check_channel_psf) and the frames of a channel are deconvolved with the PSF
+    of the channel
+
+    Parameters
+    ----------
+    fnc: callable
+        sdeconv deconvolution function with the signature fnc(image, psf,
+        **params)
+    image: np.ndarray
+        Image to deconvolve
+    psf: np.ndarray
+        Point spread function
+    params: dict
+        Other parameters of the deconvolution function
+    executor: SUnitExecutor
+        Executor running the units
+    block_size: tuple
+        Size of the blocks for tiled deconvolution. None deconvolves each frame
+        at once
+    overlap: tuple
+        Overlap between blocks
+    observers: list
+        Observers notified of the progress
+    batch: SBatchDeconv
+        Batched implementation of the deconvolution function. None deconvolves
+        the frames one by one with fnc
+    batch_size: int
+        Number of frames in a batch
+    batch_params: dict
+        Parameters of the batched deconvolution that the deconvolution function
+        does not have (ex: tolerance)
+    monitor: SIterationMonitor
+        Monitor of the iterations of the batched deconvolution. It is used only
+        when the batches are run in the calling thread
+    out: np.ndarray
+        Preallocated output (ex: the data of the layer of a previous run)
+    compute_type: str
+        Precision of the computation (float32, float64, bfloat16). None
+        computes in the precision of the image, at least float32
+    channel_axis: int
+        Axis of the channels in the image. None deconvolves all the frames with
+        the same PSF
+    resume: tuple
+        Key of the states of the iterative batched deconvolutions kept between
+        the runs (see SResumeCache). None does not keep them
+
+    Returns
+    -------
+    the deconvolved image as a numpy array
+
+    """
+    psf = np.asarray(psf)
+    spatial_ndim = psf.ndim
+    if channel_axis is not None:
+        check_channel_psf(image.shape, psf.shape, channel_axis)
+        spatial_ndim -= 1
+    frames = list(np.ndindex(image.shape[: image.ndim - spatial_ndim]))
+    if channel_axis is not None:
+        # the batches are made of frames of the same channel
+        frames.sort(key=lambda index: index[channel_axis])
+    dtype = output_dtype(image, compute_type)
+    if out is None or out.shape != image.shape or out.dtype != dtype:
+        if executor.in_process or block_size is not None:
+            out = np.empty(image.shape, dtype=dtype)
+        else:
+            out = shared_empty(image.shape, dtype)
+
+    # the sdeconv functions compute in the data type of their inputs
+    unit_dtype = None if compute_type is None else dtype
+    if block_size is not None:
+        tile_observers = observers if len(frames) == 1 else None
+        results = (
+            deconv_tiled(
+                fnc,
+                image[index],
+                _frame_psf(psf, index, channel_axis),
+                params,
+                block_size,
+                overlap,
+                tile_observers,
+                executor,
+                out[index],
+                unit_dtype,
+            )
+            for index in frames
+        )
+    elif batch is not None:
+        batch_params = {**(batch_params or {})}
+        if compute_type is not None:
+            batch_params["compute_type"] = compute_type
+        results = _deconv_batches(
+            batch,
+            image,
+            psf,
+            {**params, **batch_params},
+            frames,
+            batch_size,
+            executor,
+            monitor,
+            out,
+            channel_axis,
+            resume,
+        )
+    else:
+        if unit_dtype is not None:
+            psf = psf.astype(unit_dtype, copy=False)
+        results = executor.map(
+            fnc,
+            (
+                (
+                    image[index]
+                    if unit_dtype is None
+                    else image[index].astype(unit_dtype, copy=False),
+                    block_psf(
+                        _frame_psf(psf, index, channel_axis),
+                        image.shape[image.ndim - spatial_ndim :],
+                    ),
+                )
+                for index in frames
+            ),
+            params,
+            out,
+            frames,
+        )
+
+    for i, (index, result) in enumerate(zip(frames, results)):
+        if result is not None:
+            with profile_stage("copy back"):
+                out[index] = result
+        for observer in observers or []:
+            observer.progress(int(100 * (i + 1) / len(frames)))
+    return out
@@ -0,0 +1,158 @@
+"""Precision of the deconvolution and data type of the results
+
+The image is converted once to the precision of the computation when it is
+sent to the device, and every intermediate tensor is kept in this precision.
+torch has no FFT for bfloat16, so with the bfloat16 precision the images and
+the estimates are stored in bfloat16 and the Fourier transforms are calculated
+in float32. numpy has no bfloat16 either: the arrays of the results are
+float32. float16 is not a precision: its largest value (65504) is below the
+intensities of 16-bit cameras, which overflow in the Richardson-Lucy ratios.
+
+torch is imported by the functions handling tensors, so that the plugins
+metadata can list the precisions without loading torch
+
+Functions
+---------
+storage_dtype
+torch_dtype
+fft_dtype
+to_numpy
+convert_output
+
+"""
+import numpy as np
+
+precisions = ("float32", "float64", "bfloat16")
+
+output_types = ("precision", "input", "float32", "float64", "uint16", "uint8")
+
+
+def _check_precision(precision):
+    """Raise a ValueError for an unknown precision"""
+    if precision not in precisions:
+        raise ValueError(
+            f"Unknown precision {precision}. Available "
+            f'precisions are: {", ".join(precisions)}'
+        )
+
+
+def storage_dtype(precision):
+    """numpy data type of the arrays holding the results of a computation
+
+    Parameters
+    ----------
+    precision: str
+        Precision of the computation (float32, float64, bfloat16)
+
+    Returns
+    -------
+    the numpy data type. It is float32 for bfloat16 that numpy does not support
+
+    """
+    _check_precision(precision)
+    if precision == "float64":
+        return np.dtype(np.float64)
+    return np.dtype(np.float32)
+
+
+def torch_dtype(precision):
+    """torch data type of the tensors of a computation
+
+    Parameters
+    ----------
+    precision: str
+        Precision of the computation (float32, float64, bfloat16)
+
+    Returns
+    -------
+    the torch data type
+
+    """
+    import torch
+
+    _check_precision(precision)
+    return getattr(torch, precision)
+
+
+def fft_dtype(dtype):
+    """torch data type of the Fourier transforms of a tensor
+
+    Parameters
+    ----------
+    dtype: torch.dtype
+        Data type of the tensor
+
+    Returns
+    -------
+    float32 for the half precision types, otherwise the data type of the tensor
+
+    """
+    import torch
+
+    if dtype in (torch.bfloat16, torch.float16):
+        return torch.float32
+    return dtype
+
+
+def to_numpy(tensor):
+    """Copy a tensor to a numpy array, converting the half precision types to
+    float32"""
+    import torch
+
+    tensor = tensor.detach()
+    if tensor.dtype in (torch.bfloat16, torch.float16):
+        tensor = tensor.to(torch.float32)
+    return tensor.cpu().numpy()
+
+
+def _rescale(data, dtype, value_range):
+    """Rescale data to the range of an integer data type"""
+    info = np.iinfo(dtype)
+    mini, maxi = value_range
+    scale = (info.max - info.min) / (maxi - mini) if maxi > mini else 0
+    data = (data - mini) * scale + info.min
+    return data.clip(info.min, info.max).round().astype(dtype)
+
+
+def convert_output(data, output_type, input_dtype, value_range=None):
+    """Convert the result of a deconvolution to the output data type
+
+    Parameters
+    ----------
+    data: np.ndarray or dask.array.Array
+        Result of the deconvolution
+    output_type: str
+        `precision` keeps the data type of the computation, `input` casts the
+        result to the data type of the input image (clipped to the range of the
+        integer types), the integer types rescale the result range to the full
+        range of the type, and the float types cast the result
+    input_dtype: np.dtype
+        Data type of the input image
+    value_range: tuple
+        (min, max) mapped to the range of an integer output type. None uses the
+        range of the data
+
+    Returns
+    -------
+    the converted data. It is `data` itself when no conversion is needed
+
+    """
+    if output_type not in output_types:
+        raise ValueError(
+            f"Unknown output type {output_type}. Available "
+            f'types are: {", ".join(output_types)}'
+        )
+    if output_type == "precision":
+        return data
+    if output_type == "input":
+        dtype = np.dtype(input_dtype)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            return data.clip(info.min, info.max).round().astype(dtype)
+        return data.astype(dtype, copy=False)
+    dtype = np.dtype(output_type)
+    if np.issubdtype(dtype, np.integer):
+        if value_range is None:
+            value_range = (float(data.min()), float(data.max()))
+        return _rescale(data, dtype, value_range)
+    return data.astype(dtype, copy=False)
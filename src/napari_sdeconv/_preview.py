@@ -0,0 +1,102 @@
+"""Region of an image deconvolved by the live preview
+
+The live preview deconvolves only the displayed slice, or a region of interest
+of the displayed slice, instead of the whole image. The region is extended by
+the PSF half size so that its deconvolution is not degraded by the borders, and
+the extension is cropped from the preview.
+
+Functions
+---------
+preview_region
+shape_bounds
+
+"""
+import numpy as np
+
+from ._tiling import psf_halo
+
+
+def preview_region(shape, psf, point, displayed, roi=None):
+    """Region of an image to deconvolve for the preview of the displayed slice
+
+    Parameters
+    ----------
+    shape: tuple
+        Shape of the image
+    psf: np.ndarray
+        Point spread function. Its dimensions are the last dimensions of the
+        image
+    point: tuple
+        Data coordinates of the displayed position in each axis of the image
+    displayed: list
+        Axes of the image displayed in the viewer
+    roi: list
+        (start, stop) of the region of interest in each displayed axis. None
+        previews the whole displayed slice
+
+    Returns
+    -------
+    (crop, keep, origin) where crop are the slices of the image to deconvolve,
+    keep are the slices of the deconvolved crop displayed in the preview and
+    origin is the position of the preview in the image
+
+    """
+    psf = np.asarray(psf)
+    frame_ndim = len(shape) - psf.ndim
+    halo = psf_halo(psf)
+    displayed = list(displayed)
+    crop = []
+    keep = []
+    origin = []
+    for axis, size in enumerate(shape):
+        if axis in displayed:
+            start, stop = (
+                (0, size) if roi is None else roi[displayed.index(axis)]
+            )
+            start, stop = max(0, start), min(size, stop)
+        else:
+            start = min(size - 1, max(0, int(round(point[axis]))))
+            stop = start + 1
+        margin = 0 if axis < frame_ndim else halo[axis - frame_ndim]
+        low = max(0, start - margin)
+        crop.append(slice(low, min(size, stop + margin)))
+        keep.append(slice(start - low, stop - low))
+        origin.append(start)
+    return tuple(crop), tuple(keep), tuple(origin)
+
+
+def shape_bounds(vertices, displayed, ndim):
+    """Bounding box of a shape in the displayed axes of an image
+
+    Parameters
+    ----------
+    vertices: np.ndarray
+        Vertices of the shape [N, D], in the pixel coordinates of the last D
+        axes of the image
+    displayed: list
+        Axes of the image displayed in the viewer
+    ndim: int
+        Number of dimensions of the image
+
+    Returns
+    -------
+    list of (start, stop) of the shape in each displayed axis. None if the
+    shape does not have the displayed axes
+
+    """
+    vertices = np.asarray(vertices)
+    offset = ndim - vertices.shape[1]
+    bounds = []
+    for axis in displayed:
+        if axis < offset:
+            return None
+        coordinates = vertices[:, axis - offset]
+        bounds.append(
+            (
+                int(np.floor(coordinates.min())),
+                int(np.ceil(coordinates.max())) + 1,
+            )
+        )
+    if any(stop - start < 2 for start, stop in bounds):
+        return None
+    return bounds
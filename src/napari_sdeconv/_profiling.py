@@ -0,0 +1,241 @@
+"""Timing and memory of the stages of a run
+
+A SStageProfiler records the wall time, the CPU time and the peak resident
+memory of the stages of a run (reading the input, dtype conversion, PSF
+generation, padding, FFT, iterations, copy back, adding the layer). The deep
+functions of the pipeline annotate their stages with `profile_stage`, which
+records them in the profiler activated in the current thread, or does nothing
+when no profiler is active.
+
+The CPU time is the time of the whole process, including the torch threads. The
+peak memory is the maximum resident set size sampled during the stage, read
+with psutil when it is installed
+
+Classes
+-------
+SStageProfiler
+
+Functions
+---------
+profile_stage
+
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+_local = threading.local()
+
+
+def _rss():
+    """Resident set size of the process in bytes, or 0 if it cannot be read"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class SStageProfiler:
+    """Record the wall time, CPU time and peak memory of the stages of a run
+
+    Parameters
+    ----------
+    interval: float
+        Period in seconds of the memory sampling during the stages
+
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.events = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._origin = time.perf_counter()
+
+    def _sample(self):
+        """Update the peak memory of the open stages until all the stages are
+        closed"""
+        while True:
+            rss = _rss()
+            with self._lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                for record in self._open:
+                    record["peak_rss"] = max(record["peak_rss"], rss)
+            time.sleep(self.interval)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager recording a stage
+
+        Parameters
+        ----------
+        name: str
+            Name of the stage
+
+        """
+        record = {"name": name, "peak_rss": _rss()}
+        with self._lock:
+            self._open.append(record)
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, daemon=True
+                )
+                self._sampler.start()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            with self._lock:
+                self._open.remove(record)
+                record.update(
+                    start=start - self._origin,
+                    wall=wall,
+                    cpu=cpu,
+                    peak_rss=max(record["peak_rss"], _rss()),
+                    thread=threading.get_ident(),
+                )
+                self.events.append(record)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make the profiler record the stages annotated with profile_stage in
+        this thread"""
+        previous = getattr(_local, "profiler", None)
+        _local.profiler = self
+        try:
+            yield self
+        finally:
+            _local.profiler = previous
+
+    def merge(self, events, origin):
+        """Add the stages recorded by another profiler (ex: in the compute
+        server process)
+
+        Parameters
+        ----------
+        events: list
+            Events of the other profiler
+        origin: float
+            `time.perf_counter()` of this process when the other profiler was
+            created
+
+        """
+        offset = origin - self._origin
+        with self._lock:
+            self.events.extend(
+                {**event, "start": event["start"] + offset} for event in events
+            )
+
+    def summary(self):
+        """Total time and peak memory of each stage, in the order of the first
+        occurrence
+
+        Returns
+        -------
+        list of dict with the stage name, count, wall and cpu times in seconds
+        and peak_rss in bytes
+
+        """
+        stages = {}
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["start"])
+        for event in events:
+            stage = stages.setdefault(
+                event["name"],
+                {
+                    "name": event["name"],
+                    "count": 0,
+                    "wall": 0.0,
+                    "cpu": 0.0,
+                    "peak_rss": 0,
+                },
+            )
+            stage["count"] += 1
+            stage["wall"] += event["wall"]
+            stage["cpu"] += event["cpu"]
+            stage["peak_rss"] = max(stage["peak_rss"], event["peak_rss"])
+        return list(stages.values())
+
+    def report(self):
+        """Summary of the stages as a text table for the log area"""
+        lines = [
+            f'{"stage":<16}{"calls":>6}{"wall (s)":>10}{"cpu (s)":>10}'
+            f'{"peak (MB)":>11}'
+        ]
+        for stage in self.summary():
+            lines.append(
+                f'{stage["name"]:<16}{stage["count"]:>6}{stage["wall"]:>10.3f}'
+                f'{stage["cpu"]:>10.3f}{stage["peak_rss"] / 1e6:>11.1f}'
+            )
+        return "\n".join(lines)
+
+    def save(self, path):
+        """Write the stages to a JSON trace file
+
+        The events use the Chrome trace event format, so the file can be opened
+        in chrome://tracing or https://ui.perfetto.dev. The `stages` key holds
+        the summary
+
+        Parameters
+        ----------
+        path: str
+            Path of the JSON file
+
+        """
+        with self._lock:
+            events = [
+                {
+                    "name": event["name"],
+                    "ph": "X",
+                    "pid": os.getpid(),
+                    "tid": event["thread"],
+                    "ts": event["start"] * 1e6,
+                    "dur": event["wall"] * 1e6,
+                    "args": {
+                        "cpu": event["cpu"],
+                        "peak_rss": event["peak_rss"],
+                    },
+                }
+                for event in self.events
+            ]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {"traceEvents": events, "stages": self.summary()},
+                file,
+                indent=1,
+            )
+
+
+def profile_stage(name):
+    """Record a stage in the profiler activated in the current thread
+
+    Parameters
+    ----------
+    name: str
+        Name of the stage
+
+    Returns
+    -------
+    a context manager. It does nothing when no profiler is active
+
+    """
+    profiler = getattr(_local, "profiler", None)
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
@@ -0,0 +1,83 @@
+"""Reader of the TIFF, OME-TIFF and Zarr images for napari
+
+The images are opened without reading their data (see open_image): uncompressed
+files are memory-mapped and compressed files or Zarr stores are dask arrays
+read chunk by chunk, so opening a large stack does not use memory until its
+data are displayed or deconvolved
+
+Functions
+---------
+napari_get_reader
+read_images
+
+"""
+import os
+
+from ._io import open_image
+
+reader_extensions = (".tif", ".tiff", ".zarr")
+
+
+def _layer_name(path):
+    """Name of the layer of an image: the file name without the extensions"""
+    name = os.path.basename(path.rstrip("/\\"))
+    for extension in (
+        ".ome.tiff",
+        ".ome.tif",
+        ".ome.zarr",
+    ) + reader_extensions:
+        if name.lower().endswith(extension):
+            return name[: -len(extension)]
+    return name
+
+
+def napari_get_reader(path):
+    """Get the reader of a path
+
+    Parameters
+    ----------
+    path: str or list of str
+        Path of a file or of a Zarr store, or list of paths
+
+    Returns
+    -------
+    the read_images function if the paths are images of a supported format,
+    else None
+
+    """
+    paths = [path] if isinstance(path, str) else path
+    if not paths or not all(
+        str(item).lower().rstrip("/\\").endswith(reader_extensions)
+        for item in paths
+    ):
+        return None
+    return read_images
+
+
+def read_images(path):
+    """Open images as napari layers data
+
+    Parameters
+    ----------
+    path: str or list of str
+        Path of a file or of a Zarr store, or list of paths
+
+    Returns
+    -------
+    list of (data, metadata, 'image') tuples, one per path. The levels of a
+    pyramidal image are opened as a multi-scale layer
+
+    """
+    paths = [path] if isinstance(path, str) else path
+    layers = []
+    for item in paths:
+        levels = open_image(str(item))
+        multiscale = len(levels) > 1
+        layers.append(
+            (
+                levels if multiscale else levels[0],
+                {"name": _layer_name(str(item)), "multiscale": multiscale},
+                "image",
+            )
+        )
+    return layers
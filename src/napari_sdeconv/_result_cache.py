@@ -0,0 +1,254 @@
+"""On disk cache of the results of the plugins
+
+A result is keyed by the content hash of the input images (see array_digest)
+and by the canonical form of the other inputs, so running a plugin again on the
+same data with the same parameters reads the stored result instead of computing
+it. The results are saved as `.npy` files and read back memory-mapped, so a hit
+costs the hashing of the inputs and the opening of the files. The cache
+directory is bounded in bytes and the least recently used results are evicted.
+This module does not import Qt or napari
+
+Classes
+-------
+SResultCache
+
+Functions
+---------
+default_cache_dir
+result_key
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from importlib import metadata as importlib_metadata
+
+import numpy as np
+
+from ._cache import array_digest, freeze
+from ._io import user_cache_dir
+from ._lazy import is_lazy
+
+# execution inputs that change how a plugin is run, but not its result
+transient_inputs = (
+    "workers",
+    "threads",
+    "reuse_output",
+    "output_store",
+    "trace_file",
+    "preview_every",
+    "result_cache",
+    "cache_dir",
+    "cache_size",
+    "compute_server",
+    "resume",
+)
+
+_index_file = "index.json"
+
+
+def default_cache_dir():
+    """Directory of the result cache when the `cache_dir` input is empty"""
+    return user_cache_dir("results")
+
+
+def _version(package):
+    """Installed version of a package, to invalidate the results of the
+    previous versions"""
+    try:
+        return importlib_metadata.version(package)
+    except importlib_metadata.PackageNotFoundError:
+        return ""
+
+
+def result_key(name, inputs):
+    """Key of the result of a plugin run
+
+    Parameters
+    ----------
+    name: str
+        Name of the plugin
+    inputs: dict
+        Inputs of the state dictionary
+
+    Returns
+    -------
+    str key of the result, or None if an input is lazy (dask, zarr) and cannot
+    be hashed without reading it
+
+    """
+    canonical = {}
+    for key, value in inputs.items():
+        if key in transient_inputs:
+            continue
+        if is_lazy(value):
+            return None
+        if isinstance(value, np.ndarray):
+            value = ("array", array_digest(value))
+        canonical[key] = value
+    description = repr(
+        (
+            name,
+            freeze(canonical),
+            _version("napari-sdeconv"),
+            _version("sdeconv"),
+        )
+    )
+    return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+def _entry_size(path):
+    """Size in bytes of the files of a cache entry"""
+    return sum(
+        entry.stat().st_size for entry in os.scandir(path) if entry.is_file()
+    )
+
+
+class SResultCache:
+    """Results of the plugins stored in a directory, one sub directory per key
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the cache. It is created on the first write
+    max_bytes: int
+        Maximum size of the stored results in bytes
+
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _entries(self):
+        """List the (path, size, last access time) of the entries"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for entry in os.scandir(self.directory):
+            index = os.path.join(entry.path, _index_file)
+            if entry.is_dir() and os.path.isfile(index):
+                entries.append(
+                    (
+                        entry.path,
+                        _entry_size(entry.path),
+                        os.stat(index).st_mtime,
+                    )
+                )
+        return entries
+
+    @property
+    def size(self):
+        """Size of the stored results in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def __len__(self):
+        return len(self._entries())
+
+    def get(self, key):
+        """Read a stored result
+
+        Parameters
+        ----------
+        key: str
+            Key of the result (see result_key)
+
+        Returns
+        -------
+        list of the outputs dictionaries with the memory-mapped `data`, or None
+        if the result is not in the cache
+
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            with open(
+                os.path.join(path, _index_file), "r", encoding="utf-8"
+            ) as file:
+                outputs = json.load(file)
+            for output in outputs:
+                # copy on write: the layer can be edited without changing the
+                # stored result
+                output["data"] = np.load(
+                    os.path.join(path, output.pop("file")), mmap_mode="c"
+                )
+        except (OSError, ValueError):
+            return None
+        # the modification time of the index is the last access time of the
+        # entry
+        os.utime(os.path.join(path, _index_file))
+        return outputs
+
+    def put(self, key, outputs):
+        """Store a result and evict the least recently used results above the
+        size limit
+
+        Parameters
+        ----------
+        key: str
+            Key of the result (see result_key)
+        outputs: list
+            Outputs dictionaries. The `data` of each output is saved, with the
+            `sweep` labels if any
+
+        Returns
+        -------
+        True if the result is stored, False if it is not an array or is larger
+        than the cache
+
+        """
+        values = [output["data"] for output in outputs]
+        if (
+            not all(
+                isinstance(value, np.ndarray) and value.dtype != object
+                for value in values
+            )
+            or sum(value.nbytes for value in values) > self.max_bytes
+        ):
+            return False
+        path = os.path.join(self.directory, key)
+        os.makedirs(self.directory, exist_ok=True)
+        # written in a temporary directory and renamed, so a concurrent run
+        # never reads a partial entry
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        index = []
+        for i, (output, value) in enumerate(zip(outputs, values)):
+            file_name = f"output_{i}.npy"
+            np.save(os.path.join(tmp_path, file_name), value)
+            index.append(
+                {
+                    "file": file_name,
+                    **(
+                        {"sweep": output["sweep"]} if "sweep" in output else {}
+                    ),
+                }
+            )
+        with open(
+            os.path.join(tmp_path, _index_file), "w", encoding="utf-8"
+        ) as file:
+            json.dump(index, file)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another run stored the same result
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+        return True
+
+    def evict(self):
+        """Remove the least recently used results until the cache fits in its
+        size limit"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        for path, entry_size, _ in entries:
+            if size <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            size -= entry_size
+
+    def clear(self):
+        """Remove all the stored results"""
+        for path, _, _ in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,575 @@
+"""Run a plugin from its metadata and a state dictionary without Qt
+
+The runner is used by the napari worker thread and by the command line
+interface
+
+Classes
+-------
+SDictRunner
+
+"""
+import inspect
+
+import dask.array as da
+import numpy as np
+
+from ._batch import SIterationMonitor
+from ._cache import SResumeCache, cached_psf
+from ._io import write_image
+from ._lazy import SDaskProgress, deconv_lazy, is_lazy
+from ._parallel import SUnitExecutor, deconv_frames, output_dtype
+from ._precision import convert_output
+from ._profiling import profile_stage
+from ._result_cache import SResultCache, default_cache_dir, result_key
+from ._sweep import SSweepUnit, sweep_combinations, sweep_keys, sweep_label
+from ._varying import deconv_varying
+
+
+class SDictRunner:
+    """Run the function of a plugin metadata with the inputs of a state
+    dictionary
+
+    Inputs flagged with `'execution': True` in the metadata are not passed to
+    the processing function. They set how the function is run (ex: block size
+    for tiled deconvolution, number of processes). With `'cache': True` in the
+    metadata, the outputs of the function are cached in the process wide PSF
+    cache.
+
+    An output of the state can have a `buffer` array (ex: the data of the layer
+    of a previous run). The result is written into the buffer when it has the
+    shape and data type of the result, so that the output is not allocated
+    again.
+
+    A lazy image (dask, zarr) is deconvolved chunk by chunk. The output is a
+    lazy dask array, or is written to the Zarr store given by the
+    `output_store` execution input
+
+    The `compute_type` execution input sets the precision of the deconvolution
+    and the `output_type` input the data type of the result (see
+    convert_output)
+
+    A number input given a list of values is swept: the function is run for
+    each combination of the swept values and the outputs are stacked along a
+    first axis. The `sweep` entry of each output lists the parameters of the
+    stacked results. The combinations of a deconvolution are run in parallel by
+    the `workers` processes
+
+    With the `channel_axis` execution input, the PSF stacks one PSF per channel
+    of the image on its first axis and each channel is deconvolved with its PSF
+    in the same run
+
+    With a `psf_grid` execution input of more than one PSF, the PSF stacks the
+    PSFs of a grid on its first axis and the image is deconvolved by patches
+    with the interpolated PSF of each patch (see deconv_varying)
+
+    With the `result_cache` execution input, the outputs are stored on disk
+    keyed by the content of the input images and the parameters (see
+    SResultCache). A run with the same inputs reads the memory-mapped stored
+    outputs. `cache_hit` is True for such a run, False when the outputs are
+    computed and None when the cache is not used
+
+    With the `resume` execution input, the iterative batched deconvolutions
+    keep their state (see SResumeCache). A run on the same inputs with only
+    other stopping criteria (`niter`, `tolerance`, `precision`) resumes from
+    it. A `continue` entry in the state makes this number of iterations more
+    from the kept state. `messages` lists the notes of the run for the log (ex:
+    the resumed iteration)
+
+    Parameters
+    ----------
+    metadata: dict
+        Dictionary describing the plugin metadata
+    observers: list
+        Observers notified of the progress with `progress(int)`
+    token: SCancelToken
+        Cancellation token checked between units and iterations
+    preview: callable
+        Called with the intermediate results of the iterative algorithms
+    profiler: SStageProfiler
+        Profiler recording the stages of the run
+
+    """
+
+    def __init__(
+        self, metadata, observers=None, token=None, preview=None, profiler=None
+    ):
+        self.metadata = metadata
+        self.observers = observers if observers is not None else []
+        self.token = token
+        self.preview = preview
+        self.profiler = profiler
+        self.cache_hit = None
+        self.messages = []
+
+    def split_inputs(self, inputs):
+        """Separate the processing function parameters from the execution
+        options
+
+        Parameters
+        ----------
+        inputs: dict
+            Inputs of the state dictionary
+
+        Returns
+        -------
+        (params, options) dictionaries
+
+        """
+        params = {}
+        options = {}
+        for key, value in inputs.items():
+            if self.metadata["inputs"].get(key, {}).get("execution", False):
+                options[key] = value
+            else:
+                params[key] = value
+        return params, options
+
+    @staticmethod
+    def _block_size(options, ndim):
+        """Block size of the tiled deconvolution, or None if the image is not
+        tiled"""
+        block_size = options.get("block_size", (0, 0, 0))[-ndim:]
+        if any(size > 0 for size in block_size):
+            return block_size
+        return None
+
+    @staticmethod
+    def _channel_axis(options):
+        """Axis of the channels of a deconvolution with one PSF per channel, or
+        None"""
+        axis = options.get("channel_axis", -1)
+        return axis if axis >= 0 else None
+
+    @staticmethod
+    def _psf_grid(psf, options):
+        """Shape of the grid of a spatially varying PSF, or None for a single
+        PSF"""
+        grid = options.get("psf_grid", (1, 1, 1))
+        if np.prod(grid) <= 1:
+            return None
+        return tuple(grid[-(np.ndim(psf) - 1) :])
+
+    def _spatial_ndim(self, psf, options):
+        """Number of spatial dimensions of the PSF, without the axis of the
+        PSFs per channel or of the PSFs of a grid"""
+        return (
+            np.ndim(psf)
+            - (self._channel_axis(options) is not None)
+            - (self._psf_grid(psf, options) is not None)
+        )
+
+    def _is_split(self, params, options):
+        """Check if the deconvolution has to be split into units (frames,
+        blocks)"""
+        if "block_size" not in options:
+            return False
+        psf_ndim = self._spatial_ndim(params["psf"], options)
+        # the units convert the frames to the compute type
+        return (
+            "compute_type" in options
+            or params["image"].ndim > psf_ndim
+            or self._channel_axis(options) is not None
+            or options.get("workers", 1) > 1
+            or self._block_size(options, psf_ndim) is not None
+            or self._psf_grid(params["psf"], options) is not None
+        )
+
+    # inputs that do not change the state of an iterative deconvolution
+    _stopping_inputs = (
+        "niter",
+        "tolerance",
+        "precision",
+        "resume",
+        "output_type",
+    )
+
+    def _resume_key(self, state, params, options):
+        """Key of the states of an iterative deconvolution resumed by the next
+        runs, or None"""
+        psf = params["psf"]
+        if (
+            not options.get("resume", False)
+            or self.metadata.get("batch") is None
+            or options.get("workers", 1) > 1
+            or is_lazy(params["image"])
+            or self._block_size(options, self._spatial_ndim(psf, options))
+            is not None
+            or self._psf_grid(psf, options) is not None
+        ):
+            return None
+        inputs = {
+            key: value
+            for key, value in state["inputs"].items()
+            if key not in self._stopping_inputs
+        }
+        return result_key(self.metadata["name"], inputs)
+
+    def _resume_message(self, resume):
+        """Note on the iterations resumed by the run"""
+        kept = SResumeCache.instance().get((resume, 0), dict)
+        if kept.get("start", 0) > 0:
+            self.messages.append(
+                f'Resumed from iteration {kept["start"]} to '
+                f'{kept["iteration"]}'
+            )
+
+    @staticmethod
+    def _batch_params(options):
+        """Execution options passed to the batched deconvolution"""
+        return {
+            key: options[key]
+            for key in ("tolerance", "fft_padding")
+            if key in options
+        }
+
+    def _run_units(
+        self, params, options, out=None, resume=None, more_iterations=0
+    ):
+        """Run the deconvolution function frame by frame and block by block"""
+        image = params.pop("image")
+        psf = np.asarray(params.pop("psf"))
+        psf_ndim = self._spatial_ndim(psf, options)
+        block_size = self._block_size(options, psf_ndim)
+        overlap = options.get("block_overlap", (-1, -1, -1))[-psf_ndim:]
+        batch_params = self._batch_params(options)
+        if resume is not None and more_iterations > 0:
+            batch_params["more_iterations"] = more_iterations
+        grid = self._psf_grid(psf, options)
+        if grid is not None:
+            return self._run_varying(
+                image, psf, grid, params, options, overlap
+            )
+        with SUnitExecutor(
+            options.get("workers", 1), options.get("threads", 0), self.token
+        ) as executor:
+            return deconv_frames(
+                self.metadata["fnc"],
+                image,
+                psf,
+                params,
+                executor,
+                block_size,
+                overlap,
+                self.observers,
+                self.metadata.get("batch"),
+                options.get("batch_size", 1),
+                batch_params,
+                self._monitor(options),
+                out,
+                options.get("compute_type"),
+                self._channel_axis(options),
+                resume,
+            )
+
+    def _run_varying(self, image, psf, grid, params, options, overlap):
+        """Deconvolve an image by patches with a spatially varying PSF"""
+        if self.metadata.get("batch") is None:
+            raise ValueError(
+                f'{self.metadata["label"]} does not support a PSF grid'
+            )
+        if self._channel_axis(options) is not None:
+            raise ValueError(
+                "A PSF grid cannot be used with one PSF per channel"
+            )
+        psf_ndim = len(grid)
+        with SUnitExecutor(
+            options.get("workers", 1), options.get("threads", 0), self.token
+        ) as executor:
+            return deconv_varying(
+                self.metadata["batch"],
+                image,
+                psf,
+                grid,
+                params,
+                executor,
+                options.get("block_size", (0, 0, 0))[-psf_ndim:],
+                overlap,
+                options.get("batch_size", 1),
+                self._batch_params(options),
+                self.observers,
+                options.get("compute_type"),
+            )
+
+    def _run_lazy(self, params, options):
+        """Deconvolve a lazy image chunk by chunk"""
+        image = params.pop("image")
+        psf = np.asarray(params.pop("psf"))
+        if self._psf_grid(psf, options) is not None:
+            raise ValueError("A PSF grid cannot be used with a lazy image")
+        psf_ndim = self._spatial_ndim(psf, options)
+        overlap = options.get("block_overlap", (-1, -1, -1))[-psf_ndim:]
+        batch_params = self._batch_params(options)
+        result = deconv_lazy(
+            self.metadata["fnc"],
+            image,
+            psf,
+            params,
+            self._block_size(options, psf_ndim),
+            overlap,
+            self.metadata.get("batch"),
+            options.get("batch_size", 1),
+            batch_params,
+            self.token,
+            options.get("compute_type"),
+            self._channel_axis(options),
+        )
+        result = self._convert(result, options, image)
+        store = options.get("output_store", "")
+        if not store:
+            return result
+        if not store.endswith(".zarr"):
+            store += ".zarr"
+        with SDaskProgress(self.observers), profile_stage("write store"):
+            write_image(store, result)
+        return da.from_zarr(store)
+
+    @staticmethod
+    def _convert(value, options, image):
+        """Convert a deconvolved image to the output type
+
+        The range of a lazy result is not known before it is computed, so a
+        lazy result converted to an integer type is rescaled with the range of
+        the input image
+        """
+        output_type = options.get("output_type", "precision")
+        if output_type == "precision" or not hasattr(value, "dtype"):
+            return value
+        value_range = None
+        if (
+            is_lazy(value)
+            and output_type != "input"
+            and np.issubdtype(np.dtype(output_type), np.integer)
+        ):
+            if not hasattr(image, "dask"):
+                image = da.from_array(image, chunks=image.chunks)
+            value_range = tuple(
+                float(x) for x in da.compute(image.min(), image.max())
+            )
+        with profile_stage("dtype conversion"):
+            return convert_output(value, output_type, image.dtype, value_range)
+
+    def _monitor(self, options):
+        """Create the monitor streaming the iterations progress and previews"""
+        every = options.get("preview_every", 0)
+        preview = self.preview if every > 0 else None
+        return SIterationMonitor(
+            self._on_iteration, preview, every, self.token
+        )
+
+    def _on_iteration(self, value):
+        """Notify the observers of the progress of the iterations"""
+        for observer in self.observers:
+            observer.progress(int(100 * value))
+
+    def run(self, state):
+        """Run the plugin function and set the outputs data in the state
+
+        Parameters
+        ----------
+        state: dict
+            State dictionary with the `inputs` values and the `outputs` to fill
+
+        Returns
+        -------
+        the state dictionary
+
+        """
+        if self.profiler is None:
+            return self._run_cached(state)
+        with self.profiler.activate():
+            return self._run_cached(state)
+
+    def _run_cached(self, state):
+        """Read the outputs from the result cache, or run the function and
+        store its outputs"""
+        params, options = self.split_inputs(state["inputs"])
+        # a continued run depends on the previous runs, not only on its inputs
+        if (
+            not options.get("result_cache", False)
+            or state.get("continue", 0) > 0
+        ):
+            return self._run(state)
+        cache = SResultCache(
+            options.get("cache_dir", "") or default_cache_dir(),
+            int(options.get("cache_size", 10) * 1e9),
+        )
+        with profile_stage("cache lookup"):
+            key = result_key(self.metadata["name"], state["inputs"])
+            cached = cache.get(key) if key is not None else None
+        self.cache_hit = cached is not None
+        if cached is None:
+            self._run(state)
+            if key is not None:
+                with profile_stage("cache write"):
+                    cache.put(key, list(state["outputs"].values()))
+            return state
+        buffers = [
+            self._buffer(output, params)
+            for output in state["outputs"].values()
+        ]
+        self._set_outputs(
+            state, [output["data"] for output in cached], buffers
+        )
+        for output, cached_output in zip(state["outputs"].values(), cached):
+            if "sweep" in cached_output:
+                output["sweep"] = cached_output["sweep"]
+        return state
+
+    def _sweep_units(self, params, options, combinations):
+        """Deconvolve an image with each combination of a sweep and stack the
+        results"""
+        image = params.pop("image")
+        psf = np.asarray(params.pop("psf"))
+        workers = options.get("workers", 1)
+        psf_ndim = self._spatial_ndim(psf, options)
+        unit = SSweepUnit(
+            self.metadata["fnc"],
+            self.metadata.get("batch"),
+            options.get("batch_size", 1),
+            self._batch_params(options),
+            options.get("compute_type"),
+            self._block_size(options, psf_ndim),
+            options.get("block_overlap", (-1, -1, -1))[-psf_ndim:],
+            self.token if workers <= 1 else None,
+            self._channel_axis(options),
+        )
+        out = np.empty(
+            (len(combinations),) + image.shape,
+            dtype=output_dtype(image, options.get("compute_type")),
+        )
+        units = ((image, psf, combination) for combination in combinations)
+        with SUnitExecutor(
+            workers, options.get("threads", 0), self.token
+        ) as executor:
+            for i, result in enumerate(executor.map(unit, units, params)):
+                with profile_stage("copy back"):
+                    out[i] = result
+                for observer in self.observers:
+                    observer.progress(int(100 * (i + 1) / len(combinations)))
+        return out
+
+    def _run_sweep(self, state, params, options, keys):
+        """Run the function for each combination of the swept parameters"""
+        combinations = sweep_combinations(params, keys)
+        labels = [sweep_label(combination) for combination in combinations]
+        image = params.get("image")
+        if (
+            "block_size" in options
+            and image is not None
+            and not is_lazy(image)
+            and self._psf_grid(params["psf"], options) is None
+        ):
+            for output in state["outputs"].values():
+                output.pop("buffer", None)
+            stack = self._sweep_units(params, options, combinations)
+            outputs_values = [self._convert(stack, options, image)]
+        else:
+            results = []
+            for combination in combinations:
+                sub_state = {
+                    **state,
+                    "inputs": {**state["inputs"], **combination},
+                    "outputs": {
+                        key: {"type": value["type"], "label": value["label"]}
+                        for key, value in state["outputs"].items()
+                    },
+                }
+                results.append(
+                    [
+                        output["data"]
+                        for output in self._run(sub_state)["outputs"].values()
+                    ]
+                )
+            outputs_values = [np.stack(values) for values in zip(*results)]
+        for key, value in zip(state["outputs"].keys(), outputs_values):
+            state["outputs"][key]["data"] = value
+            state["outputs"][key]["sweep"] = labels
+        return state
+
+    def _run(self, state):
+        params, options = self.split_inputs(state["inputs"])
+        keys = sweep_keys(self.metadata, params)
+        if keys:
+            return self._run_sweep(state, params, options, keys)
+        buffers = [
+            self._buffer(output, params)
+            for output in state["outputs"].values()
+        ]
+        image = params.get("image")
+        if "block_size" in options and is_lazy(image):
+            outputs_values = self._run_lazy(params, options)
+        elif self._is_split(params, options):
+            # the buffer receives the converted result when the output type is
+            # not the compute type
+            out = (
+                buffers[0]
+                if options.get("output_type", "precision") == "precision"
+                else None
+            )
+            resume = self._resume_key(state, params, options)
+            outputs_values = self._convert(
+                self._run_units(
+                    params, options, out, resume, state.get("continue", 0)
+                ),
+                options,
+                image,
+            )
+            if resume is not None:
+                self._resume_message(resume)
+        elif self.metadata.get("cache", False):
+            with profile_stage("psf generation"):
+                outputs_values = cached_psf(
+                    self.metadata["name"], self.metadata["fnc"], params
+                )
+        else:
+            fnc_args = inspect.getfullargspec(self.metadata["fnc"])
+            if "observers" in fnc_args.args:
+                params["observers"] = self.observers
+            if "token" in fnc_args.args:
+                params["token"] = self.token
+            with profile_stage("deconvolution"):
+                outputs_values = self.metadata["fnc"](**params)
+
+        # copy outputs references to the dictionary
+        if len(state["outputs"].keys()) == 1:
+            outputs_values = [outputs_values]
+        self._set_outputs(state, outputs_values, buffers)
+        return state
+
+    @staticmethod
+    def _set_outputs(state, outputs_values, buffers):
+        """Set the outputs data in the state, copied into the outputs buffers
+        if possible"""
+        for i, key in enumerate(state["outputs"].keys()):
+            value = outputs_values[i]
+            buffer = buffers[i]
+            with profile_stage("copy back"):
+                if hasattr(value, "detach"):
+                    value = value.detach().cpu().numpy()
+                if (
+                    buffer is not None
+                    and isinstance(value, np.ndarray)
+                    and value is not buffer
+                    and buffer.shape == value.shape
+                    and buffer.dtype == value.dtype
+                ):
+                    np.copyto(buffer, value)
+                    value = buffer
+            state["outputs"][key]["data"] = value
+
+    @staticmethod
+    def _buffer(output, params):
+        """Get the buffer of an output if it does not share memory with the
+        inputs"""
+        buffer = output.pop("buffer", None)
+        if (
+            buffer is None
+            or not buffer.flags.writeable
+            or any(
+                np.may_share_memory(buffer, value)
+                for value in params.values()
+                if isinstance(value, np.ndarray)
+            )
+        ):
+            return None
+        return buffer
@@ -4,13 +4,26 @@ This module is an example of a barebones sample data provider for napari.
 It implements the "sample data" specification.
 see: https://napari.org/plugins/guides.html?#sample-data
 
-Replace code below according to your needs.
+The sample is decoded once and saved in the user cache directory. The next
+calls memory-map the saved image, so loading the sample does not copy it
 """
 from __future__ import annotations
 
-from sdeconv.data import celegans
+import os
+
+import numpy as np
+
+from ._io import user_cache_dir, write_image
 
 
 def make_sample_data():
     """Generates an image"""
-    return [(celegans().detach().cpu().numpy(), {"name": "C. elegans"})]
+    path = os.path.join(user_cache_dir("samples"), "celegans.npy")
+    if not os.path.isfile(path):
+        # imported here so that napari can list the sample without loading
+        # sdeconv and torch
+        from sdeconv.data import celegans
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_image(path, celegans().detach().cpu().numpy())
+    return [(np.load(path, mmap_mode="r"), {"name": "C. elegans"})]
@@ -6,50 +6,367 @@ see: https://napari.org/plugins/guides.html?#widgets
 
 Replace code below according to your needs.
 """
-from typing import TYPE_CHECKING
-
-from sdeconv.deconv.wiener import metadata as wiener_metadata
-from sdeconv.deconv.richardson_lucy import metadata as rl_metadata
-from sdeconv.deconv.spitfire import metadata as spitfire_metadata
-from sdeconv.deconv.wiener import swiener
-from sdeconv.deconv.richardson_lucy import srichardsonlucy
-from sdeconv.deconv.spitfire import spitfire
-from ._framework import SNapariPlugin
+import napari
+import numpy as np
+from qtpy.QtCore import Signal
+from qtpy.QtWidgets import QPushButton, QSpinBox
+
 from ._dict_widget import SDictWidget
 from ._dict_worker import SDictWorker
+from ._framework import SNapariPlugin
+from ._metadata import get_metadata
+from ._preview import preview_region, shape_bounds
+from ._stream import SFrameStream
+
+
+# ########################################################################### #
+#                                SDeconvPlugin
+# ########################################################################### #
+class SDeconvPlugin(SNapariPlugin):
+    """Common interface of the deconvolution plugins
+
+    The live preview deconvolves the displayed slice of the input image, or the
+    bounding box of the selected shape (or the last shape) of the active Shapes
+    layer, extended by the PSF half size. The preview runs in the calling
+    process, without tiling and without the `pad` padding
+
+    The iterative plugins have a `Continue` button running more iterations from
+    the state kept by the last run on the same image (see the `resume` input).
+    The button is enabled when the last run kept its state
+
+    The `Stream` button deconvolves the time points appended to the first axis
+    of the input layer during an acquisition, and appends them to a `<label>
+    stream` layer (see SFrameStream). The input layer is watched until the
+    button is released, including when it is replaced by a layer of the same
+    name
+    """
+
+    live_preview = True
+    stream_frames = Signal(int, float)
+    stream_error = Signal(object)
+
+    def __init__(self, napari_viewer):
+        super().__init__(napari_viewer)
+        self._stream = None
+        self._stream_layer = None
+        self.stream_btn = QPushButton("Stream")
+        self.stream_btn.setCheckable(True)
+        self.stream_btn.setToolTip(
+            "Deconvolve the time points appended to the input image as "
+            "they arrive"
+        )
+        self.stream_btn.toggled.connect(self._on_stream_toggled)
+        self.stream_frames.connect(self._on_stream_frames)
+        self.stream_error.connect(self._on_stream_error)
+        self.viewer.layers.events.inserted.connect(self._on_stream_inserted)
+        self.actions_layout.addWidget(self.stream_btn)
+        self.continue_btn = None
+        if "resume" in self._widget.metadata["inputs"]:
+            self.continue_btn = QPushButton("Continue")
+            self.continue_btn.setToolTip(
+                "Run more iterations from the result of the last run "
+                "on the same image. The last run must resume iterations"
+            )
+            self.continue_btn.setEnabled(False)
+            self.continue_btn.clicked.connect(self._on_click_continue)
+            self.continue_box = QSpinBox()
+            self.continue_box.setRange(1, 999999)
+            self.continue_box.setValue(10)
+            self.continue_box.setSuffix(" iterations")
+            self.actions_layout.addWidget(self.continue_btn)
+            self.actions_layout.addWidget(self.continue_box)
+
+    def _on_click_continue(self):
+        self.progress_bar.setValue(0)
+        if not self._widget.check_inputs():
+            return
+        count = self.continue_box.value()
+        niter = self._widget.params.get("niter")
+        if niter is not None:
+            value = niter["widget"].state()
+            if not isinstance(value, int):
+                self._widget.show_error(
+                    "Continue needs a single number of iterations"
+                )
+                return
+            # the run with more iterations resumes from the kept state
+            niter["widget"].edit.setText(str(value + count))
+        self.submit(lambda: self._continue_state(niter is None, count))
+
+    def _enable_continue(self, enabled):
+        if self.continue_btn is not None:
+            self.continue_btn.setEnabled(enabled)
+
+    def set_outputs(self, job):
+        super().set_outputs(job)
+        if self.continue_btn is None:
+            return
+        kept = job.inputs.get("resume", False)
+        self._enable_continue(kept)
+        if not kept:
+            self.log_widget.add_log(
+                "Continue is disabled: the last run kept no state. Set "
+                "'Resume iterations' to continue the next run"
+            )
+
+    def _on_cancelled(self, job):
+        super()._on_cancelled(job)
+        # a cancelled or failed run frees the kept states
+        self._enable_continue(False)
+
+    def _on_failed(self, job):
+        super()._on_failed(job)
+        self._enable_continue(False)
+
+    def _continue_state(self, more_iterations, count):
+        """State of the job continuing the last run"""
+        state = self._widget.state()
+        state["inputs"]["resume"] = True
+        if more_iterations:
+            state["continue"] = count
+        return state
 
-if TYPE_CHECKING:
-    import napari
+    def _on_stream_toggled(self, checked):
+        if checked:
+            self._start_stream()
+        else:
+            self._stop_stream()
+
+    def _start_stream(self):
+        if not self._widget.check_inputs():
+            self.stream_btn.setChecked(False)
+            return
+        state = self._widget.state()
+        try:
+            self._stream = SFrameStream.from_state(
+                self._widget.metadata,
+                state,
+                self.stream_frames.emit,
+                self.stream_error.emit,
+            )
+        except ValueError as error:
+            self._widget.show_error(str(error))
+            self.stream_btn.setChecked(False)
+            return
+        output = next(iter(state["outputs"].values()))
+        self._stream_name = f"{output['label']} stream"
+        image_name = self._widget.params["image"][
+            "widget"
+        ].layer_box.currentText()
+        self._watch_stream_layer(self.viewer.layers[image_name])
+        self._stream.start(state["inputs"]["image"])
+        self.log_widget.add_log(
+            f"Streaming the time points of {self._stream_layer.name}"
+        )
+
+    def _stop_stream(self):
+        if self._stream is None:
+            return
+        stream, self._stream = self._stream, None
+        self._watch_stream_layer(None)
+        stream.stop()
+        self.log_widget.add_log(
+            f"Stream stopped after {stream.count} time points"
+        )
+
+    def _watch_stream_layer(self, layer):
+        """Follow the data of the source layer of the stream"""
+        if self._stream_layer is not None:
+            self._stream_layer.events.data.disconnect(self._on_stream_data)
+        self._stream_layer = layer
+        if layer is not None:
+            layer.events.data.connect(self._on_stream_data)
+
+    def _on_stream_data(self, *args):
+        layer = self._stream_layer
+        self._stream.update(layer.data[0] if layer.multiscale else layer.data)
+
+    def _on_stream_inserted(self, event):
+        """Follow a new layer replacing the source layer of the stream"""
+        if (
+            self._stream is not None
+            and isinstance(event.value, napari.layers.Image)
+            and event.value.name == self._stream_layer.name
+            and event.value is not self._stream_layer
+        ):
+            self._watch_stream_layer(event.value)
+            self._on_stream_data()
+
+    def _on_stream_frames(self, count, latency):
+        if self._stream is None:
+            return
+        data = self._stream.output
+        if self._stream_name in self.viewer.layers:
+            self.viewer.layers[self._stream_name].data = data
+        else:
+            self.viewer.add_image(
+                data,
+                name=self._stream_name,
+                scale=self._stream_layer.scale,
+                translate=self._stream_layer.translate,
+            )
+        self.log_widget.add_log(
+            f"Stream: {count} time points, latency {latency:.2f} s"
+        )
+
+    def _on_stream_error(self, error):
+        self.log_widget.add_log(f"Stream error: {error}")
+        self.stream_btn.setChecked(False)
+
+    def _preview_roi(self, image_layer, displayed):
+        """Bounding box of the preview shape in the displayed axes of the
+        image, or None"""
+        layer = self.viewer.layers.selection.active
+        if not isinstance(layer, napari.layers.Shapes):
+            layer = next(
+                (
+                    layer
+                    for layer in reversed(self.viewer.layers)
+                    if isinstance(layer, napari.layers.Shapes)
+                ),
+                None,
+            )
+        if layer is None or len(layer.data) == 0:
+            return None
+        index = (
+            max(layer.selected_data)
+            if layer.selected_data
+            else len(layer.data) - 1
+        )
+        vertices = np.asarray(layer.data[index])
+        # shapes coordinates to image pixel coordinates on the last axes
+        ndim = vertices.shape[1]
+        world = (
+            vertices * np.asarray(layer.scale)[-ndim:]
+            + np.asarray(layer.translate)[-ndim:]
+        )
+        pixels = (
+            world - np.asarray(image_layer.translate)[-ndim:]
+        ) / np.asarray(image_layer.scale)[-ndim:]
+        return shape_bounds(pixels, displayed, image_layer.ndim)
+
+    def preview_state(self):
+        image_name = self._widget.params["image"][
+            "widget"
+        ].layer_box.currentText()
+        if image_name not in self.viewer.layers:
+            return None
+        try:
+            state = self._widget.state()
+        except (ValueError, KeyError):
+            return None
+        image = state["inputs"]["image"]
+        psf = np.asarray(state["inputs"]["psf"])
+        channel_axis = state["inputs"].get("channel_axis", -1)
+        grid = state["inputs"].get("psf_grid", [1, 1, 1])
+        stacked = channel_axis >= 0 or np.prod(grid) > 1
+        if image.ndim < psf.ndim - stacked:
+            return None
+        image_layer = self.viewer.layers[image_name]
+        offset = self.viewer.dims.ndim - image.ndim
+        displayed = [
+            axis - offset
+            for axis in self.viewer.dims.displayed
+            if axis >= offset
+        ]
+        point = image_layer.world_to_data(self.viewer.dims.point)
+        crop, keep, origin = preview_region(
+            image.shape,
+            psf[0] if stacked else psf,
+            point,
+            displayed,
+            self._preview_roi(image_layer, displayed),
+        )
+        state["inputs"]["image"] = np.asarray(image[crop])
+        if 0 <= channel_axis < image.ndim:
+            # the PSFs of the previewed channels
+            state["inputs"]["psf"] = psf[crop[channel_axis]]
+        elif np.prod(grid) > 1:
+            # the preview is deconvolved with the PSF interpolated at its
+            # center
+            from ._varying import interpolate_psf
+
+            frame_ndim = psf.ndim - 1
+            center = [
+                start + (item.stop - item.start) / 2
+                for start, item in zip(
+                    origin[-frame_ndim:], keep[-frame_ndim:]
+                )
+            ]
+            state["inputs"]["psf"] = interpolate_psf(
+                psf, grid[-frame_ndim:], center, image.shape[-frame_ndim:]
+            )
+            state["inputs"]["psf_grid"] = [1, 1, 1]
+        # the crop is already extended by the PSF half size, so it is not
+        # padded again
+        overrides = {
+            "pad": 0,
+            "workers": 1,
+            "block_size": [0, 0, 0],
+            "reuse_output": False,
+            "output_store": "",
+            "trace_file": "",
+            "preview_every": 0,
+            "result_cache": False,
+            "resume": False,
+        }
+        state["inputs"].update(
+            {
+                key: value
+                for key, value in overrides.items()
+                if key in state["inputs"]
+            }
+        )
+        scale = np.asarray(image_layer.scale)
+        state["preview"] = {
+            "keep": keep,
+            "scale": tuple(scale),
+            "translate": tuple(
+                np.asarray(origin) * scale + np.asarray(image_layer.translate)
+            ),
+        }
+        return state
+
+
+# ########################################################################### #
+#                                SWienerPlugin
+# ########################################################################### #
+class SWienerPlugin(SDeconvPlugin):
+    def init_widget(self, napari_viewer):
+        return SDictWidget(get_metadata("SWiener"), napari_viewer)
+
+    def init_worker(self):
+        return SDictWorker(get_metadata("SWiener"))
 
 
-# ################################################################################################ #
-#                                    SWienerPlugin
-# ################################################################################################ #
-class SWienerPlugin(SNapariPlugin):
+# ########################################################################### #
+#                            SRichardsonLucyPlugin
+# ########################################################################### #
+class SRichardsonLucyPlugin(SDeconvPlugin):
     def init_widget(self, napari_viewer):
-        return SDictWidget(wiener_metadata, napari_viewer)
+        return SDictWidget(get_metadata("SRichardsonLucy"), napari_viewer)
 
     def init_worker(self):
-        return SDictWorker(wiener_metadata)
+        return SDictWorker(get_metadata("SRichardsonLucy"))
 
 
-# ################################################################################################ #
-#                                 SRichardsonLucyPlugin
-# ################################################################################################ #
-class SRichardsonLucyPlugin(SNapariPlugin):
+# ########################################################################### #
+#                          SBlindRichardsonLucyPlugin
+# ########################################################################### #
+class SBlindRichardsonLucyPlugin(SNapariPlugin):
     def init_widget(self, napari_viewer):
-        return SDictWidget(rl_metadata, napari_viewer)
+        return SDictWidget(get_metadata("SBlindRichardsonLucy"), napari_viewer)
 
     def init_worker(self):
-        return SDictWorker(rl_metadata)
+        return SDictWorker(get_metadata("SBlindRichardsonLucy"))
 
 
-# ################################################################################################ #
-#                                 SSpitfirePlugin
-# ################################################################################################ #
-class SpitfirePlugin(SNapariPlugin):
+# ########################################################################### #
+#                               SSpitfirePlugin
+# ########################################################################### #
+class SpitfirePlugin(SDeconvPlugin):
     def init_widget(self, napari_viewer):
-        return SDictWidget(spitfire_metadata, napari_viewer)
+        return SDictWidget(get_metadata("Spitfire"), napari_viewer)
 
     def init_worker(self):
-        return SDictWorker(spitfire_metadata)
+        return SDictWorker(get_metadata("Spitfire"))
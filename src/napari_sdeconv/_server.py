@@ -0,0 +1,399 @@
+"""Persistent compute server running the plugins in a separate process
+
+The server is a process started on demand by the first job with the
+`compute_server` input. It imports sdeconv and torch and builds the plugins
+metadata once, then keeps its PSF and OTF caches and the torch thread pools
+warm between the runs, so the runs after the first one have almost no startup
+latency and the computation does not hold the GIL of the napari process.
+
+Each job opens a connection to the server (a local socket, or a named pipe on
+Windows) and is run in a server thread by a SDictRunner. The input and output
+images are exchanged through shared memory (see shared_copy and attach_shared),
+the other inputs are pickled. The progress, the previews of the iterations and
+the cancellation requests go through the connection. This module does not
+import Qt, napari or torch
+
+Classes
+-------
+SComputeServer
+
+Functions
+---------
+serve
+
+"""
+import atexit
+import contextlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+import numpy as np
+
+from ._cancel import SCancelledError, SCancelToken
+from ._profiling import SStageProfiler, profile_stage
+from ._shared import (
+    attach_shared,
+    open_shared,
+    shared_copy,
+    shared_empty,
+    shared_spec,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+class _SConnectionObserver:
+    """Observer sending the progress of a job to the client"""
+
+    def __init__(self, send):
+        self._send = send
+
+    def progress(self, value):
+        self._send("progress", value)
+
+    def notify(self, message):
+        self._send("log", message)
+
+
+def _listen(conn, token):
+    """Cancel the job when the client asks for it or closes the connection"""
+    try:
+        while True:
+            if conn.recv()[0] == "cancel":
+                token.cancel()
+    except (EOFError, OSError):
+        token.cancel()
+
+
+def _handle(conn, message):
+    """Run the job received on a connection and send its progress and
+    outputs"""
+    from ._batch import release_memory
+    from ._cache import cache_message
+    from ._metadata import get_metadata
+    from ._runner import SDictRunner
+
+    _, name, state, specs = message
+    lock = threading.Lock()
+
+    def send(*reply):
+        with lock:
+            conn.send(reply)
+
+    token = SCancelToken()
+    threading.Thread(target=_listen, args=(conn, token), daemon=True).start()
+    blocks = []
+    try:
+        for key, spec in specs.items():
+            state["inputs"][key], block = open_shared(spec)
+            blocks.append(block)
+        profiler = SStageProfiler()
+        runner = SDictRunner(
+            get_metadata(name),
+            [_SConnectionObserver(send)],
+            token,
+            lambda data: send("preview", data),
+            profiler,
+        )
+        runner.run(state)
+        output_specs = {}
+        with profiler.activate(), profile_stage("shared memory"):
+            for key, output in state["outputs"].items():
+                if (
+                    isinstance(output["data"], np.ndarray)
+                    and output["data"].dtype != object
+                ):
+                    output_specs[key] = shared_copy(output.pop("data"))
+        send(
+            "done",
+            state["outputs"],
+            output_specs,
+            profiler.events,
+            runner.cache_hit,
+            runner.messages + [cache_message()],
+        )
+    except SCancelledError:
+        release_memory()
+        send("cancelled")
+    except Exception as error:  # pylint: disable=broad-except
+        release_memory()
+        try:
+            send("error", error)
+        except Exception:  # pylint: disable=broad-except
+            # the exception cannot be pickled
+            send("error", RuntimeError(f"{type(error).__name__}: {error}"))
+    finally:
+        # the views of the inputs must be released before their blocks are
+        # closed
+        state["inputs"].clear()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                # a view of the input is still referenced: the block is
+                # released when the view is collected
+                _logger.warning(
+                    "Shared memory block %s of a %s job is still referenced",
+                    block.name,
+                    name,
+                )
+        conn.close()
+
+
+def _warm_up():
+    """Import sdeconv and torch and build the plugins metadata before the first
+    job"""
+    import torch
+
+    from ._metadata import get_metadata, plugin_names
+
+    for name in plugin_names:
+        get_metadata(name)
+    torch.fft.fftn(torch.zeros(8, 8))
+
+
+def _watch_parent():
+    """Exit when the process that started the server exits"""
+    multiprocessing.parent_process().join()
+    os._exit(0)
+
+
+def serve(authkey, ready):
+    """Main function of the compute server process
+
+    Parameters
+    ----------
+    authkey: bytes
+        Key authenticating the connections of the clients
+    ready: multiprocessing.connection.Connection
+        Connection receiving the address of the server once it listens
+
+    """
+    listener = Listener(authkey=authkey)
+    ready.send(listener.address)
+    ready.close()
+    threading.Thread(target=_watch_parent, daemon=True).start()
+    _warm_up()
+    while True:
+        try:
+            conn = listener.accept()
+            message = conn.recv()
+        except (OSError, EOFError, AuthenticationError):
+            continue
+        if message[0] == "shutdown":
+            conn.close()
+            listener.close()
+            return
+        threading.Thread(
+            target=_handle, args=(conn, message), daemon=True
+        ).start()
+
+
+class SComputeServer:
+    """Client of the persistent compute server
+
+    The server process is started by the first job and runs until the napari
+    process exits or `stop` is called. Each job opens its own connection to the
+    server, so the jobs of the run queues of all the plugins can run at the
+    same time in the server
+
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    start_timeout = 60
+
+    @staticmethod
+    def instance():
+        """Static access to the server client"""
+        with SComputeServer.__instance_lock:
+            if SComputeServer.__instance is None:
+                SComputeServer.__instance = SComputeServer()
+            return SComputeServer.__instance
+
+    def __init__(self):
+        self._authkey = os.urandom(32)
+        self._address = None
+        self._process = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    @property
+    def running(self):
+        """True if the server process is running"""
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """Start the server process if it is not running
+
+        Returns
+        -------
+        the address of the server
+
+        """
+        with self._lock:
+            if self.running:
+                return self._address
+            context = multiprocessing.get_context("spawn")
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=serve,
+                args=(self._authkey, sender),
+                name="napari-sdeconv compute server",
+            )
+            process.start()
+            sender.close()
+            if not receiver.poll(self.start_timeout):
+                process.terminate()
+                raise RuntimeError("The compute server did not start")
+            self._address = receiver.recv()
+            receiver.close()
+            self._process = process
+            return self._address
+
+    def stop(self, timeout=5):
+        """Stop the server process, or kill it if it does not stop within
+        timeout seconds"""
+        with self._lock:
+            process, self._process = self._process, None
+            if process is None or not process.is_alive():
+                return
+            try:
+                with Client(self._address, authkey=self._authkey) as conn:
+                    conn.send(("shutdown",))
+            except OSError:
+                pass
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def run(
+        self,
+        name,
+        state,
+        observers=None,
+        token=None,
+        preview=None,
+        profiler=None,
+    ):
+        """Run a plugin in the server and set the outputs data in the state
+
+        An output with a `buffer` array of the shape and data type of the
+        result receives the result, like with SDictRunner
+
+        Parameters
+        ----------
+        name: str
+            Name of the plugin (see get_metadata)
+        state: dict
+            State dictionary with the `inputs` values and the `outputs` to fill
+        observers: list
+            Observers notified of the progress with `progress(int)`
+        token: SCancelToken
+            Cancellation token. The cancellation is sent to the server
+        preview: callable
+            Called with the intermediate results of the iterative algorithms
+        profiler: SStageProfiler
+            Profiler receiving the stages of the job recorded in the server
+
+        Returns
+        -------
+        (cache_hit, messages) the result cache status of the run and the notes
+        of the run for the log (see SDictRunner), with the state of the server
+        PSF cache
+
+        Raises
+        ------
+        SCancelledError if the job is cancelled, or the exception raised by the
+        job
+
+        """
+        address = self.start()
+        activate = (
+            profiler.activate()
+            if profiler is not None
+            else contextlib.nullcontext()
+        )
+        with activate:
+            inputs, specs, arrays = {}, {}, []
+            with profile_stage("shared memory"):
+                for key, value in state["inputs"].items():
+                    if isinstance(value, np.ndarray) and value.dtype != object:
+                        array = shared_empty(value.shape, value.dtype)
+                        np.copyto(array, value)
+                        arrays.append(array)
+                        specs[key] = shared_spec(array)
+                    else:
+                        inputs[key] = value
+            buffers = {
+                key: output.pop("buffer", None)
+                for key, output in state["outputs"].items()
+            }
+            origin = time.perf_counter()
+            with Client(address, authkey=self._authkey) as conn:
+                conn.send(("run", name, {**state, "inputs": inputs}, specs))
+                reply = self._wait(conn, observers or [], token, preview)
+            del arrays
+            _, outputs, output_specs, events, cache_hit, messages = reply
+            if profiler is not None:
+                profiler.merge(events, origin)
+            with profile_stage("copy back"):
+                for key, output in outputs.items():
+                    if key in output_specs:
+                        output["data"] = self._output_data(
+                            attach_shared(output_specs[key]), buffers.get(key)
+                        )
+                    state["outputs"][key] = output
+        return cache_hit, messages
+
+    @staticmethod
+    def _wait(conn, observers, token, preview):
+        """Forward the messages of a running job until it is done"""
+        cancel_sent = False
+        while True:
+            if token is not None and token.cancelled and not cancel_sent:
+                conn.send(("cancel",))
+                cancel_sent = True
+            if not conn.poll(0.05):
+                continue
+            try:
+                reply = conn.recv()
+            except EOFError:
+                raise RuntimeError(
+                    "The compute server stopped during the job"
+                ) from None
+            if reply[0] == "progress":
+                for observer in observers:
+                    observer.progress(reply[1])
+            elif reply[0] == "log":
+                for observer in observers:
+                    observer.notify(reply[1])
+            elif reply[0] == "preview":
+                if preview is not None:
+                    preview(reply[1])
+            elif reply[0] == "cancelled":
+                raise SCancelledError("The run has been cancelled")
+            elif reply[0] == "error":
+                raise reply[1]
+            else:
+                return reply
+
+    @staticmethod
+    def _output_data(data, buffer):
+        """Copy an output into its buffer when it has the same shape and data
+        type"""
+        if (
+            buffer is not None
+            and buffer.flags.writeable
+            and buffer.shape == data.shape
+            and buffer.dtype == data.dtype
+        ):
+            np.copyto(buffer, data)
+            return buffer
+        return data
@@ -0,0 +1,203 @@
+"""Numpy arrays in shared memory written directly by the pool processes
+
+The results of the units deconvolved in a process pool are written by the pool
+processes into an output array allocated in shared memory, instead of being
+pickled back to the main process and copied into the output.
+
+The images of the jobs run by the compute server are exchanged the same way:
+the client copies the inputs into shared arrays and the server copies the
+outputs into new blocks that the client attaches (see shared_copy and
+attach_shared).
+
+A shared memory block stays allocated as long as its array (or a view of it) is
+alive. The blocks of the collected arrays are released at the next allocation
+and at exit
+
+Functions
+---------
+shared_empty
+shared_spec
+write_shared
+open_shared
+shared_copy
+attach_shared
+
+"""
+import atexit
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_blocks = []
+_lock = threading.Lock()
+
+
+def _sweep():
+    """Release the shared memory blocks of the collected arrays"""
+    with _lock:
+        alive = []
+        for array_ref, block in _blocks:
+            if array_ref() is None:
+                block.close()
+                block.unlink()
+            else:
+                alive.append((array_ref, block))
+        _blocks[:] = alive
+
+
+@atexit.register
+def _unlink_all():
+    """Remove the names of the remaining blocks so they are freed with the last
+    mapping"""
+    with _lock:
+        for _, block in _blocks:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        _blocks.clear()
+
+
+def shared_empty(shape, dtype):
+    """Allocate an uninitialized array in shared memory
+
+    Parameters
+    ----------
+    shape: tuple
+        Shape of the array
+    dtype: np.dtype
+        Data type of the array
+
+    Returns
+    -------
+    the array as a np.ndarray
+
+    """
+    _sweep()
+    size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    with _lock:
+        _blocks.append((weakref.ref(array), block))
+    return array
+
+
+def shared_spec(array):
+    """Description of a shared array that can be sent to another process
+
+    Parameters
+    ----------
+    array: np.ndarray
+        Array allocated with shared_empty
+
+    Returns
+    -------
+    (block name, shape, dtype) of the array, or None if it is not in shared
+    memory
+
+    """
+    with _lock:
+        for array_ref, block in _blocks:
+            if array_ref() is array:
+                return block.name, array.shape, array.dtype.str
+    return None
+
+
+def write_shared(spec, indices, result):
+    """Write the result of a unit into a shared array from a pool process
+
+    Parameters
+    ----------
+    spec: tuple
+        Description of the array given by shared_spec
+    indices: tuple or list
+        Index of the frame in the array, or list of the indices of a batch of
+        frames
+    result: np.ndarray
+        Deconvolved frame, or batch of frames
+
+    """
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if isinstance(indices, tuple):
+            array[indices] = result
+        else:
+            for index, frame in zip(indices, result):
+                array[index] = frame
+        del array
+    finally:
+        block.close()
+
+
+def open_shared(spec):
+    """Open a shared array of another process without taking its ownership
+
+    Parameters
+    ----------
+    spec: tuple
+        Description of the array given by shared_spec
+
+    Returns
+    -------
+    (array, block). The block must be closed when the array and its views are
+    deleted
+
+    """
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+
+def shared_copy(array):
+    """Copy an array into a new shared memory block for another process
+
+    The block is not released by this process: the process receiving the
+    description takes its ownership with attach_shared
+
+    Parameters
+    ----------
+    array: np.ndarray
+        Array to copy
+
+    Returns
+    -------
+    (block name, shape, dtype) of the copy
+
+    """
+    size = max(1, array.nbytes)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        copy = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        np.copyto(copy, array)
+        del copy
+    finally:
+        block.close()
+    return block.name, array.shape, array.dtype.str
+
+
+def attach_shared(spec):
+    """Take the ownership of a shared array created by another process with
+    shared_copy
+
+    The block is released when the returned array is collected, like the arrays
+    allocated with shared_empty
+
+    Parameters
+    ----------
+    spec: tuple
+        Description of the array given by shared_copy
+
+    Returns
+    -------
+    the array as a np.ndarray
+
+    """
+    _sweep()
+    array, block = open_shared(spec)
+    with _lock:
+        _blocks.append((weakref.ref(array), block))
+    return array
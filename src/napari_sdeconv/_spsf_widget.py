@@ -6,37 +6,29 @@ see: https://napari.org/plugins/guides.html?#widgets
 
 Replace code below according to your needs.
 """
-from typing import TYPE_CHECKING
-
-from sdeconv.psfs.gaussian import metadata as gaussian_metadata
-from sdeconv.psfs.gibson_lanni import metadata as gl_metadata
-from sdeconv.psfs import SPSFGaussian, SPSFGibsonLanni
-
-from ._framework import SNapariPlugin
 from ._dict_widget import SDictWidget
 from ._dict_worker import SDictWorker
-
-if TYPE_CHECKING:
-    import napari
+from ._framework import SNapariPlugin
+from ._metadata import get_metadata
 
 
-# ################################################################################################ #
-#                                    SGaussianPlugin
-# ################################################################################################ #
+# ########################################################################### #
+#                               SGaussianPlugin
+# ########################################################################### #
 class SGaussianPlugin(SNapariPlugin):
     def init_widget(self, napari_viewer):
-        return SDictWidget(gaussian_metadata)
+        return SDictWidget(get_metadata("SPSFGaussian"))
 
     def init_worker(self):
-        return SDictWorker(gaussian_metadata)
+        return SDictWorker(get_metadata("SPSFGaussian"))
 
 
-# ################################################################################################ #
-#                                    SGibsonLanniPlugin
-# ################################################################################################ #
+# ########################################################################### #
+#                              SGibsonLanniPlugin
+# ########################################################################### #
 class SGibsonLanniPlugin(SNapariPlugin):
     def init_widget(self, napari_viewer):
-        return SDictWidget(gl_metadata)
+        return SDictWidget(get_metadata("SPSFGibsonLanni"))
 
     def init_worker(self):
-        return SDictWorker(gl_metadata)
+        return SDictWorker(get_metadata("SPSFGibsonLanni"))
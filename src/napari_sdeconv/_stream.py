@@ -0,0 +1,317 @@
+"""Streaming deconvolution of the time points appended to an image during an
+acquisition
+
+A reader thread (the producer) copies the new time points of the source image
+into a bounded queue and a deconvolution thread (the consumer) deconvolves them
+by batches with an OTF calculated once for the whole stream. The queue bounds
+the number of time points waiting in memory: when the deconvolution is slower
+than the acquisition, the reader waits and the new time points stay in the
+source. This module does not import Qt, napari or torch
+
+Classes
+-------
+SFrameStream
+
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+from ._cache import cached_otf
+from ._cancel import SCancelledError, SCancelToken
+
+
+class SFrameStream:
+    """Deconvolve the time points of an image as they are appended to its first
+    axis
+
+    The time points are deconvolved frame by frame with a single PSF: the axes
+    of a time point before the PSF axes (ex: channels) are frames deconvolved
+    with the same OTF. The PSF and its OTF stay in memory until the stream
+    stops. The deconvolved time points are written into an output array whose
+    capacity doubles when it is full, so appending a time point does not copy
+    the previous ones
+
+    Parameters
+    ----------
+    batch: SBatchDeconv
+        Batched deconvolution
+    psf: np.ndarray
+        Point spread function
+    params: dict
+        Parameters of the batched deconvolution (ex: niter, pad, compute_type,
+        fft_padding)
+    on_frames: callable
+        Called from the deconvolution thread with the number of deconvolved
+        time points and the latency in seconds of the last one, between its
+        arrival and its deconvolution
+    on_error: callable
+        Called from the deconvolution thread with the exception stopping the
+        stream
+    max_pending: int
+        Maximum number of time points read from the source and waiting for the
+        deconvolution
+    batch_size: int
+        Maximum number of waiting time points deconvolved in one call
+
+    """
+
+    def __init__(
+        self,
+        batch,
+        psf,
+        params,
+        on_frames=None,
+        on_error=None,
+        max_pending=4,
+        batch_size=1,
+    ):
+        self.batch = batch
+        self.psf = np.asarray(psf)
+        self.params = params
+        self.on_frames = on_frames
+        self.on_error = on_error
+        self.batch_size = max(1, batch_size)
+        self.error = None
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._condition = threading.Condition()
+        self._token = SCancelToken()
+        self._source = None
+        self._arrivals = {}
+        self._otf = None
+        self._output = None
+        self._count = 0
+        self._threads = []
+
+    @classmethod
+    def from_state(cls, metadata, state, on_frames=None, on_error=None):
+        """Create the stream of a deconvolution plugin from its state
+
+        Parameters
+        ----------
+        metadata: dict
+            Metadata of a deconvolution plugin with a batched deconvolution
+        state: dict
+            State dictionary of the plugin. The image input is the source of
+            the stream
+        on_frames: callable
+            See SFrameStream
+        on_error: callable
+            See SFrameStream
+
+        Returns
+        -------
+        the stream, not started
+
+        Raises
+        ------
+        ValueError if the state cannot be streamed
+
+        """
+        if metadata.get("batch") is None:
+            raise ValueError(f'{metadata["label"]} cannot deconvolve a stream')
+        params, options = {}, {}
+        for key, value in state["inputs"].items():
+            if metadata["inputs"].get(key, {}).get("execution", False):
+                options[key] = value
+            else:
+                params[key] = value
+        if any(isinstance(value, list) for value in params.values()):
+            raise ValueError("A stream cannot sweep parameters")
+        if (
+            options.get("channel_axis", -1) >= 0
+            or np.prod(options.get("psf_grid", (1, 1, 1))) > 1
+        ):
+            raise ValueError("A stream is deconvolved with a single PSF")
+        image = params.pop("image")
+        psf = np.asarray(params.pop("psf"))
+        if np.ndim(image) <= psf.ndim:
+            raise ValueError(
+                "The streamed image needs a time axis before the PSF axes"
+            )
+        params.update(
+            {
+                key: options[key]
+                for key in ("tolerance", "fft_padding", "compute_type")
+                if options.get(key) is not None
+            }
+        )
+        return cls(
+            metadata["batch"],
+            psf,
+            params,
+            on_frames,
+            on_error,
+            batch_size=options.get("batch_size", 1),
+        )
+
+    @property
+    def running(self):
+        """True if the threads of the stream are running"""
+        return any(thread.is_alive() for thread in self._threads)
+
+    @property
+    def count(self):
+        """Number of deconvolved time points"""
+        return self._count
+
+    @property
+    def output(self):
+        """The deconvolved time points, or None before the first one"""
+        output, count = self._output, self._count
+        return None if output is None else output[:count]
+
+    def start(self, source):
+        """Start the threads and deconvolve the time points of the source
+
+        Parameters
+        ----------
+        source: np.ndarray
+            Image whose first axis is the time
+
+        """
+        self.update(source)
+        self._threads = [
+            threading.Thread(
+                target=self._read,
+                daemon=True,
+                name="napari-sdeconv stream reader",
+            ),
+            threading.Thread(
+                target=self._deconvolve,
+                daemon=True,
+                name="napari-sdeconv stream deconvolution",
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def update(self, source):
+        """Set the new data of the source and deconvolve its new time points
+
+        Parameters
+        ----------
+        source: np.ndarray
+            Image whose first axis is the time. Its first time points are the
+            ones of the previous source
+
+        """
+        now = time.perf_counter()
+        with self._condition:
+            previous = 0 if self._source is None else len(self._source)
+            for index in range(previous, len(source)):
+                self._arrivals[index] = now
+            self._source = source
+            self._condition.notify_all()
+
+    def stop(self, timeout=None):
+        """Stop the stream. The time point being deconvolved is cancelled"""
+        self._token.cancel()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def _put(self, item):
+        """Put an item in the queue, waiting for a free place until the stream
+        stops"""
+        while not self._token.cancelled:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self):
+        """Get an item from the queue, or None when the stream stops"""
+        while not self._token.cancelled:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _read(self):
+        """Producer: copy the new time points of the source into the queue"""
+        index = 0
+        while True:
+            with self._condition:
+                while not self._token.cancelled and len(self._source) <= index:
+                    self._condition.wait()
+                if self._token.cancelled:
+                    break
+                source = self._source
+                arrival = self._arrivals.pop(index, time.perf_counter())
+            # the time point is copied: the source can be replaced or grown in
+            # place
+            if not self._put((index, np.array(source[index]), arrival)):
+                break
+            index += 1
+
+    def _deconvolve(self):
+        """Consumer: deconvolve the queued time points by batches"""
+        from ._batch import SIterationMonitor
+
+        monitor = SIterationMonitor(token=self._token)
+        try:
+            while True:
+                item = self._get()
+                if item is None:
+                    return
+                # the time points waiting in the queue are deconvolved in the
+                # same batch
+                items = [item]
+                while len(items) < self.batch_size:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._deconvolve_items(items, monitor)
+        except SCancelledError:
+            pass
+        except Exception as error:  # pylint: disable=broad-except
+            self.error = error
+            self._token.cancel()
+            if self.on_error is not None:
+                self.on_error(error)
+
+    def _deconvolve_items(self, items, monitor):
+        """Deconvolve consecutive time points and append them to the output"""
+        points = np.stack([item[1] for item in items])
+        frame_shape = points.shape[points.ndim - self.psf.ndim :]
+        if self._otf is None:
+            # the OTF is kept for the whole stream, even when the PSF cache
+            # drops it
+            self._otf = cached_otf(
+                self.batch, self.psf, frame_shape, self.params
+            )
+        result = self.batch(
+            points.reshape((-1,) + frame_shape),
+            self._otf,
+            monitor,
+            **self.params,
+        )
+        self._append(items[0][0], result.reshape(points.shape))
+        if self.on_frames is not None:
+            self.on_frames(self._count, time.perf_counter() - items[-1][2])
+
+    def _append(self, start, points):
+        """Write deconvolved time points into the output, growing its capacity
+        if needed"""
+        stop = start + len(points)
+        output = self._output
+        if output is None or len(output) < stop:
+            capacity = max(stop, 2 * (0 if output is None else len(output)))
+            grown = np.empty(
+                (capacity,) + points.shape[1:], dtype=points.dtype
+            )
+            if output is not None:
+                grown[:start] = output[:start]
+            output = grown
+        output[start:stop] = points
+        self._output = output
+        self._count = stop
@@ -0,0 +1,184 @@
+"""Parameter sweeps
+
+A number input of a plugin can be given a list of values (`1e-5, 1e-4, 1e-3`)
+or a range (`10:50:10`, where the stop value is included). The plugin is then
+run for every combination of the swept values and the results are stacked along
+a first sweep axis.
+
+Classes
+-------
+SSweepUnit
+
+Functions
+---------
+parse_values
+sweep_keys
+sweep_combinations
+sweep_label
+
+"""
+import itertools
+
+import numpy as np
+
+
+def parse_values(text, number_type):
+    """Parse a number, a list of numbers or a range
+
+    Parameters
+    ----------
+    text: str
+        A number, numbers separated by commas, or a range start:stop:step
+        including stop
+    number_type: str
+        int or float
+
+    Returns
+    -------
+    the number, or the list of the numbers of a list or a range
+
+    """
+    cast = int if number_type == "int" else float
+    if "," in text:
+        return [cast(value) for value in text.split(",") if value.strip()]
+    if ":" in text:
+        parts = [cast(value) for value in text.split(":")]
+        if len(parts) != 3 or parts[2] <= 0 or parts[1] < parts[0]:
+            raise ValueError(f"{text} is not a range start:stop:step")
+        start, stop, step = parts
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        # rounding removes the floating point errors of the steps (ex: 0.1 + 2
+        # * 0.1)
+        return [cast(round(start + i * step, 12)) for i in range(count)]
+    return cast(text)
+
+
+def sweep_keys(metadata, params):
+    """Names of the number inputs given a list of values
+
+    Parameters
+    ----------
+    metadata: dict
+        Metadata of the plugin
+    params: dict
+        Parameters of the plugin function
+
+    Returns
+    -------
+    list of the swept parameter names, in the order of the metadata
+
+    """
+    return [
+        key
+        for key, value in params.items()
+        if metadata["inputs"].get(key, {}).get("type") in ("int", "float")
+        and isinstance(value, (list, tuple))
+    ]
+
+
+def sweep_combinations(params, keys):
+    """All the combinations of the values of the swept parameters
+
+    Parameters
+    ----------
+    params: dict
+        Parameters of the plugin function
+    keys: list
+        Names of the swept parameters
+
+    Returns
+    -------
+    list of dict of the swept parameters values. The last parameter varies the
+    fastest
+
+    """
+    return [
+        dict(zip(keys, values))
+        for values in itertools.product(*(params[key] for key in keys))
+    ]
+
+
+def sweep_label(combination):
+    """Label of a combination of the swept parameters (ex: 'beta=0.001,
+    pad=4')"""
+    return ", ".join(f"{key}={value:g}" for key, value in combination.items())
+
+
+class SSweepUnit:
+    """Deconvolution of a whole image with the parameters of one combination of
+    a sweep
+
+    The unit is called like a sdeconv function and runs the frames, blocks and
+    batches of the image in the calling process, so the combinations of a sweep
+    can be run in parallel by a SUnitExecutor. It profiles its own stages
+
+    Parameters
+    ----------
+    fnc: callable
+        sdeconv deconvolution function
+    batch: SBatchDeconv
+        Batched implementation of the deconvolution function
+    batch_size: int
+        Number of frames in a batch
+    batch_params: dict
+        Parameters of the batched deconvolution that the deconvolution function
+        does not have
+    compute_type: str
+        Precision of the computation
+    block_size: tuple
+        Size of the blocks for tiled deconvolution. None deconvolves each frame
+        at once
+    overlap: tuple
+        Overlap between blocks
+    token: SCancelToken
+        Cancellation token. It must be None when the unit is run in a process
+        pool
+    channel_axis: int
+        Axis of the channels of the image when the PSF has one PSF per channel
+
+    """
+
+    stage = "deconvolution"
+
+    def __init__(
+        self,
+        fnc,
+        batch=None,
+        batch_size=1,
+        batch_params=None,
+        compute_type=None,
+        block_size=None,
+        overlap=None,
+        token=None,
+        channel_axis=None,
+    ):
+        self.fnc = fnc
+        self.batch = batch
+        self.batch_size = batch_size
+        self.batch_params = batch_params
+        self.compute_type = compute_type
+        self.block_size = block_size
+        self.overlap = overlap
+        self.token = token
+        self.channel_axis = channel_axis
+
+    def __call__(self, image, psf, **params):
+        # the widgets parse the sweeps without loading the deconvolution
+        # modules and torch
+        from ._parallel import SUnitExecutor, deconv_frames
+
+        with SUnitExecutor(token=self.token) as executor:
+            return deconv_frames(
+                self.fnc,
+                image,
+                psf,
+                params,
+                executor,
+                self.block_size,
+                self.overlap,
+                batch=self.batch,
+                batch_size=self.batch_size,
+                batch_params=self.batch_params,
+                compute_type=self.compute_type,
+                channel_axis=self.channel_axis,
+            )
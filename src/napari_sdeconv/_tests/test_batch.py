@@ -0,0 +1,245 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+import torch
+from sdeconv.data import celegans
+from sdeconv.deconv.richardson_lucy import srichardsonlucy
+from sdeconv.deconv.spitfire import Spitfire
+from sdeconv.deconv.wiener import swiener
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._batch import (
+    SBatchRichardsonLucy,
+    SBatchSpitfire,
+    SBatchWiener,
+    SIterationMonitor,
+    release_memory,
+)
+from napari_sdeconv._cache import SPSFCache, SResumeCache
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._runner import SDictRunner
+
+
+def test_batch_wiener_matches_sdeconv():
+    image = np.random.random((64, 64)).astype(np.float32)
+    psf = SPSFGaussian((1.5, 1.5), (15, 15))().numpy()
+    batch = SBatchWiener()
+    otf = batch.otf(psf, image.shape, beta=1e-3, pad=4)
+    out = batch(image[None], otf, beta=1e-3, pad=4)
+    np.testing.assert_allclose(
+        out[0], swiener(image, psf, 1e-3, 4).numpy(), atol=1e-4
+    )
+
+
+# sdeconv deconvolves a 3D image with a PSF of the same shape
+@pytest.mark.parametrize(
+    "shape, psf_shape, sigma",
+    [
+        ((64, 64), (15, 15), (1.5, 1.5)),
+        ((16, 48, 48), (16, 48, 48), (1, 1.5, 1.5)),
+    ],
+)
+def test_batch_richardson_lucy_and_wiener_match_sdeconv(
+    shape, psf_shape, sigma
+):
+    image = np.random.random(shape).astype(np.float32) + 1
+    psf = SPSFGaussian(sigma, psf_shape)().numpy()
+    runs = [
+        (SBatchWiener(), swiener, {"beta": 1e-3, "pad": 4}),
+        (SBatchRichardsonLucy(), srichardsonlucy, {"niter": 10, "pad": 4}),
+    ]
+    for batch, function, params in runs:
+        otf = batch.otf(psf, shape, fft_padding="off", **params)
+        out = batch(image[None], otf, fft_padding="off", **params)
+        expected = function(image, psf, *params.values()).numpy()
+        np.testing.assert_allclose(out[0], expected, rtol=1e-4, atol=1e-5)
+
+
+def _default_state(metadata, **inputs):
+    state = {
+        "name": metadata["name"],
+        "inputs": {
+            key: value.get("default")
+            for key, value in metadata["inputs"].items()
+        },
+        "outputs": {"image": {"type": "Image", "label": "Deconvolved"}},
+    }
+    state["inputs"].update(inputs)
+    return state
+
+
+# the batched Spitfire computes its data term in the Fourier domain, which
+# changes the values on the image border
+@pytest.mark.parametrize(
+    "name, tolerance",
+    [("SWiener", 1e-5), ("SRichardsonLucy", 1e-5), ("Spitfire", 5e-3)],
+)
+def test_single_image_matches_sdeconv(name, tolerance):
+    metadata = get_metadata(name)
+    image = np.random.random((40, 40)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    state = _default_state(metadata, image=image, psf=psf, fft_padding="off")
+    params, _ = SDictRunner(metadata).split_inputs(state["inputs"])
+    expected = metadata["fnc"](**params).detach().numpy()
+    out = SDictRunner(metadata).run(state)["outputs"]["image"]["data"]
+    assert np.linalg.norm(out - expected) < tolerance * np.linalg.norm(
+        expected
+    )
+
+
+def test_single_image_reuses_the_cached_otf():
+    metadata = get_metadata("SWiener")
+    image = np.random.random((40, 40)).astype(np.float32)
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    cache = SPSFCache.instance()
+    cache.clear()
+    SDictRunner(metadata).run(_default_state(metadata, image=image, psf=psf))
+    misses = cache.misses
+    assert cache.hits == 0 and misses > 0
+    SDictRunner(metadata).run(_default_state(metadata, image=image, psf=psf))
+    assert cache.hits == misses and cache.misses == misses
+
+
+class _Progress:
+    def __init__(self):
+        self.values = []
+
+    def progress(self, value):
+        self.values.append(value)
+
+
+@pytest.mark.parametrize("name", ["SRichardsonLucy", "Spitfire"])
+def test_single_image_reports_the_iterations(name):
+    metadata = get_metadata(name)
+    image = np.random.random((40, 40)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    observer = _Progress()
+    SDictRunner(metadata, [observer]).run(
+        _default_state(metadata, image=image, psf=psf)
+    )
+    assert len(observer.values) > 20
+    assert observer.values == sorted(observer.values)
+    assert observer.values[-1] == 100
+
+
+def test_batch_spitfire_3d_matches_sdeconv():
+    # float64 because Adam amplifies the float32 rounding differences
+    plane = celegans().numpy()[100:132, 100:132].astype(np.float64)
+    profile = np.exp(-((np.arange(12) - 6) ** 2) / 8)
+    image = profile[:, None, None] * plane + 0.01
+    psf = SPSFGaussian((1, 1.5, 1.5), image.shape)().numpy().astype(np.float64)
+    params = {"weight": 0.6, "delta": 1, "reg": 0.995, "pad": 4}
+    function = Spitfire(
+        torch.from_numpy(psf), gradient_step=0.01, precision=1e-7, **params
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = function(torch.from_numpy(image)).detach().numpy()
+    batch = SBatchSpitfire()
+    otf = batch.otf(
+        psf, image.shape, fft_padding="off", compute_type="float64", **params
+    )
+    state = {}
+    out = batch(
+        image[None],
+        otf,
+        fft_padding="off",
+        compute_type="float64",
+        state=state,
+        **params,
+    )
+    # sdeconv counts the iteration where the loss increases
+    assert state["iteration"] == function.niter_ - 1
+    np.testing.assert_allclose(out[0], expected, rtol=1e-5, atol=1e-6)
+
+
+def test_batch_richardson_lucy_frames_are_independent():
+    images = np.random.random((3, 8, 32, 32)).astype(np.float32)
+    psf = SPSFGaussian((1, 1.5, 1.5), (8, 32, 32))().numpy()
+    batch = SBatchRichardsonLucy()
+    otf = batch.otf(psf, images.shape[1:], niter=5, pad=2)
+    out = batch(images, otf, niter=5, pad=2)
+    assert out.shape == images.shape
+    np.testing.assert_allclose(
+        out[1], batch(images[1:2], otf, niter=5, pad=2)[0], rtol=1e-4
+    )
+
+
+def test_richardson_lucy_early_stop_and_preview():
+    image = np.random.random((48, 48)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (15, 15))().numpy()
+    progress = []
+    previews = []
+    monitor = SIterationMonitor(progress.append, previews.append, every=2)
+    batch = SBatchRichardsonLucy()
+    otf = batch.otf(psf, image.shape, pad=4)
+    batch(image[None], otf, monitor=monitor, niter=500, pad=4, tolerance=1e-2)
+    assert 0 < len(progress) < 500
+    assert len(previews) == len(progress) // 2
+    assert previews[0].shape == image.shape
+
+
+def test_richardson_lucy_resumes_from_the_last_run():
+    metadata = get_metadata("SRichardsonLucy")
+    image = np.random.random((2, 40, 40)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+
+    def run(**inputs):
+        state = {
+            "name": metadata["name"],
+            "inputs": {
+                key: value.get("default")
+                for key, value in metadata["inputs"].items()
+            },
+            "outputs": {"image": {"type": "Image", "label": "Deconvolved"}},
+        }
+        state["inputs"].update(image=image, psf=psf, **inputs)
+        runner = SDictRunner(metadata)
+        return runner.run(state)["outputs"]["image"]["data"], runner.messages
+
+    SResumeCache.instance().clear()
+    run(niter=5, resume=True)
+    resumed, messages = run(niter=12, resume=True)
+    assert messages == ["Resumed from iteration 5 to 12"]
+    restarted, _ = run(niter=12)
+    np.testing.assert_allclose(resumed, restarted, rtol=1e-5)
+    release_memory()
+    assert len(SResumeCache.instance()) == 0
+
+
+def test_spitfire_continues_from_its_optimizer_state():
+    images = np.random.random((1, 32, 32)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    batch = SBatchSpitfire()
+    otf = batch.otf(psf, images.shape[1:], pad=0)
+    state = {}
+    first = batch(images, otf, state=state, precision=1e-2)
+    assert state["converged"].all()
+    # the same criteria return the converged result, more iterations continue
+    # from it
+    np.testing.assert_allclose(
+        batch(images, otf, state=state, precision=1e-2), first
+    )
+    iteration = state["iteration"]
+    batch(images, otf, state=state, precision=1e-2, more_iterations=4)
+    assert state["iteration"] == iteration + 4 and state["start"] == iteration
+
+
+def test_spitfire_frames_stop_independently():
+    images = np.random.random((2, 32, 32)).astype(np.float32) + 1
+    images[1] = images[1] ** 3
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    batch = SBatchSpitfire()
+    otf = batch.otf(psf, images.shape[1:], pad=4)
+    progress = []
+    out = batch(
+        images, otf, SIterationMonitor(progress.append), pad=4, precision=1e-5
+    )
+    assert progress == sorted(progress) and progress[-1] < 1
+    for i in range(2):
+        np.testing.assert_allclose(
+            out[i],
+            batch(images[i : i + 1], otf, pad=4, precision=1e-5)[0],
+            rtol=1e-5,
+        )
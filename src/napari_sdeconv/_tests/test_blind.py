@@ -0,0 +1,42 @@
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._runner import SDictRunner
+
+
+def test_blind_richardson_lucy_estimates_image_and_psf():
+    rng = np.random.default_rng(0)
+    truth = np.zeros((64, 64), dtype=np.float32)
+    truth[rng.integers(8, 56, 20), rng.integers(8, 56, 20)] = 100
+    image = gaussian_filter(truth, 2) + 0.01
+    metadata = get_metadata("SBlindRichardsonLucy")
+    inputs = {
+        key: value["default"]
+        for key, value in metadata["inputs"].items()
+        if "default" in value
+    }
+    inputs.update(
+        {
+            "image": image,
+            "sigma": [2, 2],
+            "psf_size": [11, 11],
+            "niter": 20,
+            "pad": 4,
+        }
+    )
+    state = {
+        "inputs": inputs,
+        "outputs": {
+            key: dict(value) for key, value in metadata["outputs"].items()
+        },
+    }
+    outputs = SDictRunner(metadata).run(state)["outputs"]
+    deconvolved, psf = outputs["image"]["data"], outputs["psf"]["data"]
+    assert deconvolved.shape == image.shape and psf.shape == (11, 11)
+    assert psf.min() >= 0 and np.isclose(psf.sum(), 1)
+    assert np.unravel_index(psf.argmax(), psf.shape) == (5, 5)
+    assert (
+        np.corrcoef(deconvolved.ravel(), truth.ravel())[0, 1]
+        > np.corrcoef(image.ravel(), truth.ravel())[0, 1]
+    )
@@ -0,0 +1,24 @@
+import numpy as np
+
+from napari_sdeconv._cache import SLRUCache, array_digest, freeze
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = SLRUCache(max_bytes=200)
+    cache.get("a", lambda: np.zeros(10))
+    cache.get("b", lambda: np.zeros(10))
+    cache.get("a", lambda: np.ones(10))
+    cache.get("c", lambda: np.zeros(10))
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert len(cache) == 2 and cache.size == 160
+    assert cache.get("a", lambda: np.ones(10)).sum() == 0
+    assert cache.get("b", lambda: np.ones(10)).sum() == 10
+
+
+def test_cache_keys():
+    assert freeze({"sigma": [0, 1.5], "shape": (1, 2)}) == freeze(
+        {"shape": [1, 2], "sigma": (0, 1.5)}
+    )
+    array = np.arange(12.0).reshape(3, 4)
+    assert array_digest(array) == array_digest(array.copy())
+    assert array_digest(array) != array_digest(array.T)
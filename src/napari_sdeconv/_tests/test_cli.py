@@ -0,0 +1,73 @@
+import json
+import os
+
+import numpy as np
+
+from napari_sdeconv._cli import main, manifest_name
+
+
+def _write_inputs(tmp_path):
+    os.makedirs(tmp_path / "in")
+    for i in range(2):
+        np.save(
+            tmp_path / "in" / f"image{i}.npy",
+            np.random.random((32, 32)).astype(np.float32),
+        )
+    state = {
+        "name": "SWiener",
+        "inputs": {
+            "psf": {
+                "name": "SPSFGaussian",
+                "inputs": {"sigma": [0, 1.5, 1.5], "shape": [1, 9, 9]},
+            },
+            "beta": 1e-5,
+            "pad": 4,
+        },
+    }
+    with open(tmp_path / "wiener.json", "w", encoding="utf-8") as file:
+        json.dump(state, file)
+
+
+def test_cli_processes_files_and_resumes(tmp_path, capsys):
+    _write_inputs(tmp_path)
+    args = [
+        str(tmp_path / "wiener.json"),
+        str(tmp_path / "in"),
+        "-o",
+        str(tmp_path / "out"),
+    ]
+    assert main(args) == 0
+    for i in range(2):
+        assert np.load(tmp_path / "out" / f"image{i}.npy").shape == (32, 32)
+    assert os.path.isfile(tmp_path / "out" / manifest_name)
+
+    capsys.readouterr()
+    assert main(args) == 0
+    assert "0 of 2 files to process" in capsys.readouterr().out
+
+
+def test_cli_processes_the_files_again_with_a_new_psf(tmp_path, capsys):
+    _write_inputs(tmp_path)
+    psf = np.zeros((9, 9), dtype=np.float32)
+    psf[3:6, 3:6] = 1 / 9
+    np.save(tmp_path / "psf.npy", psf)
+    state = {"name": "SWiener", "inputs": {"psf": "psf.npy", "pad": 4}}
+    with open(tmp_path / "wiener.json", "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    args = [
+        str(tmp_path / "wiener.json"),
+        str(tmp_path / "in"),
+        "-o",
+        str(tmp_path / "out"),
+    ]
+    assert main(args) == 0
+
+    # the same PSF written again keeps the results
+    np.save(tmp_path / "psf.npy", psf)
+    capsys.readouterr()
+    assert main(args) == 0
+    assert "0 of 2 files to process" in capsys.readouterr().out
+
+    np.save(tmp_path / "psf.npy", np.roll(psf, 1, axis=0))
+    assert main(args) == 0
+    assert "2 of 2 files to process" in capsys.readouterr().out
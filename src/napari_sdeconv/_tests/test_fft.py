@@ -0,0 +1,56 @@
+import numpy as np
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._batch import SBatchRichardsonLucy
+from napari_sdeconv._cache import SPSFCache
+from napari_sdeconv._fft import next_fast_size, padding_widths
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._runner import SDictRunner
+
+
+def test_next_fast_size():
+    assert [next_fast_size(size) for size in (1, 7, 97, 1021, 1024)] == [
+        1,
+        8,
+        100,
+        1024,
+        1024,
+    ]
+    assert padding_widths((97, 60), pad=2) == [(5, 6), (2, 2)]
+    assert padding_widths((97, 60), pad=2, mode="off") == [(2, 2), (2, 2)]
+
+
+def test_fast_padding_crops_back():
+    images = np.random.random((2, 37, 41)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    batch = SBatchRichardsonLucy()
+    outs = {}
+    for mode in ("off", "reflect"):
+        otf = batch.otf(psf, images.shape[1:], pad=4, fft_padding=mode)
+        outs[mode] = batch(images, otf, niter=5, pad=4, fft_padding=mode)
+        assert outs[mode].shape == images.shape
+    inner = (slice(None), slice(8, -8), slice(8, -8))
+    np.testing.assert_allclose(
+        outs["reflect"][inner], outs["off"][inner], rtol=1e-3
+    )
+
+
+def test_single_image_is_padded_to_fast_sizes_by_default():
+    metadata = get_metadata("SRichardsonLucy")
+    image = np.random.random((37, 37)).astype(np.float32)
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    state = {
+        "name": metadata["name"],
+        "inputs": {
+            key: value.get("default")
+            for key, value in metadata["inputs"].items()
+        },
+        "outputs": {"image": {"type": "Image", "label": "Deconvolved"}},
+    }
+    state["inputs"].update(image=image, psf=psf, niter=2, pad=13)
+    cache = SPSFCache.instance()
+    cache.clear()
+    out = SDictRunner(metadata).run(state)["outputs"]["image"]["data"]
+    assert out.shape == image.shape
+    # 37 + 2 * 13 = 63 is padded to 64
+    assert [value.shape for value, _ in cache._items.values()] == [(64, 64)]
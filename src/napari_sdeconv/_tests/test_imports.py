@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+# cumulative import time of the napari_sdeconv package, in microseconds
+IMPORT_BUDGET_US = 50000
+
+
+def _import(statement):
+    """Run an import in a new interpreter and return its -X importtime
+    report"""
+    code = f"{statement}; import sys; print(sorted(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stderr, result.stdout
+
+
+def test_package_import_budget():
+    report, modules = _import("import napari_sdeconv")
+    times = {
+        line.split("|")[2].strip(): int(line.split("|")[1])
+        for line in report.splitlines()
+        if line.startswith("import time:")
+        and line.split("|")[1].strip().isdigit()
+    }
+    assert times["napari_sdeconv"] < IMPORT_BUDGET_US
+    for module in ("torch", "sdeconv", "napari", "qtpy"):
+        assert f"'{module}'" not in modules
+
+
+def test_widgets_import_without_torch():
+    _, modules = _import(
+        "import napari_sdeconv._sdeconv_widget, napari_sdeconv._spsf_widget, "
+        "napari_sdeconv._sample_data, napari_sdeconv._metadata"
+    )
+    assert "'torch'" not in modules and "'sdeconv'" not in modules
@@ -0,0 +1,25 @@
+import dask.array as da
+import numpy as np
+
+from napari_sdeconv._lazy import deconv_lazy, is_lazy
+
+
+def _scale(image, psf, factor):
+    return factor * np.asarray(image)
+
+
+def test_deconv_lazy_is_lazy_and_blockwise():
+    image = np.random.random((3, 100, 90))
+    lazy = da.from_array(image, chunks=(1, 40, 40))
+    out = deconv_lazy(_scale, lazy, np.ones((5, 5)), {"factor": 2})
+    assert is_lazy(lazy) and is_lazy(out) and not is_lazy(image)
+    assert out.chunks == lazy.chunks
+    np.testing.assert_allclose(out.compute(), 2 * image)
+
+
+def test_deconv_lazy_overlap_larger_than_the_chunks():
+    image = np.random.random((2, 30, 4))
+    lazy = da.from_array(image, chunks=(1, 16, 2))
+    out = deconv_lazy(_scale, lazy, np.ones((11, 11)), {"factor": 2})
+    assert out.shape == image.shape
+    np.testing.assert_allclose(out.compute(), 2 * image)
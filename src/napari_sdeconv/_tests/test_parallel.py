@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from napari_sdeconv._cancel import SCancelledError, SCancelToken
+from napari_sdeconv._parallel import SUnitExecutor, deconv_frames
+from napari_sdeconv._shared import shared_spec
+
+
+def _scale(image, psf, factor):
+    return factor * np.asarray(image)
+
+
+def _sleep(image, psf, seconds):
+    time.sleep(seconds)
+    return image
+
+
+def _threads(image, psf):
+    import torch
+
+    return np.full(image.shape, torch.get_num_threads())
+
+
+def test_deconv_frames_in_order():
+    image = np.random.random((3, 2, 20, 30))
+    with SUnitExecutor(workers=2) as executor:
+        out = deconv_frames(
+            _scale, image, np.ones((3, 3)), {"factor": 2}, executor
+        )
+    np.testing.assert_allclose(out, 2 * image)
+
+
+def test_workers_share_the_cores_by_default():
+    image = np.zeros((2, 8, 8))
+    with SUnitExecutor(workers=2) as executor:
+        out = deconv_frames(_threads, image, np.ones((3, 3)), {}, executor)
+    assert executor.threads == max(1, os.cpu_count() // 2)
+    assert (out == executor.threads).all()
+    assert SUnitExecutor(threads=3).threads == 3
+
+
+def test_deconv_frames_tiled():
+    image = np.random.random((2, 40, 30))
+    with SUnitExecutor() as executor:
+        out = deconv_frames(
+            _scale, image, np.ones((3, 3)), {"factor": 1}, executor, (16, 16)
+        )
+    np.testing.assert_allclose(out, image)
+
+
+def test_cancelled_executor_stops_between_units():
+    token = SCancelToken()
+    done = []
+
+    def units():
+        for i in range(5):
+            if i == 2:
+                token.cancel()
+            done.append(i)
+            yield np.zeros((4, 4)), np.ones((3, 3))
+
+    with pytest.raises(SCancelledError):
+        with SUnitExecutor(token=token) as executor:
+            list(executor.map(_scale, units(), {"factor": 1}))
+    assert done == [0, 1, 2]
+
+
+def test_cancelled_pool_terminates_the_running_units():
+    token = SCancelToken()
+    units = ((np.zeros((4, 4)), np.ones((3, 3))) for _ in range(2))
+    start = time.perf_counter()
+    with pytest.raises(SCancelledError):
+        with SUnitExecutor(2, token=token) as executor:
+            results = executor.map(_sleep, units, {"seconds": 60})
+            threading.Timer(5, token.cancel).start()
+            list(results)
+    assert time.perf_counter() - start < 30
+
+
+def test_deconv_frames_writes_into_output():
+    image = np.random.random((3, 20, 30))
+    out = np.empty_like(image)
+    with SUnitExecutor() as executor:
+        result = deconv_frames(
+            _scale, image, np.ones((3, 3)), {"factor": 2}, executor, out=out
+        )
+    assert result is out
+    np.testing.assert_allclose(out, 2 * image)
+
+
+def test_pool_writes_frames_in_shared_memory():
+    image = np.random.random((4, 20, 30))
+    with SUnitExecutor(workers=2) as executor:
+        out = deconv_frames(
+            _scale, image, np.ones((3, 3)), {"factor": 3}, executor
+        )
+    assert shared_spec(out) is not None
+    np.testing.assert_allclose(out, 3 * image)
+
+
+def test_deconv_frames_with_one_psf_per_channel():
+    from sdeconv.psfs import SPSFGaussian
+
+    from napari_sdeconv._batch import SBatchWiener
+
+    image = np.random.random((2, 3, 32, 32)).astype(np.float32)
+    psfs = np.stack(
+        [
+            SPSFGaussian((sigma, sigma), (9, 9))().numpy()
+            for sigma in (1, 1.5, 2)
+        ]
+    )
+    batch = SBatchWiener()
+    with SUnitExecutor() as executor:
+        out = deconv_frames(
+            None,
+            image,
+            psfs,
+            {"beta": 1e-3, "pad": 4},
+            executor,
+            batch=batch,
+            batch_size=4,
+            channel_axis=1,
+        )
+        for channel in range(3):
+            expected = deconv_frames(
+                None,
+                image[:, channel],
+                psfs[channel],
+                {"beta": 1e-3, "pad": 4},
+                executor,
+                batch=batch,
+            )
+            np.testing.assert_allclose(
+                out[:, channel], expected, rtol=1e-5, atol=1e-6
+            )
+        with pytest.raises(ValueError):
+            deconv_frames(
+                None,
+                image,
+                psfs[:2],
+                {},
+                executor,
+                batch=batch,
+                channel_axis=1,
+            )
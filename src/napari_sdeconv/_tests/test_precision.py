@@ -0,0 +1,35 @@
+import numpy as np
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._batch import SBatchRichardsonLucy
+from napari_sdeconv._precision import convert_output
+
+
+def test_batch_precisions():
+    images = np.random.randint(100, 1000, (2, 48, 48)).astype(np.uint16)
+    psf = SPSFGaussian((1.5, 1.5), (15, 15))().numpy()
+    batch = SBatchRichardsonLucy()
+    outs = {}
+    for compute_type in ("float64", "float32", "bfloat16"):
+        otf = batch.otf(
+            psf, images.shape[1:], pad=4, compute_type=compute_type
+        )
+        outs[compute_type] = batch(
+            images, otf, niter=5, pad=4, compute_type=compute_type
+        )
+    assert outs["float64"].dtype == np.float64
+    assert outs["float32"].dtype == np.float32
+    assert outs["bfloat16"].dtype == np.float32
+    np.testing.assert_allclose(outs["float32"], outs["float64"], rtol=1e-4)
+    np.testing.assert_allclose(outs["bfloat16"], outs["float64"], rtol=5e-2)
+
+
+def test_convert_output():
+    data = np.linspace(-10, 300, 12, dtype=np.float32).reshape(3, 4)
+    rescaled = convert_output(data, "uint16", np.uint16)
+    assert rescaled.dtype == np.uint16
+    assert rescaled.min() == 0 and rescaled.max() == 65535
+    clipped = convert_output(data, "input", np.uint8)
+    assert clipped.dtype == np.uint8
+    assert clipped.min() == 0 and clipped.max() == 255
+    assert convert_output(data, "precision", np.uint16) is data
@@ -0,0 +1,52 @@
+import napari
+import numpy as np
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._preview import preview_region, shape_bounds
+from napari_sdeconv._sdeconv_widget import SWienerPlugin
+
+
+def test_preview_region_of_slice_and_roi():
+    psf = SPSFGaussian((1, 1.5, 1.5), (5, 15, 15))().numpy()
+    crop, keep, origin = preview_region(
+        (2, 20, 64, 64), psf, (1, 10, 0, 0), [2, 3]
+    )
+    assert crop[:2] == (slice(1, 2), slice(8, 13))
+    assert keep[:2] == (slice(0, 1), slice(2, 3))
+    assert origin == (1, 10, 0, 0)
+    roi = shape_bounds(np.array([[10.2, 20], [30, 40.5]]), [2, 3], 4)
+    assert roi == [(10, 31), (20, 42)]
+    crop, keep, origin = preview_region(
+        (2, 20, 64, 64), psf, (1, 10, 0, 0), [2, 3], roi
+    )
+    assert crop[2].start < 10 and crop[2].stop > 31
+    assert keep[2].stop - keep[2].start == 21
+    assert origin[2:] == (10, 20)
+
+
+def test_live_preview_of_roi(qtbot):
+    viewer = napari.components.ViewerModel()
+    viewer.add_image(
+        np.random.random((64, 64)).astype(np.float32), name="image"
+    )
+    viewer.add_image(SPSFGaussian((1.5, 1.5), (9, 9))().numpy(), name="psf")
+    plugin = SWienerPlugin(viewer)
+    plugin._widget.params["image"]["widget"].layer_box.setCurrentText("image")
+    plugin._widget.params["psf"]["widget"].layer_box.setCurrentText("psf")
+    plugin.preview_box.setChecked(True)
+    qtbot.waitUntil(
+        lambda: "Wiener live preview" in viewer.layers, timeout=10000
+    )
+    assert viewer.layers["Wiener live preview"].data.shape == (64, 64)
+
+    viewer.add_shapes(
+        [np.array([[10, 12], [10, 30], [20, 30], [20, 12]])],
+        shape_type="rectangle",
+    )
+    qtbot.waitUntil(
+        lambda: viewer.layers["Wiener live preview"].data.shape == (11, 19),
+        timeout=10000,
+    )
+    np.testing.assert_allclose(
+        viewer.layers["Wiener live preview"].translate, (10, 12)
+    )
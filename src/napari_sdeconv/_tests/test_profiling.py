@@ -0,0 +1,27 @@
+import json
+
+import numpy as np
+
+from napari_sdeconv._batch import SBatchWiener
+from napari_sdeconv._profiling import SStageProfiler, profile_stage
+
+
+def test_profiler_records_the_annotated_stages(tmp_path):
+    profiler = SStageProfiler()
+    batch = SBatchWiener()
+    images = np.random.random((2, 32, 32)).astype(np.float32)
+    with profile_stage("ignored"):
+        pass
+    with profiler.activate():
+        batch(images, batch.otf(np.ones((5, 5)), (32, 32), pad=4), pad=4)
+    names = [stage["name"] for stage in profiler.summary()]
+    assert names == ["fft", "dtype conversion", "padding", "copy back"]
+    assert all(
+        stage["wall"] >= 0 and stage["peak_rss"] >= 0
+        for stage in profiler.summary()
+    )
+
+    profiler.save(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json", encoding="utf-8") as file:
+        trace = json.load(file)
+    assert len(trace["traceEvents"]) == 5
@@ -0,0 +1,186 @@
+import numpy as np
+
+from napari_sdeconv._dict_worker import SDictWorker
+from napari_sdeconv._framework import (
+    SJob,
+    SJobQueue,
+    SNapariPlugin,
+    SNapariWidget,
+    SNapariWorker,
+)
+from napari_sdeconv._metadata import get_metadata
+
+
+class _DoubleWorker(SNapariWorker):
+    def run(self):
+        self._state["outputs"]["out"]["data"] = (
+            2 * self._state["inputs"]["value"]
+        )
+        self.finished.emit()
+
+
+class _FailingWorker(SNapariWorker):
+    def run(self):
+        if self._state["inputs"]["value"] < 0:
+            self.failed.emit("negative value")
+            return
+        self.finished.emit()
+
+
+class _FillWorker(SNapariWorker):
+    """Write the value in the output buffer like SDictRunner, and cancel the
+    negative values after writing"""
+
+    def run(self):
+        output = self._state["outputs"]["out"]
+        data = output.pop("buffer", None)
+        if data is None:
+            data = np.empty((4, 4), dtype=np.float32)
+        data[:] = self._state["inputs"]["value"]
+        if self._state["inputs"]["value"] < 0:
+            self.cancelled.emit()
+            return
+        output["data"] = data
+        self.finished.emit()
+
+
+class _FillPlugin(SNapariPlugin):
+    def init_widget(self, napari_viewer):
+        return SNapariWidget(napari_viewer)
+
+    def init_worker(self):
+        return _FillWorker()
+
+
+def _state(value):
+    return {
+        "name": "double",
+        "label": "Double",
+        "inputs": {"value": value},
+        "outputs": {"out": {"type": "Image", "label": "Double"}},
+    }
+
+
+def test_job_inputs_are_read_only():
+    state = _state(1)
+    state["inputs"]["image"] = np.zeros(4)
+    job = SJob(1, state)
+    state["inputs"]["value"] = 2
+    assert job.inputs["value"] == 1
+    assert not job.state()["inputs"]["image"].flags.writeable
+    assert state["inputs"]["image"].flags.writeable
+    job.state()["outputs"]["out"]["data"] = 0
+    assert "data" not in job.state()["outputs"]["out"]
+    job.release()
+    assert "image" not in job.inputs and job.inputs["value"] == 1
+
+
+def test_queue_runs_jobs_in_order(qtbot):
+    queue = SJobQueue(_DoubleWorker)
+    results = []
+    queue.job_finished.connect(
+        lambda job: results.append(job.result["out"]["data"])
+    )
+    jobs = [queue.submit(_state(value)) for value in range(3)]
+    queue.cancel(jobs[2])
+    qtbot.waitUntil(lambda: not queue.unfinished(), timeout=5000)
+    assert results == [0, 2]
+    assert all(job.result is None for job in jobs)
+    assert [job.status for job in jobs] == [
+        SJob.DONE,
+        SJob.DONE,
+        SJob.CANCELLED,
+    ]
+
+
+def test_failed_job_releases_its_place(qtbot):
+    queue = SJobQueue(_FailingWorker)
+    failed = []
+    queue.job_failed.connect(failed.append)
+    jobs = [queue.submit(_state(value)) for value in (-1, 1)]
+    qtbot.waitUntil(lambda: not queue.unfinished(), timeout=5000)
+    assert failed == [jobs[0]] and jobs[0].error == "negative value"
+    assert [job.status for job in jobs] == [SJob.FAILED, SJob.DONE]
+
+
+def test_dict_worker_emits_the_error_of_a_run():
+    metadata = get_metadata("SWiener")
+    worker = SDictWorker(metadata)
+    inputs = {
+        key: value.get("default") for key, value in metadata["inputs"].items()
+    }
+    # a 3D PSF cannot deconvolve a 2D image
+    inputs.update(image=np.zeros((16, 16)), psf=np.ones((3, 3, 3)))
+    worker.set_state(
+        {
+            "name": "SWiener",
+            "inputs": inputs,
+            "outputs": {"image": {"type": "Image", "label": "Wiener"}},
+        }
+    )
+    errors, finished = [], []
+    worker.failed.connect(errors.append)
+    worker.finished.connect(lambda: finished.append(True))
+    worker.run()
+    assert len(errors) == 1 and not finished
+
+
+def test_reused_output_layer_is_updated_when_the_job_finishes(qtbot):
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    plugin = _FillPlugin(viewer)
+    qtbot.addWidget(plugin)
+
+    def run(value):
+        state = _state(value)
+        state["inputs"]["reuse_output"] = True
+        plugin.submit(lambda: state)
+        qtbot.waitUntil(lambda: not plugin.queue.unfinished(), timeout=5000)
+        return viewer.layers["Double"].data
+
+    first = run(1)
+    second = run(2)
+    assert second is not first and (second == 2).all()
+    third = run(3)
+    assert third is first and (third == 3).all()
+    run(-1)
+    assert viewer.layers["Double"].data is third and (third == 3).all()
+    assert len(viewer.layers) == 1
+
+
+def test_continue_resumes_the_last_run_that_kept_its_state(qtbot):
+    from napari.components import ViewerModel
+    from sdeconv.psfs import SPSFGaussian
+
+    from napari_sdeconv._sdeconv_widget import SRichardsonLucyPlugin
+
+    viewer = ViewerModel()
+    viewer.add_image(
+        np.random.random((32, 32)).astype(np.float32), name="image"
+    )
+    viewer.add_image(SPSFGaussian((1.5, 1.5), (9, 9))().numpy(), name="psf")
+    plugin = SRichardsonLucyPlugin(viewer)
+    qtbot.addWidget(plugin)
+    params = plugin._widget.params
+    params["image"]["widget"].layer_box.setCurrentText("image")
+    params["psf"]["widget"].layer_box.setCurrentText("psf")
+    params["niter"]["widget"].edit.setText("5")
+
+    def wait():
+        qtbot.waitUntil(lambda: not plugin.queue.unfinished(), timeout=20000)
+        return plugin.log_widget.log_area.toPlainText()
+
+    assert not plugin.continue_btn.isEnabled()
+    plugin.run_btn.click()
+    assert "the last run kept no state" in wait()
+    assert not plugin.continue_btn.isEnabled()
+
+    params["resume"]["widget"].combobox.setCurrentText("True")
+    plugin.run_btn.click()
+    wait()
+    assert plugin.continue_btn.isEnabled()
+    plugin.continue_box.setValue(3)
+    plugin.continue_btn.click()
+    assert "Resumed from iteration 5 to 8" in wait()
+    assert params["niter"]["widget"].edit.text() == "8"
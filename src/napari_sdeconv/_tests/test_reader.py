@@ -0,0 +1,50 @@
+import sys
+
+import dask.array as da
+import numpy as np
+import tifffile
+import zarr
+
+from napari_sdeconv._reader import napari_get_reader
+
+
+def test_reader_memory_maps_tiff(tmp_path):
+    image = np.random.random((4, 32, 32)).astype(np.float32)
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, image)
+    assert napari_get_reader(str(tmp_path / "stack.png")) is None
+    data, metadata, layer_type = napari_get_reader(path)(path)[0]
+    assert isinstance(data, np.memmap) and layer_type == "image"
+    assert metadata == {"name": "stack", "multiscale": False}
+    np.testing.assert_array_equal(data, image)
+
+
+def test_reader_opens_compressed_tiff_and_zarr_lazily(tmp_path):
+    image = np.random.random((4, 32, 32)).astype(np.float32)
+    tiff_path = str(tmp_path / "stack.ome.tif")
+    tifffile.imwrite(tiff_path, image, ome=True, compression="zlib")
+    zarr_path = str(tmp_path / "stack.zarr")
+    zarr.open_array(
+        store=zarr_path,
+        mode="w",
+        shape=image.shape,
+        dtype=image.dtype,
+        chunks=(1, 32, 32),
+    )[...] = image
+    layers = napari_get_reader([tiff_path, zarr_path])([tiff_path, zarr_path])
+    for data, metadata, _ in layers:
+        assert isinstance(data, da.Array) and metadata["name"] == "stack"
+        np.testing.assert_array_equal(data.compute(), image)
+
+
+def test_reader_reads_compressed_tiff_in_memory_without_zarr(
+    tmp_path, monkeypatch
+):
+    image = np.random.random((4, 32, 32)).astype(np.float32)
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, image, compression="zlib")
+    # zarr is an optional dependency
+    monkeypatch.setitem(sys.modules, "zarr", None)
+    data, metadata, _ = napari_get_reader(path)(path)[0]
+    assert isinstance(data, np.ndarray) and metadata["name"] == "stack"
+    np.testing.assert_array_equal(data, image)
@@ -0,0 +1,66 @@
+import numpy as np
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._cache import array_digest
+from napari_sdeconv._metadata import wiener_plugin_metadata
+from napari_sdeconv._result_cache import SResultCache, result_key
+from napari_sdeconv._runner import SDictRunner
+
+
+def _state(image, psf, cache_dir, beta=1e-5):
+    inputs = {
+        key: value["default"]
+        for key, value in wiener_plugin_metadata["inputs"].items()
+        if "default" in value
+    }
+    inputs.update(
+        {
+            "image": image,
+            "psf": psf,
+            "beta": beta,
+            "result_cache": True,
+            "cache_dir": str(cache_dir),
+        }
+    )
+    return {
+        "inputs": inputs,
+        "outputs": {"image": {"type": "Image", "label": "Wiener"}},
+    }
+
+
+def test_result_cache_hit(tmp_path):
+    image = np.random.rand(2, 32, 32).astype(np.float32)
+    psf = SPSFGaussian((1.5, 1.5), (9, 9))().numpy()
+    runner = SDictRunner(wiener_plugin_metadata)
+    computed = runner.run(_state(image, psf, tmp_path))["outputs"]["image"][
+        "data"
+    ]
+    assert runner.cache_hit is False
+    runner = SDictRunner(wiener_plugin_metadata)
+    cached = runner.run(_state(image.copy(), psf, tmp_path))["outputs"][
+        "image"
+    ]["data"]
+    assert runner.cache_hit is True
+    assert isinstance(cached, np.memmap)
+    np.testing.assert_array_equal(cached, computed)
+    runner = SDictRunner(wiener_plugin_metadata)
+    runner.run(_state(image, psf, tmp_path, beta=1e-3))
+    assert runner.cache_hit is False
+    # non contiguous views are hashed without copy and match their copy
+    assert array_digest(image[:, ::2, 1:]) == array_digest(
+        image[:, ::2, 1:].copy()
+    )
+    assert result_key("SWiener", {"image": image, "workers": 2}) == result_key(
+        "SWiener", {"image": image, "workers": 1}
+    )
+
+
+def test_result_cache_eviction(tmp_path):
+    cache = SResultCache(str(tmp_path), max_bytes=2500)
+    for key in ("a", "b", "c"):
+        assert cache.put(key, [{"data": np.zeros(100)}])
+        if key == "b":
+            cache.get("a")
+    assert len(cache) == 2
+    assert cache.get("b") is None and cache.get("a") is not None
+    assert not cache.put("d", [{"data": np.zeros(1000)}])
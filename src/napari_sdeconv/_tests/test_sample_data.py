@@ -1,7 +1,12 @@
-# from napari_sdeconv import make_sample_data
+import numpy as np
 
-# add your tests here...
+from napari_sdeconv import make_sample_data
 
 
-def test_something():
-    pass
+def test_sample_data_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    first = make_sample_data()[0][0]
+    second = make_sample_data()[0][0]
+    assert isinstance(second, np.memmap) and not second.flags.writeable
+    assert (tmp_path / "napari-sdeconv" / "samples" / "celegans.npy").is_file()
+    np.testing.assert_array_equal(first, second)
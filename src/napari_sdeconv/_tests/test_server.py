@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._profiling import SStageProfiler
+from napari_sdeconv._runner import SDictRunner
+from napari_sdeconv._server import SComputeServer
+
+
+def _state(metadata, **inputs):
+    state = {
+        "name": metadata["name"],
+        "inputs": {
+            key: value.get("default")
+            for key, value in metadata["inputs"].items()
+        },
+        "outputs": {"image": {"type": "Image", "label": "Deconvolved"}},
+    }
+    state["inputs"].update(inputs)
+    return state
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = SComputeServer()
+    yield server
+    server.stop()
+
+
+def test_server_run_matches_local_run(server):
+    metadata = get_metadata("SRichardsonLucy")
+    image = np.random.random((3, 40, 40)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    buffer = np.zeros((3, 40, 40), dtype=np.float32)
+    state = _state(
+        metadata, image=image, psf=psf, niter=5, compute_server=True
+    )
+    state["outputs"]["image"]["buffer"] = buffer
+    profiler = SStageProfiler()
+    server.run(metadata["name"], state, profiler=profiler)
+    local = SDictRunner(metadata).run(
+        _state(metadata, image=image, psf=psf, niter=5)
+    )
+
+    assert state["outputs"]["image"]["data"] is buffer
+    np.testing.assert_allclose(
+        buffer, local["outputs"]["image"]["data"], rtol=1e-5
+    )
+    assert "iterations" in [stage["name"] for stage in profiler.summary()]
+
+
+def test_server_raises_the_job_errors(server):
+    metadata = get_metadata("SWiener")
+    state = _state(
+        metadata,
+        image=np.zeros((16, 16), dtype=np.float32),
+        psf=np.ones((5, 5, 5), dtype=np.float32),
+        channel_axis=0,
+        block_size=[0, 8, 8],
+    )
+    with pytest.raises(ValueError):
+        server.run(metadata["name"], state)
+    assert server.running
@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+import pytest
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._stream import SFrameStream
+
+
+def _state(metadata, **inputs):
+    state = {
+        "name": metadata["name"],
+        "inputs": {
+            key: value.get("default")
+            for key, value in metadata["inputs"].items()
+        },
+        "outputs": {"image": {"type": "Image", "label": "Deconvolved"}},
+    }
+    state["inputs"].update(inputs)
+    return state
+
+
+def test_stream_deconvolves_the_appended_time_points():
+    metadata = get_metadata("SRichardsonLucy")
+    data = np.random.random((5, 2, 32, 32)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    counts = []
+    done = threading.Event()
+
+    def on_frames(count, latency):
+        counts.append(count)
+        if count == len(data):
+            done.set()
+
+    stream = SFrameStream.from_state(
+        metadata,
+        _state(metadata, image=data[:2], psf=psf, niter=5, batch_size=1),
+        on_frames,
+    )
+    stream.start(data[:2])
+    stream.update(data[:3])
+    stream.update(data)
+    assert done.wait(60)
+    stream.stop()
+
+    batch = metadata["batch"]
+    expected = batch(
+        data.reshape(10, 32, 32),
+        batch.otf(psf, (32, 32), pad=13),
+        pad=13,
+        niter=5,
+    ).reshape(data.shape)
+    assert not stream.running
+    assert counts == [1, 2, 3, 4, 5]
+    np.testing.assert_allclose(stream.output, expected, rtol=1e-5)
+
+
+def test_stream_needs_a_time_axis():
+    metadata = get_metadata("SWiener")
+    psf = np.ones((5, 5), dtype=np.float32)
+    with pytest.raises(ValueError):
+        SFrameStream.from_state(
+            metadata, _state(metadata, image=np.zeros((16, 16)), psf=psf)
+        )
+    with pytest.raises(ValueError):
+        SFrameStream.from_state(
+            metadata,
+            _state(
+                metadata,
+                image=np.zeros((2, 16, 16)),
+                psf=psf,
+                beta=[1e-5, 1e-4],
+            ),
+        )
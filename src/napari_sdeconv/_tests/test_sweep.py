@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._runner import SDictRunner
+from napari_sdeconv._sweep import parse_values
+
+
+def _state(metadata, **inputs):
+    state = {
+        "name": metadata["name"],
+        "inputs": {
+            key: value.get("default")
+            for key, value in metadata["inputs"].items()
+        },
+        "outputs": {"image": {"type": "Image", "label": "Deconvolved"}},
+    }
+    state["inputs"].update(inputs)
+    return state
+
+
+def test_parse_values():
+    assert parse_values("3", "int") == 3
+    assert parse_values("1e-5, 1e-3", "float") == [1e-5, 1e-3]
+    assert parse_values("0.1:0.3:0.1", "float") == [0.1, 0.2, 0.3]
+    assert parse_values("10:30:10", "int") == [10, 20, 30]
+    with pytest.raises(ValueError):
+        parse_values("10:30", "int")
+
+
+def test_sweep_stacks_the_combinations():
+    metadata = get_metadata("SRichardsonLucy")
+    image = np.random.random((48, 48)).astype(np.float32) + 1
+    psf = SPSFGaussian((1.5, 1.5), (11, 11))().numpy()
+    state = SDictRunner(metadata).run(
+        _state(metadata, image=image, psf=psf, niter=[2, 4], pad=[0, 2])
+    )
+    output = state["outputs"]["image"]
+    assert output["data"].shape == (4, 48, 48)
+    assert output["sweep"] == [
+        "niter=2, pad=0",
+        "niter=2, pad=2",
+        "niter=4, pad=0",
+        "niter=4, pad=2",
+    ]
+    single = SDictRunner(metadata).run(
+        _state(metadata, image=image, psf=psf, niter=4, pad=2)
+    )
+    np.testing.assert_allclose(
+        output["data"][3], single["outputs"]["image"]["data"]
+    )
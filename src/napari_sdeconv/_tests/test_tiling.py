@@ -0,0 +1,78 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+from sdeconv.data import celegans
+from sdeconv.psfs import SPSFGaussian
+
+from napari_sdeconv._metadata import get_metadata
+from napari_sdeconv._tiling import (
+    deconv_tiled,
+    extend_block,
+    fit_psf,
+    psf_halo,
+    tile_grid,
+)
+
+
+def test_tile_grid_weights_sum_to_one():
+    shape = (37, 101, 90)
+    total = np.zeros(shape)
+    for slices, weights in tile_grid(shape, (16, 40, 0), (4, 10, 8)):
+        total[slices] += np.multiply.outer(
+            np.multiply.outer(weights[0], weights[1]), weights[2]
+        )
+    np.testing.assert_allclose(total, 1)
+
+
+def test_deconv_tiled_identity():
+    image = np.random.random((30, 70, 50)).astype(np.float32)
+    out = deconv_tiled(
+        lambda block, psf: block,
+        image,
+        np.ones((5, 5, 5)),
+        {},
+        (16, 32, 0),
+        (-1, -1, -1),
+    )
+    np.testing.assert_allclose(out, image, atol=1e-6)
+
+
+def test_extend_block_keeps_an_even_size():
+    extended, crop = extend_block(
+        (slice(0, 48), slice(0, 30)), (5, 5), (128, 30)
+    )
+    assert extended == (slice(0, 54), slice(0, 30))
+    assert crop == (slice(0, 48), slice(0, 30))
+    extended, crop = extend_block((slice(80, 128),), (5,), (128,))
+    assert extended == (slice(74, 128),) and crop == (slice(6, 54),)
+
+
+@pytest.mark.parametrize(
+    "name, params",
+    [
+        ("SWiener", {"beta": 1e-3, "pad": 13}),
+        ("SRichardsonLucy", {"niter": 20, "pad": 13}),
+    ],
+)
+def test_deconv_tiled_matches_the_whole_image(name, params):
+    image = celegans().numpy()[:128, :128].astype(np.float32)
+    image /= image.max()
+    psf = SPSFGaussian((1.5, 1.5), (13, 13))().numpy()
+    fnc = get_metadata(name)["fnc"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = fnc(image, psf, **params).numpy()
+        out = deconv_tiled(fnc, image, psf, params, (48, 48))
+    error = np.abs(out - expected)
+    assert np.linalg.norm(error) < 2e-3 * np.linalg.norm(expected)
+    # the borders of the image depend on the size of the padded image
+    assert error[16:-16, 16:-16].max() < 5e-3 * expected.max()
+
+
+def test_fit_psf_keeps_center():
+    psf = np.zeros((11, 11))
+    psf[5, 5] = 1
+    assert fit_psf(psf, (7, 7))[3, 3] == 1
+    assert fit_psf(psf, (16, 16))[8, 8] == 1
+    assert psf_halo(psf) == (0, 0)
@@ -0,0 +1,318 @@
+"""Tiled deconvolution of images that do not fit in memory
+
+The image is split into overlapping blocks. Each block is extended by the PSF
+halo and deconvolved independently. The halo, where the block borders distort
+the deconvolution, is cropped and the blocks are blended back with separable
+linear ramps in the overlapping areas.
+
+Functions
+---------
+psf_halo
+fit_psf
+block_psf
+tile_grid
+extend_block
+blend_weights
+deconv_tiled
+
+"""
+import numpy as np
+
+
+def psf_halo(psf, threshold=1e-3):
+    """Calculate the half size of the PSF support in each dimension
+
+    Parameters
+    ----------
+    psf: np.ndarray
+        Point spread function
+    threshold: float
+        Fraction of the PSF maximum below which the PSF is considered null
+
+    Returns
+    -------
+    tuple of the halo size for each dimension
+
+    """
+    psf = np.asarray(psf)
+    mask = psf >= threshold * psf.max()
+    halo = []
+    for axis in range(psf.ndim):
+        other_axes = tuple(i for i in range(psf.ndim) if i != axis)
+        support = np.nonzero(np.any(mask, axis=other_axes))[0]
+        center = psf.shape[axis] // 2
+        halo.append(int(max(center - support[0], support[-1] - center)))
+    return tuple(halo)
+
+
+def fit_psf(psf, shape):
+    """Crop or zero pad a PSF around its center to a given shape
+
+    Parameters
+    ----------
+    psf: np.ndarray
+        Point spread function
+    shape: tuple
+        Target shape
+
+    Returns
+    -------
+    the PSF with the target shape
+
+    """
+    psf = np.asarray(psf)
+    out = np.zeros(shape, dtype=psf.dtype)
+    src = []
+    dst = []
+    for size, target in zip(psf.shape, shape):
+        offset = target // 2 - size // 2
+        start = max(0, -offset)
+        length = min(size - start, target - max(0, offset))
+        src.append(slice(start, start + length))
+        dst.append(slice(max(0, offset), max(0, offset) + length))
+    out[tuple(dst)] = psf[tuple(src)]
+    return out
+
+
+def _axis_tiles(length, block, overlap):
+    """Calculate the tiles along one axis
+
+    Parameters
+    ----------
+    length: int
+        Size of the image axis
+    block: int
+        Size of the blocks along the axis. 0 means that the axis is not split
+    overlap: int
+        Number of pixels shared by two consecutive blocks
+
+    Returns
+    -------
+    list of (start, weights) where weights are the blending weights of the
+    block
+
+    """
+    if block <= 0 or block >= length:
+        return [(0, np.ones(length))]
+    overlap = min(overlap, block // 2)
+    step = block - overlap
+    starts = list(range(0, length - block + 1, step))
+    if starts[-1] + block < length:
+        starts.append(length - block)
+
+    ramp = np.arange(1, overlap + 1) / (overlap + 1)
+    tiles = []
+    total = np.zeros(length)
+    for start in starts:
+        weights = np.ones(block)
+        if overlap > 0 and start > 0:
+            weights[:overlap] = ramp
+        if overlap > 0 and start + block < length:
+            weights[-overlap:] = ramp[::-1]
+        total[start : start + block] += weights
+        tiles.append((start, weights))
+    return [
+        (start, weights / total[start : start + block])
+        for start, weights in tiles
+    ]
+
+
+def tile_grid(shape, block_size, overlap):
+    """Split an image shape into overlapping blocks
+
+    The blending weights of each block are given per axis. Their outer product
+    sums to one over the whole image
+
+    Parameters
+    ----------
+    shape: tuple
+        Shape of the image
+    block_size: tuple
+        Size of the blocks in each dimension. 0 means that the dimension is not
+        split
+    overlap: tuple
+        Overlap between blocks in each dimension
+
+    Returns
+    -------
+    list of (slices, weights) for each block
+
+    """
+    axes = [
+        _axis_tiles(length, block, over)
+        for length, block, over in zip(shape, block_size, overlap)
+    ]
+    grid = [((), ())]
+    for axis in axes:
+        grid = [
+            (
+                slices + (slice(start, start + len(weights)),),
+                weights_ + (weights,),
+            )
+            for slices, weights_ in grid
+            for start, weights in axis
+        ]
+    return grid
+
+
+def extend_block(slices, halo, shape):
+    """Extend the slices of a block by the PSF halo, within the image
+
+    An extended block smaller than the image has an even size: the sdeconv
+    functions shift the result of an odd-sized image by one pixel
+
+    Parameters
+    ----------
+    slices: tuple
+        Slices of the block in the image
+    halo: tuple
+        Halo size in each dimension
+    shape: tuple
+        Shape of the image
+
+    Returns
+    -------
+    (extended, crop) the slices of the extended block in the image, and the
+    slices of the block in the extended block
+
+    """
+    extended = []
+    for item, size, length in zip(slices, halo, shape):
+        start = max(0, item.start - size)
+        stop = min(length, item.stop + size)
+        if (stop - start) % 2 and stop - start < length:
+            if stop < length:
+                stop += 1
+            else:
+                start -= 1
+        extended.append(slice(start, stop))
+    crop = tuple(
+        slice(item.start - ext.start, item.stop - ext.start)
+        for item, ext in zip(slices, extended)
+    )
+    return tuple(extended), crop
+
+
+def blend_weights(weights):
+    """Blending weights of a block
+
+    Parameters
+    ----------
+    weights: list
+        Blending weights of the block along each axis (see tile_grid)
+
+    Returns
+    -------
+    the outer product of the weights of the axes
+
+    """
+    out = weights[0]
+    for axis_weights in weights[1:]:
+        out = np.multiply.outer(out, axis_weights)
+    return out
+
+
+def block_psf(psf, block_shape):
+    """Adapt the PSF to a block shape
+
+    3D sdeconv algorithms need a PSF with the same shape as the image, and 2D
+    algorithms need a PSF smaller than the image
+    """
+    if psf.ndim == 3:
+        return fit_psf(psf, block_shape)
+    shape = [
+        min(size, block - 1 - block % 2)
+        for size, block in zip(psf.shape, block_shape)
+    ]
+    return fit_psf(psf, shape)
+
+
+def deconv_tiled(
+    fnc,
+    image,
+    psf,
+    params,
+    block_size,
+    overlap=None,
+    observers=None,
+    executor=None,
+    out=None,
+    dtype=None,
+):
+    """Run a deconvolution function block by block
+
+    Parameters
+    ----------
+    fnc: callable
+        sdeconv deconvolution function with the signature fnc(image, psf,
+        **params)
+    image: np.ndarray
+        Image to deconvolve
+    psf: np.ndarray
+        Point spread function
+    params: dict
+        Other parameters of the deconvolution function
+    block_size: tuple
+        Size of the blocks in each dimension. 0 means that the dimension is not
+        split
+    overlap: tuple
+        Overlap between blocks in each dimension. A negative value (or None)
+        uses twice the PSF halo
+    observers: list
+        Observers notified of the blocks progress
+    executor: SUnitExecutor
+        Executor running the blocks. None runs them one after the other
+    out: np.ndarray
+        Preallocated output with the shape of the image
+    dtype: np.dtype
+        Data type to which the blocks and the PSF are converted before the
+        deconvolution. None keeps the data type of the image
+
+    Returns
+    -------
+    the deconvolved image as a numpy array. It is None when the blocks are
+    written into `out`
+
+    """
+    psf = np.asarray(psf)
+    halo = psf_halo(psf)
+    if overlap is None:
+        overlap = (-1,) * image.ndim
+    overlap = [2 * h if o < 0 else o for o, h in zip(overlap, halo)]
+    grid = tile_grid(image.shape, block_size, overlap)
+    blocks = [extend_block(slices, halo, image.shape) for slices, _ in grid]
+
+    if dtype is not None:
+        psf = psf.astype(dtype, copy=False)
+    units = (
+        (
+            image[extended]
+            if dtype is None
+            else image[extended].astype(dtype, copy=False),
+            block_psf(psf, image[extended].shape),
+        )
+        for extended, _ in blocks
+    )
+    if executor is None:
+        results = (
+            fnc(np.asarray(block), unit_psf, **params)
+            for block, unit_psf in units
+        )
+    else:
+        results = executor.map(fnc, units, params)
+
+    output = out
+    for i, ((slices, weights), (_, crop), result) in enumerate(
+        zip(grid, blocks, results)
+    ):
+        if hasattr(result, "detach"):
+            result = result.detach().cpu().numpy()
+        result = result[crop]
+        if output is None:
+            output = np.zeros(image.shape, dtype=result.dtype)
+        elif i == 0:
+            output[...] = 0
+        output[slices] += blend_weights(weights).astype(output.dtype) * result
+        for observer in observers or []:
+            observer.progress(int(100 * (i + 1) / len(grid)))
+    return None if out is not None else output
@@ -0,0 +1,235 @@
+"""Deconvolution with a spatially varying PSF
+
+The PSF changes across the field of view. It is given as a grid of PSFs,
+measured or generated at regularly spaced positions: the grid PSFs are stacked
+on the first axis of the PSF layer in row-major order (z, y, x). Each PSF of
+the grid is the PSF at the center of its cell.
+
+The image is split into overlapping patches (see tile_grid), each patch is
+deconvolved with the PSF interpolated at its center and the patches are blended
+back. The OTFs of the grid PSFs are calculated once per run: the Fourier
+transform is linear, so the OTF of an interpolated PSF is the interpolation of
+the grid OTFs. The patches are deconvolved by batches with one OTF per patch,
+and the batches are run in parallel by the executor.
+
+Functions
+---------
+check_psf_grid
+interpolation_weights
+interpolate_psf
+deconv_varying
+
+"""
+import numpy as np
+import torch
+
+from ._cache import cached_otf
+from ._parallel import output_dtype
+from ._profiling import profile_stage
+from ._tiling import blend_weights, psf_halo, tile_grid
+
+
+def check_psf_grid(psf_shape, grid_shape):
+    """Check that a PSF stacks the PSFs of a grid
+
+    Parameters
+    ----------
+    psf_shape: tuple
+        Shape of the PSF, with the grid PSFs on the first axis
+    grid_shape: tuple
+        Number of PSFs of the grid in each spatial dimension
+
+    Raises
+    ------
+    ValueError if the PSF does not have one PSF per grid position
+
+    """
+    if len(psf_shape) - 1 != len(grid_shape) or psf_shape[0] != int(
+        np.prod(grid_shape)
+    ):
+        raise ValueError(
+            f"The PSF of shape {psf_shape} must stack the "
+            f"{int(np.prod(grid_shape))} PSFs of a {grid_shape} grid on its "
+            f"first axis"
+        )
+
+
+def interpolation_weights(point, frame_shape, grid_shape):
+    """Weights of the grid PSFs in the multilinear interpolation of the PSF at
+    a point
+
+    Parameters
+    ----------
+    point: tuple
+        Position in the frame, in pixels
+    frame_shape: tuple
+        Shape of the frame
+    grid_shape: tuple
+        Number of PSFs of the grid in each dimension
+
+    Returns
+    -------
+    np.ndarray of the weight of each grid PSF, in the order of the stacked PSFs
+
+    """
+    weights = np.ones(())
+    for position, size, count in zip(point, frame_shape, grid_shape):
+        # the PSF i of the axis is at the center of the cell i
+        coordinate = min(max(position / size * count - 0.5, 0), count - 1)
+        low = int(np.floor(coordinate))
+        high = min(low + 1, count - 1)
+        axis_weights = np.zeros(count)
+        axis_weights[low] += 1 - (coordinate - low)
+        axis_weights[high] += coordinate - low
+        weights = np.multiply.outer(weights, axis_weights)
+    return weights.ravel()
+
+
+def interpolate_psf(psfs, grid_shape, point, frame_shape):
+    """PSF at a point of the frame, interpolated between the PSFs of a grid
+
+    Parameters
+    ----------
+    psfs: np.ndarray
+        PSFs of the grid stacked on the first axis
+    grid_shape: tuple
+        Number of PSFs of the grid in each dimension
+    point: tuple
+        Position in the frame, in pixels
+    frame_shape: tuple
+        Shape of the frame
+
+    Returns
+    -------
+    the interpolated PSF
+
+    """
+    psfs = np.asarray(psfs)
+    check_psf_grid(psfs.shape, grid_shape)
+    weights = interpolation_weights(point, frame_shape, grid_shape)
+    return np.tensordot(weights, psfs, axes=1).astype(psfs.dtype, copy=False)
+
+
+def deconv_varying(
+    batch,
+    image,
+    psfs,
+    grid_shape,
+    params,
+    executor,
+    block_size=None,
+    overlap=None,
+    batch_size=1,
+    batch_params=None,
+    observers=None,
+    compute_type=None,
+):
+    """Deconvolve an image with a spatially varying PSF
+
+    Parameters
+    ----------
+    batch: SBatchDeconv
+        Batched deconvolution
+    image: np.ndarray
+        Image to deconvolve. The axes before the PSF dimensions are frames
+    psfs: np.ndarray
+        PSFs of the grid stacked on the first axis (see check_psf_grid)
+    grid_shape: tuple
+        Number of PSFs of the grid in each spatial dimension
+    params: dict
+        Parameters of the deconvolution function
+    executor: SUnitExecutor
+        Executor running the batches of patches
+    block_size: tuple
+        Size of the patches. 0 (or None) uses the size of the grid cells in the
+        dimension
+    overlap: tuple
+        Overlap between patches. A negative value (or None) uses twice the PSF
+        half size
+    batch_size: int
+        Number of patches in a batch
+    batch_params: dict
+        Parameters of the batched deconvolution that the deconvolution function
+        does not have
+    observers: list
+        Observers notified of the progress
+    compute_type: str
+        Precision of the computation (float32, float64, bfloat16)
+
+    Returns
+    -------
+    the deconvolved image as a numpy array
+
+    """
+    psfs = np.asarray(psfs)
+    grid_shape = tuple(grid_shape)
+    check_psf_grid(psfs.shape, grid_shape)
+    ndim = len(grid_shape)
+    frame_shape = image.shape[image.ndim - ndim :]
+    if block_size is None:
+        block_size = (0,) * ndim
+    block_size = [
+        size if size > 0 else -(-length // count)
+        for size, length, count in zip(block_size, frame_shape, grid_shape)
+    ]
+    halo = np.max([psf_halo(psf) for psf in psfs], axis=0)
+    if overlap is None:
+        overlap = (-1,) * ndim
+    overlap = [2 * int(h) if o < 0 else o for o, h in zip(overlap, halo)]
+    patches = tile_grid(frame_shape, block_size, overlap)
+    patch_shape = tuple(item.stop - item.start for item in patches[0][0])
+
+    params = {**params, **(batch_params or {})}
+    if compute_type is not None:
+        params["compute_type"] = compute_type
+    # the OTFs of the grid are calculated once, the OTFs of the patches are
+    # interpolated
+    otfs = torch.stack(
+        [cached_otf(batch, psf, patch_shape, params) for psf in psfs]
+    )
+    with profile_stage("otf interpolation"):
+        patch_otfs = []
+        for slices, _ in patches:
+            center = [(item.start + item.stop) / 2 for item in slices]
+            weights = torch.as_tensor(
+                interpolation_weights(center, frame_shape, grid_shape),
+                dtype=otfs.dtype,
+                device=otfs.device,
+            )
+            patch_otfs.append(torch.tensordot(weights, otfs, dims=1))
+
+    units = [
+        (frame, patch)
+        for frame in np.ndindex(image.shape[: image.ndim - ndim])
+        for patch in range(len(patches))
+    ]
+    batch_size = max(1, batch_size)
+    groups = [
+        units[i : i + batch_size] for i in range(0, len(units), batch_size)
+    ]
+
+    def batches():
+        for group in groups:
+            yield (
+                np.stack(
+                    [
+                        image[frame + patches[patch][0]]
+                        for frame, patch in group
+                    ]
+                ),
+                torch.stack([patch_otfs[patch] for _, patch in group]),
+            )
+
+    out = np.zeros(image.shape, dtype=output_dtype(image, compute_type))
+    for i, (group, results) in enumerate(
+        zip(groups, executor.map(batch, batches(), params))
+    ):
+        with profile_stage("blending"):
+            for (frame, patch), result in zip(group, results):
+                slices, weights = patches[patch]
+                out[frame + slices] += (
+                    blend_weights(weights).astype(out.dtype) * result
+                )
+        for observer in observers or []:
+            observer.progress(int(100 * (i + 1) / len(groups)))
+    return out